@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Seed a throwaway DB with synthetic access_logs rows and time the audit
+lookups before and after the index migration.
+
+    python3 bench/bench_access_log_indexes.py --rows 2000000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import db  # noqa: E402
+
+QUERIES = [
+    ("user history (latest 50)",
+     "SELECT id, container_name, ts_start, ts_end FROM access_logs "
+     "WHERE username = ? ORDER BY ts_start DESC LIMIT 50",
+     lambda r: (f"user{r.randrange(USERS)}",)),
+    ("container window (30 days)",
+     "SELECT id, username, ts_start FROM access_logs "
+     "WHERE container_name = ? AND ts_start >= datetime('now', '-30 days') ORDER BY ts_start",
+     lambda r: (f"container{r.randrange(CONTAINERS)}",)),
+    ("open sessions",
+     "SELECT id, username, container_name FROM access_logs WHERE ts_end IS NULL ORDER BY ts_start",
+     lambda r: ()),
+    ("containers owned by user",
+     "SELECT container_name FROM containers WHERE owner_username = ?",
+     lambda r: (f"user{r.randrange(USERS)}",)),
+]
+
+USERS = 2000
+CONTAINERS = 5000
+
+
+def seed(rows: int, batch: int = 50000):
+    rnd = random.Random(42)
+    now = time.time()
+    span = 365 * 86400
+    conn = db.connection()
+
+    def gen(n):
+        for _ in range(n):
+            start = now - rnd.random() * span
+            # ~0.1% of sessions still open
+            end = None if rnd.random() < 0.001 else start + rnd.randrange(30, 4 * 3600)
+            yield (
+                f"user{rnd.randrange(USERS)}",
+                f"container{rnd.randrange(CONTAINERS)}",
+                time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(start)),
+                None if end is None else time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(end)),
+                "/var/log/secure-container-access/sessions/x.log",
+            )
+
+    done = 0
+    while done < rows:
+        n = min(batch, rows - done)
+        with db.transaction() as c:
+            c.executemany(
+                "INSERT INTO access_logs (username, container_name, ts_start, ts_end, typescript_path) "
+                "VALUES (?, ?, ?, ?, ?)",
+                gen(n),
+            )
+        done += n
+        print(f"\r  seeded {done}/{rows}", end="", flush=True)
+    print()
+    with db.transaction() as c:
+        c.executemany(
+            "INSERT INTO containers (container_name, owner_username) VALUES (?, ?)",
+            ((f"container{i}", f"user{rnd.randrange(USERS)}") for i in range(CONTAINERS)),
+        )
+    conn.execute("ANALYZE")
+
+
+def run_queries(label: str, iterations: int):
+    conn = db.connection()
+    print(f"\n[{label}]")
+    for name, sql, params in QUERIES:
+        plan = " / ".join(r["detail"] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, params(random)))
+        rnd = random.Random(7)
+        t0 = time.perf_counter()
+        for _ in range(iterations):
+            conn.execute(sql, params(rnd)).fetchall()
+        per = (time.perf_counter() - t0) / iterations * 1000
+        print(f"  {name:<28} {per:9.3f} ms/query   plan: {plan}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="access_logs index benchmark")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "bench.sqlite")
+        db.migrate(target=1)
+        print(f"Seeding {args.rows} access_logs rows into {db.DB_PATH}")
+        t0 = time.perf_counter()
+        seed(args.rows)
+        print(f"  {time.perf_counter() - t0:.1f}s")
+
+        run_queries("schema v1, no indexes", args.iterations)
+
+        t0 = time.perf_counter()
+        db.migrate()
+        db.connection().execute("ANALYZE")
+        print(f"\nApplied migrations up to v{db.SCHEMA_VERSION} in {time.perf_counter() - t0:.1f}s")
+
+        run_queries(f"schema v{db.SCHEMA_VERSION}, indexed", args.iterations)
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
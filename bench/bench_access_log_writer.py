@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Session start/end logging: one transaction per event vs the batched writer.
+
+--threads workers each log --sessions session starts and ends against a
+throwaway database, first with the old per-event INSERT/UPDATE commits,
+then through access_log.AccessLogWriter.
+
+    python3 bench/bench_access_log_writer.py --threads 32 --sessions 100
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import access_log  # noqa: E402
+import db  # noqa: E402
+
+
+def per_event(username):
+    with db.transaction() as conn:
+        c = conn.execute("INSERT INTO access_logs (username, container_name, typescript_path) VALUES (?, ?, ?)",
+                         (username, "c", "/dev/null"))
+    log_id = c.lastrowid
+    with db.transaction() as conn:
+        conn.execute("UPDATE access_logs SET ts_end = CURRENT_TIMESTAMP WHERE id = ?", (log_id,))
+
+
+def _run(label, threads, sessions, fn, after=None):
+    def worker(n):
+        for _ in range(sessions):
+            fn(f"user{n}")
+
+    t0 = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    extra = after() if after else ""
+    elapsed = time.perf_counter() - t0
+    events = threads * sessions * 2
+    print(f"  {label:<12} {events / elapsed:9.0f} events/s  {elapsed:6.2f}s{extra}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="access_logs writer benchmark")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--sessions", type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "bench.sqlite")
+        db.init_db()
+        print(f"{args.threads} threads x {args.sessions} sessions (start + end each)")
+        _run("per-event", args.threads, args.sessions, per_event)
+
+        writer = access_log.AccessLogWriter()
+
+        def batched(username):
+            log_id = writer.start_session(username, "c", "/dev/null").result()
+            writer.end_session(log_id)
+
+        def _drain():
+            writer.flush()
+            return f"  {writer.commits} commits for {writer.events} events"
+
+        _run("batched", args.threads, args.sessions, batched, after=_drain)
+        writer.close()
+
+
+if __name__ == "__main__":
+    main()
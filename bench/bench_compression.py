@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Record the same synthetic session without compression, with gzip and
+with zstd (if `zstandard` is installed) and compare size, recorder CPU and
+the time replay.py needs to seek into the middle of the recording.
+
+The input mimics a colourised build log: ANSI escapes, timestamps and
+many near-identical lines, written as ~4 KiB pty reads at 20 per second.
+
+    python3 bench/bench_compression.py --mb 50
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import recorder  # noqa: E402
+import replay  # noqa: E402
+
+READ_SIZE = 4096
+READS_PER_SECOND = 20
+
+
+def _build_log(total: int) -> bytes:
+    lines = []
+    size = i = 0
+    while size < total:
+        step = i % 118 + 1
+        line = (f"\x1b[2m2024-01-01T00:{i // 3600 % 60:02d}:{i // 60 % 60:02d}.{i % 1000:03d}Z\x1b[0m "
+                f"\x1b[32mINFO\x1b[0m [{step:3d}/118] compiling src/pkg{i % 37}/module_{i % 211}.c "
+                f"-O2 -Wall ... \x1b[1;32mok\x1b[0m ({i % 97} ms)\r\n").encode()
+        lines.append(line)
+        size += len(line)
+        i += 1
+    return b"".join(lines)[:total]
+
+
+def _record(path, data, compression):
+    w = recorder.CastWriter(path, compression=compression)
+    t0 = w.started
+    c0 = os.times()
+    for n, pos in enumerate(range(0, len(data), READ_SIZE)):
+        w.write_output(data[pos:pos + READ_SIZE], t0 + n / READS_PER_SECOND)
+    w.close()
+    c1 = os.times()
+    return w, (c1.user - c0.user) + (c1.system - c0.system)
+
+
+def _seek(path, at):
+    t0 = time.perf_counter()
+    with replay.Recording(path) as rec:
+        got = sum(len(d) for _, _, d in rec.events(at, at + 10))
+    return time.perf_counter() - t0, got
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Session recording compression benchmark")
+    parser.add_argument("--mb", type=int, default=50)
+    args = parser.parse_args()
+    data = _build_log(args.mb * 1_000_000)
+    middle = len(data) / READ_SIZE / READS_PER_SECOND / 2
+
+    codecs = [None, "gzip"] + (["zstd"] if recorder.zstandard is not None else [])
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Recording {args.mb} MB of build-log output; seek to {replay.format_time(middle)} and read 10s")
+        for compression in codecs:
+            path = os.path.join(tmp, "session.cast" + recorder.COMPRESSION_SUFFIX[compression])
+            w, cpu = _record(path, data, compression)
+            seek, got = _seek(path, middle)
+            print(f"  {compression or 'none':<5} {w.disk_bytes / 1e6:8.2f} MB on disk  "
+                  f"ratio {w.raw_bytes / w.disk_bytes:6.1f}x  {cpu:6.2f}s recorder cpu  "
+                  f"{seek * 1000:7.1f} ms seek+read ({got} bytes)")
+        if recorder.zstandard is None:
+            print("  (zstd skipped: 'zstandard' is not installed)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""Compare a fresh docker.from_env() per lookup against the shared pooled
+client, using a stand-in Docker API server on a temporary unix socket.
+
+The stand-in answers /_ping, /version and /containers/<name>/json and
+counts accepted connections and requests, so the saved round trips are
+visible without a real daemon.
+
+    python3 bench/bench_docker_client.py --iterations 500 --latency-ms 0.5
+"""
+
+import argparse
+import http.server
+import json
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import docker  # noqa: E402
+
+import docker_client  # noqa: E402
+
+API_VERSION = "1.43"
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    latency = 0.0
+    connections = 0
+    requests = 0
+    _lock = threading.Lock()
+
+    def get_request(self):
+        conn, _ = super().get_request()
+        with self._lock:
+            self.connections += 1
+        # BaseHTTPRequestHandler expects a (host, port) style client address
+        return conn, ("local", 0)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, body, ctype="application/json"):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Api-Version", API_VERSION)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        with self.server._lock:
+            self.server.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        path = self.path.split("?")[0]
+        if path.endswith("/_ping"):
+            return self._reply(b"OK", "text/plain")
+        if path.endswith("/version"):
+            return self._reply({"ApiVersion": API_VERSION, "Version": "stand-in"})
+        if "/containers/" in path and path.endswith("/json"):
+            name = path.split("/containers/")[1][:-len("/json")]
+            return self._reply({
+                "Id": "0" * 64,
+                "Name": f"/{name}",
+                "Image": "sha256:" + "1" * 64,
+                "Config": {"Image": "stand-in:latest", "Labels": {}},
+                "State": {"Status": "running", "Running": True},
+            })
+        self.send_error(404)
+
+    do_HEAD = do_GET
+
+
+def _run(label, server, iterations, lookup):
+    server.connections = server.requests = 0
+    t0 = time.perf_counter()
+    for i in range(iterations):
+        lookup(f"c{i % 10}")
+    elapsed = time.perf_counter() - t0
+    print(f"  {label:<34} {elapsed / iterations * 1000:8.3f} ms/lookup  "
+          f"{server.connections / iterations:5.2f} conns/lookup  "
+          f"{server.requests / iterations:5.2f} requests/lookup")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared Docker client benchmark")
+    parser.add_argument("--iterations", type=int, default=300)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated daemon latency per request")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sock = os.path.join(tmp, "docker.sock")
+        server = _Server(sock, _Handler)
+        server.latency = args.latency_ms / 1000
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        os.environ["DOCKER_HOST"] = f"unix://{sock}"
+
+        print(f"Stand-in daemon on {sock}, {args.iterations} container lookups")
+
+        def fresh_client(name):
+            # what enter.check_container_running and check_docker.check used to do
+            client = docker.from_env()
+            client.ping()
+            client.containers.get(name)
+            client.close()
+
+        def shared_client(name):
+            docker_client.ping()
+            docker_client.get_client().containers.get(name)
+
+        _run("docker.from_env() per lookup", server, args.iterations, fresh_client)
+        docker_client.reset()
+        _run("shared client (auto version)", server, args.iterations, shared_client)
+        docker_client.reset()
+        docker_client.DOCKER_API_VERSION = API_VERSION
+        _run("shared client (pinned version)", server, args.iterations, shared_client)
+        docker_client.reset()
+
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""Time from authorization to a working shell: script + docker CLI vs. the
+in-process Docker API exec (exec_session).
+
+Each run starts a session in a running container, types a command whose
+output cannot come from the terminal's echo (`echo $((6*7))READY`) and
+stops the clock when `42READY` comes back; then it exits the shell.
+
+- script+cli: `script -q <file> -c "docker exec -it <c> <shell>"` on a pty,
+  what enter.spawn_and_record ran for typescripts;
+- sdk (probe): exec_session with an empty shell cache, i.e. one probe exec
+  plus the session exec, as the first entry into an image;
+- sdk (cached): the session exec alone, shell read from the image_shells
+  table (a throwaway database here).
+
+    python3 bench/bench_exec.py mycontainer --runs 10
+"""
+
+import argparse
+import os
+import pty
+import select
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import db  # noqa: E402
+import docker_client  # noqa: E402
+import exec_session  # noqa: E402
+
+COMMAND = b"echo $((6*7))READY\r"
+MARKER = b"42READY"
+
+
+def _wait_for(fd: int, marker: bytes, seen: bytes = b"", timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while marker not in seen:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise RuntimeError(f"no {marker!r} within {timeout}s: {seen[-300:]!r}")
+        ready, _, _ = select.select([fd], [], [], left)
+        if not ready:
+            continue
+        try:
+            chunk = os.read(fd, 65536)
+        except BlockingIOError:
+            continue
+        except OSError:
+            chunk = b""
+        if not chunk:
+            raise RuntimeError(f"session ended before {marker!r}: {seen[-300:]!r}")
+        seen += chunk
+
+
+def script_cli(container: str, shell: str, tmp: str) -> float:
+    master, slave = pty.openpty()
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(["script", "-q", os.path.join(tmp, "session.log"), "-c",
+                             f"docker exec -it {container} {shell}"],
+                            stdin=slave, stdout=slave, stderr=slave, start_new_session=True)
+    os.close(slave)
+    try:
+        os.write(master, COMMAND)
+        _wait_for(master, MARKER)
+        elapsed = time.perf_counter() - t0
+        os.write(master, b"exit\r")
+        proc.wait(timeout=10)
+    finally:
+        if proc.poll() is None:
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.wait()
+        os.close(master)
+    return elapsed
+
+
+def sdk(container: str, cached: bool) -> float:
+    api = docker_client.get_client().api
+    # every entry is a new process: nothing in memory, maybe in the database
+    exec_session._shells.clear()
+    if not cached:
+        db.connection().execute("DELETE FROM image_shells")
+    t0 = time.perf_counter()
+    shell = exec_session.detect_shell(api, container)
+    if shell is None:
+        raise RuntimeError(f"no shell in {container}")
+    session = exec_session.ExecSession(api, container, [shell], environment={"TERM": "xterm"})
+    try:
+        fd = session.start(80, 24)
+        os.write(fd, COMMAND)
+        _wait_for(fd, MARKER, session.pending)
+        elapsed = time.perf_counter() - t0
+        os.write(fd, b"exit\r")
+    finally:
+        session.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time to shell: script + docker CLI vs. Docker API exec")
+    parser.add_argument("container", help="A running container to exec into")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--shell", default=None, help="Shell for the script path (default: what the probe finds)")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        # shell cache in a throwaway database
+        db.DB_PATH = os.path.join(tmp, "db.sqlite")
+        db.init_db()
+        # connect and negotiate the API version outside the timed runs, like the
+        # gatekeeper or an earlier check_container_running call would have
+        docker_client.ping()
+        shell = args.shell or exec_session.detect_shell(docker_client.get_client().api, args.container)
+        for label, fn in (
+            ("script+cli", lambda: script_cli(args.container, shell, tmp)),
+            ("sdk (probe)", lambda: sdk(args.container, cached=False)),
+            ("sdk (cached)", lambda: sdk(args.container, cached=True)),
+        ):
+            results[label] = [fn() * 1000 for _ in range(args.runs)]
+
+    base = statistics.median(results["script+cli"])
+    print(f"time to shell in {args.container} ({shell}), {args.runs} runs")
+    for label, times in results.items():
+        med = statistics.median(times)
+        print(f"  {label:<13} median {med:7.1f} ms  min {min(times):7.1f} ms  max {max(times):7.1f} ms"
+              f"  x{base / med:4.1f}")
+
+
+if __name__ == "__main__":
+    main()
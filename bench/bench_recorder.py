@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Pipe a large synthetic stream through the pty recorder and compare it
+with the old loop (4096-byte reads, write + flush per chunk).
+
+A forked child writes --mb megabytes of log-like text into the pty slave,
+the parent records it to a temporary typescript, terminal output goes to
+/dev/null.
+
+    python3 bench/bench_recorder.py --mb 200
+"""
+
+import argparse
+import os
+import pty
+import sys
+import tempfile
+import time
+import tty
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import recorder  # noqa: E402
+
+LINE = b"2024-01-01T00:00:00Z INFO build step 42/118: compiling module foo.bar.baz ... ok\n"
+
+
+def _spawn_writer(total: int):
+    master_fd, slave_fd = pty.openpty()
+    pid = os.fork()
+    if pid == 0:
+        os.close(master_fd)
+        tty.setraw(slave_fd)
+        chunk = LINE * (65536 // len(LINE))
+        left = total
+        while left > 0:
+            n = os.write(slave_fd, chunk[:left])
+            left -= n
+        os._exit(0)
+    os.close(slave_fd)
+    return pid, master_fd
+
+
+def legacy(master_fd, pid, path, out_fd):
+    chunks = 0
+    with open(path, "wb") as f:
+        while True:
+            try:
+                data = os.read(master_fd, 4096)
+            except OSError:
+                break
+            if not data:
+                break
+            chunks += 1
+            os.write(out_fd, data)
+            f.write(data)
+            f.flush()
+    os.waitpid(pid, 0)
+    # one terminal write and one file write per chunk
+    return chunks, chunks
+
+
+def buffered(master_fd, pid, path, out_fd):
+    null_in = os.open(os.devnull, os.O_RDONLY)
+    sink = recorder.TypescriptWriter(path)
+    try:
+        stats = recorder.relay(master_fd, sink, child_pid=pid, stdin_fd=null_in, stdout_fd=out_fd)
+    finally:
+        sink.close()
+        os.close(null_in)
+    return stats.output_batches, sink.flushes
+
+
+def _run(label, fn, total, tmp):
+    path = os.path.join(tmp, f"{label}.log")
+    out_fd = os.open(os.devnull, os.O_WRONLY)
+    pid, master_fd = _spawn_writer(total)
+    t0 = time.perf_counter()
+    c0 = os.times()
+    term_writes, file_writes = fn(master_fd, pid, path, out_fd)
+    elapsed = time.perf_counter() - t0
+    c1 = os.times()
+    os.close(master_fd)
+    os.close(out_fd)
+    size = os.path.getsize(path)
+    cpu = (c1.user - c0.user) + (c1.system - c0.system)
+    print(f"  {label:<10} {size / elapsed / 1e6:8.1f} MB/s  {elapsed:6.2f}s wall  "
+          f"{cpu:6.2f}s parent cpu  {term_writes:7d} tty writes  {file_writes:7d} file writes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pty recorder throughput benchmark")
+    parser.add_argument("--mb", type=int, default=100)
+    args = parser.parse_args()
+    total = args.mb * 1_000_000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Streaming {args.mb} MB through a pty")
+        _run("legacy", legacy, total, tmp)
+        _run("buffered", buffered, total, tmp)
+
+
+if __name__ == "__main__":
+    main()
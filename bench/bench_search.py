@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Time session searches against a large synthetic index.
+
+Fills a throwaway database with --sessions access_logs rows and
+--lines indexed terminal lines per session (a few rare commands mixed in),
+then compares session_index.search() with a LIKE scan over the same lines
+in a plain table, which is what grepping every recording amounts to.
+
+    python3 bench/bench_search.py --sessions 100000 --lines 40
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import db  # noqa: E402
+import session_index  # noqa: E402
+
+COMMANDS = ["ls -la", "cd /app", "cat config.yml", "git status", "make test", "tail -f log/app.log",
+            "ps aux", "vim main.py", "docker ps", "df -h", "top", "pip install -r requirements.txt"]
+OUTPUT = ["total 48", "drwxr-xr-x 2 root root 4096 Jan  1 00:00 src", "ok", "PASS tests/test_api.py",
+          "On branch main", "Filesystem Size Used Avail Use% Mounted on", "Collecting requests"]
+RARE = "rm -rf /var/lib/data"
+
+
+def _populate(sessions, lines):
+    rnd = random.Random(42)
+    with db.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO access_logs (id, username, container_name, ts_start, ts_end, typescript_path) "
+            "VALUES (?, ?, ?, datetime('2024-01-01', ? || ' minutes'), CURRENT_TIMESTAMP, ?)",
+            [(i, f"user{i % 500}", f"c{i % 300}", i, f"/sessions/{i}.cast.gz") for i in range(1, sessions + 1)],
+        )
+        conn.execute("CREATE TABLE plain_text (log_id INTEGER, offset_ms INTEGER, text TEXT)")
+    for start in range(1, sessions + 1, 2000):
+        rows = []
+        for log_id in range(start, min(start + 2000, sessions + 1)):
+            for n in range(lines):
+                if n % 2 == 0:
+                    cmd = RARE if rnd.random() < 0.0005 else rnd.choice(COMMANDS)
+                    text = f"root@c{log_id % 300}:/app# {cmd}"
+                else:
+                    cmd, text = "", rnd.choice(OUTPUT)
+                rows.append((session_index._rowid(log_id, n), cmd, text, n * 1500))
+        with db.transaction() as conn:
+            conn.executemany("INSERT INTO session_text (rowid, command, text, offset_ms) VALUES (?, ?, ?, ?)", rows)
+            conn.executemany("INSERT INTO plain_text VALUES (? >> 24, ?, ?)",
+                             [(r[0], r[3], r[2]) for r in rows])
+
+
+def _time(label, fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        n = len(fn())
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"  {label:<44} {best * 1000:9.1f} ms  {n:5d} hits")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Session full-text search benchmark")
+    parser.add_argument("--sessions", type=int, default=20000)
+    parser.add_argument("--lines", type=int, default=40)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "bench.sqlite")
+        db.init_db()
+        session_index.ensure_table(db.connection())
+        t0 = time.perf_counter()
+        _populate(args.sessions, args.lines)
+        print(f"{args.sessions} sessions x {args.lines} lines indexed in {time.perf_counter() - t0:.1f}s, "
+              f"db {os.path.getsize(db.DB_PATH) / 1e6:.0f} MB")
+
+        conn = db.connection()
+        _time("LIKE scan (grep equivalent)", lambda: conn.execute(
+            "SELECT log_id, offset_ms FROM plain_text WHERE text LIKE ? LIMIT 50", (f"%{RARE}%",)).fetchall())
+        _time("FTS phrase", lambda: session_index.search(session_index.phrase(RARE)))
+        _time("FTS phrase, commands only", lambda: session_index.search(
+            session_index.phrase(RARE), commands_only=True))
+        _time("FTS phrase, one container", lambda: session_index.search(
+            session_index.phrase("make test"), container="c7"))
+        _time("FTS common term, newest 50", lambda: session_index.search(session_index.phrase("ls")))
+
+
+if __name__ == "__main__":
+    main()
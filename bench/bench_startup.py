@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""Startup cost of the CLI entry points: time to the first prompt.
+
+Each entry point runs on a pty against a throwaway database, --runs times,
+under `python -X importtime`. We measure the wall time from launch until
+its first prompt appears (or until it exits, for commands without one) and
+which modules it imported on the way (interpreter startup excluded).
+
+    python3 bench/bench_startup.py --save    # record this host's baseline
+    python3 bench/bench_startup.py           # compare; exits 1 on regression
+
+A regression is either:
+- a median time to prompt more than --tolerance (plus --slack-ms for noise)
+  above the saved baseline;
+- an entry point importing one of its DEFERRED modules before the prompt.
+  This is checked even without a baseline, since it does not depend on the host.
+"""
+
+import argparse
+import json
+import os
+import pty
+import select
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SRC = os.path.join(ROOT, "src")
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_baseline.json")
+
+# only needed once a session, a Docker call or a bcrypt hash actually happens
+DEFERRED = {"docker", "requests", "urllib3", "multiprocessing", "concurrent.futures"}
+
+# (label, argv relative to the repo, first prompt or None = run to exit,
+#  modules that must not be imported by then, whether it opens the database)
+ENTRY_POINTS = [
+    ("enter", ["src/enter.py", "web"], b"Username:", DEFERRED | {"bcrypt"}, True),
+    ("admin add", ["src/admin.py", "add"], b"Admin username:", DEFERRED, True),
+    ("admin list", ["src/admin.py", "list"], None, DEFERRED, True),
+    ("user add", ["src/user.py", "add"], b"User username:", DEFERRED, True),
+    ("gatekeeper_client", ["src/gatekeeper_client.py", "web"], None, DEFERRED | {"sqlite3", "bcrypt"}, False),
+]
+
+_LAUNCHER = """import runpy, sys
+sys.argv = {argv!r}
+sys.path.insert(0, {src!r})
+if {uses_db!r}:
+    import db
+    db.DB_PATH = {db!r}
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+
+def _imports(output: str) -> tuple[dict, set]:
+    """From -X importtime output: top-level module -> cumulative time (us),
+    and the names of all modules imported, nested ones included."""
+    top, names = {}, set()
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        names.add(name.strip())
+        if not name.startswith("  "):
+            top[name.strip()] = int(cumulative)
+    return top, names
+
+
+def _run_once(argv: list, prompt: bytes | None, env: dict, timeout: float = 30) -> tuple[float, str]:
+    """(seconds until prompt or exit, terminal output up to then).
+
+    stderr goes to the pty as well: input() writes its prompt there when
+    readline is not loaded, and -X importtime reports there too.
+    """
+    master, slave = pty.openpty()
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(argv, stdin=slave, stdout=slave, stderr=slave, env=env,
+                            cwd=ROOT, start_new_session=True)
+    os.close(slave)
+    seen = b""
+    elapsed = None
+    deadline = t0 + timeout
+    try:
+        while time.perf_counter() < deadline:
+            ready, _, _ = select.select([master], [], [], 0.05)
+            if ready:
+                try:
+                    chunk = os.read(master, 65536)
+                except OSError:
+                    # EIO: the child exited and closed the pty
+                    chunk = b""
+                seen += chunk
+                if prompt is not None and prompt in seen:
+                    elapsed = time.perf_counter() - t0
+                    break
+                if not chunk:
+                    break
+            elif proc.poll() is not None:
+                break
+        if elapsed is None:
+            if prompt is not None:
+                raise RuntimeError(f"no {prompt!r} prompt from {argv}: {seen[-500:]!r}")
+            proc.wait()
+            elapsed = time.perf_counter() - t0
+    finally:
+        if proc.poll() is None:
+            os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+        os.close(master)
+    return elapsed, seen.decode(errors="replace").replace("\r", "")
+
+
+def measure(runs: int) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, SCAM_GATEKEEPER_SOCKET=os.path.join(tmp, "none.sock"))
+        base_cmd = [sys.executable, "-X", "importtime", "-c", "pass"]
+        times, output = [], ""
+        for _ in range(runs):
+            elapsed, output = _run_once(base_cmd, None, env)
+            times.append(elapsed)
+        startup = _imports(output)[1]
+        results["interpreter"] = {"ms": statistics.median(times) * 1000, "imports_ms": 0.0, "modules": 0,
+                                  "deferred": []}
+
+        for label, argv, prompt, deferred, uses_db in ENTRY_POINTS:
+            code = _LAUNCHER.format(argv=argv, src=SRC, uses_db=uses_db, db=os.path.join(tmp, "db.sqlite"))
+            cmd = [sys.executable, "-X", "importtime", "-c", code]
+            times, import_ms, modules = [], [], set()
+            for _ in range(runs):
+                elapsed, output = _run_once(cmd, prompt, env)
+                top, names = _imports(output)
+                times.append(elapsed)
+                import_ms.append(sum(us for name, us in top.items() if name not in startup) / 1000)
+                modules = names - startup
+            results[label] = {
+                "ms": statistics.median(times) * 1000,
+                "imports_ms": statistics.median(import_ms),
+                "modules": len(modules),
+                "deferred": sorted(modules & deferred),
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CLI startup benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--baseline", default=BASELINE, help="Baseline JSON (host specific)")
+    parser.add_argument("--save", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown vs baseline (fraction)")
+    parser.add_argument("--slack-ms", type=float, default=5.0, help="Absolute noise allowance")
+    args = parser.parse_args()
+
+    results = measure(args.runs)
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+
+    failed = False
+    print(f"median of {args.runs} runs, time until the first prompt (or exit)")
+    for label, r in results.items():
+        line = f"  {label:<18} {r['ms']:7.1f} ms  imports {r['imports_ms']:6.1f} ms  {r['modules']:3d} modules"
+        base = baseline.get(label)
+        if base is not None:
+            limit = base["ms"] * (1 + args.tolerance) + args.slack_ms
+            line += f"  baseline {base['ms']:7.1f} ms"
+            if label != "interpreter" and r["ms"] > limit:
+                line += "  REGRESSION"
+                failed = True
+        if r["deferred"]:
+            line += f"  imports {', '.join(r['deferred'])} before the prompt"
+            failed = True
+        print(line)
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+    elif not baseline:
+        print(f"no baseline at {args.baseline}; run with --save to record one")
+    sys.exit(1 if failed and not args.save else 0)
+
+
+if __name__ == "__main__":
+    main()
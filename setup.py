@@ -1,7 +1,17 @@
+from __future__ import annotations
+
+import argparse
 import os 
 import sys
 import getpass
+import hashlib
+import importlib
+import shutil
+import stat
 import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 def _ensure_src_on_path():
     here = os.path.dirname(os.path.abspath(__file__)) #take current path
@@ -59,258 +69,327 @@ def _run_sudo(cmd, *, input_bytes=None) -> tuple[int, str]:
     return p.returncode, stderr or stdout
 
 
-def lock_docker_systemwide() -> bool:
-    """
-    Lock Docker so normal users cannot access /var/run/docker.sock.
-    
-    How it works (systemd drop-in approach):
-    1. Creates /etc/systemd/system/docker.service.d/scam-lock.conf
-    2. Adds ExecStartPost hooks to force root-only socket permissions
-    3. Reloads systemd and restarts docker
-    
-    Why this is needed:
-    - Prevents users from bypassing the wrapper with direct 'docker exec'
-    - Enforces that all container access goes through this gatekeeper
-    
-    Security note:
-    - This does NOT protect against root users
-    - Requires removing developers from 'docker' group
-    - Requires sudoers policy restricting 'docker' command
-    
-    Returns True if successful or if Docker is not managed by systemd.
-    """
-    print("\n" + "=" * 60)
-    print("DOCKER LOCK SETUP")
-    print("=" * 60)
-    
-    # First, check if docker.service exists
-    rc, _ = _run_sudo(["sudo", "systemctl", "list-units", "--type=service", "--all"])
-    
-    # Try to find docker service name
-    docker_service = None
-    for service_name in ["docker.service", "docker", "snap.docker.dockerd.service"]:
-        rc, output = _run_sudo(["sudo", "systemctl", "status", service_name])
-        if rc == 0 or "could not be found" not in output.lower():
-            docker_service = service_name
-            print(f"Found Docker service: {docker_service}")
-            break
-    
-    if not docker_service:
-        print("⚠ Docker service not found in systemd.")
-        print("This is normal for:")
-        print("  - Docker Desktop on WSL2")
-        print("  - Docker installed without systemd integration")
-        print("")
-        print("⚠ WARNING: Cannot lock docker.sock via systemd.")
-        print("Will attempt manual socket permission lock instead...")
-        
-        # Try to lock the socket directly
-        if os.path.exists("/var/run/docker.sock"):
-            print("Locking /var/run/docker.sock to root-only (0600)...")
-            rc, msg = _run_sudo(["sudo", "chmod", "0600", "/var/run/docker.sock"])
-            if rc != 0:
-                print(f"✗ Failed to lock socket: {msg}")
-                print("⚠ Continuing anyway - manual intervention may be required.")
-                return True  # Don't fail setup
-            
-            rc, msg = _run_sudo(["sudo", "chown", "root:root", "/var/run/docker.sock"])
-            if rc != 0:
-                print(f"✗ Failed to change socket ownership: {msg}")
-            
-            rc, output = _run_sudo(["sudo", "ls", "-l", "/var/run/docker.sock"])
-            print(f"\nDocker socket permissions:\n{output}")
-            print("\n⚠ Socket locked manually (will reset on Docker restart)")
-            print("Consider using a proper Docker installation with systemd.")
-            return True
-        else:
-            print("✗ /var/run/docker.sock not found.")
-            print("⚠ Continuing anyway - Docker access control may not work.")
-            return True
-    
-    # Proceed with systemd-based locking
-    dropin_dir = f"/etc/systemd/system/{docker_service}.d"
-    dropin_path = f"{dropin_dir}/scam-lock.conf"
-    dropin_content = """[Service]
+# ---- provisioning engine --------------------------------------------------
+#
+# First-time setup used to run one sudo subprocess per user and per probe.
+# Now it reads the account databases once, computes every change up front
+# (plan_provisioning), and applies them in bulk (apply_plan). Steps that
+# touch different things run at the same time. `setup.py --dry-run` prints
+# the plan without changing anything.
+#
+# Planning is a diff against the desired state: directory modes, the
+# drop-in's contents, the sudoers file's hash and mode, and group members
+# are inspected in-process, and only what differs becomes a step. Running
+# it again on a configured host plans nothing (`setup.py --reconcile`),
+# so Docker is restarted only when its drop-in actually changes.
+
+DOCKER_SERVICES = ["docker.service", "snap.docker.dockerd.service"]
+DOCKER_SOCKET = "/var/run/docker.sock"
+DOCKER_DROPIN_NAME = "scam-lock.conf"
+DOCKER_DROPIN = """[Service]
 # Force Docker socket to be root-only (Option 2A: gatekeeper enforcement)
 ExecStartPost=/bin/chown root:root /var/run/docker.sock
 ExecStartPost=/bin/chmod 0600 /var/run/docker.sock
 """
+SUDOERS_FILE = "/etc/sudoers.d/scam"
+DEVELOPERS_GROUP = "developers"
+# Regular users: UID >= this, except nobody
+MIN_REGULAR_UID = 1000
+# Longest member list passed to one `gpasswd -M` (Linux caps a single
+# argument at 128 KiB); larger groups are changed one member at a time.
+GPASSWD_MAX_ARG = 100_000
+
+
+class Step:
+    """One provisioning change.
+
+    details: what will be done, for the plan. action(log) makes the change,
+    appends what happened to log and returns True on success. Steps with
+    the same lane run one after another (e.g. everything that edits
+    /etc/group, which gpasswd locks); different lanes run concurrently.
+    """
 
-    print(f"Locking /var/run/docker.sock to root-only (0600) via {docker_service}...")
-    print()
+    def __init__(self, title, details, action, lane):
+        self.title = title
+        self.details = details
+        self.action = action
+        self.lane = lane
+        self.log = []
+        self.ok = None
+        self.seconds = 0.0
+
+    def run(self) -> bool:
+        t0 = time.perf_counter()
+        try:
+            self.ok = bool(self.action(self.log))
+        except Exception as e:
+            self.log.append(f"✗ {e}")
+            self.ok = False
+        self.seconds = time.perf_counter() - t0
+        return self.ok
+
+
+def _run(cmd) -> tuple[int, str, str]:
+    """Unprivileged probe (getent, systemctl show) used while planning.
+
+    Returns (returncode, stdout, stderr) kept apart: unlike _run_sudo, a
+    warning on stderr must never be parsed as the probe's output.
+    """
+    try:
+        p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
+    except FileNotFoundError:
+        return 127, "", f"{cmd[0]} not found"
+    return p.returncode, p.stdout.decode(errors="ignore"), p.stderr.decode(errors="ignore").strip()
 
-    # Create drop-in directory
-    rc, msg = _run_sudo(["sudo", "mkdir", "-p", dropin_dir])
-    if rc != 0:
-        print(f"Failed to create {dropin_dir}: {msg}")
-        return False
 
-    # Write drop-in config
-    rc, msg = _run_sudo(["sudo", "tee", dropin_path], input_bytes=dropin_content.encode())
-    if rc != 0:
-        print(f"Failed to write {dropin_path}: {msg}")
-        return False
+def _parse_getent_groups(output: str) -> dict:
+    """name -> member list from `getent group` lines (name:x:gid:a,b,c)."""
+    groups = {}
+    for line in output.splitlines():
+        parts = line.split(":")
+        if len(parts) >= 4:
+            groups[parts[0]] = [u for u in parts[3].strip().split(",") if u]
+    return groups
 
-    print(f"✓ Created {dropin_path}")
 
-    # Reload systemd
-    rc, msg = _run_sudo(["sudo", "systemctl", "daemon-reload"])
-    if rc != 0:
-        print(f"Failed to reload systemd: {msg}")
-        return False
+def _parse_regular_users(output: str) -> list:
+    users = []
+    for line in output.splitlines():
+        parts = line.split(":")
+        if len(parts) >= 3 and parts[2].isdigit():
+            if int(parts[2]) >= MIN_REGULAR_UID and parts[0] != "nobody":
+                users.append(parts[0])
+    return users
+
 
-    print("✓ Reloaded systemd")
+def read_accounts() -> tuple[dict, list]:
+    """({group: members} for docker/developers, regular users) from one read each.
 
-    # Restart docker
-    print(f"Restarting {docker_service}...")
-    rc, msg = _run_sudo(["sudo", "systemctl", "restart", docker_service])
+    `getent passwd` is the slow one with a large directory behind NSS; both
+    run at the same time.
+    """
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        groups = pool.submit(_run, ["getent", "group", "docker", DEVELOPERS_GROUP])
+        passwd = pool.submit(_run, ["getent", "passwd"])
+        # getent exits 2 when one of the keys is missing; the other still prints
+        _, group_out, _ = groups.result()
+        rc, passwd_out, passwd_err = passwd.result()
     if rc != 0:
-        print(f"⚠ Failed to restart {docker_service}: {msg}")
-        print("Attempting to apply permissions manually...")
-        rc, msg = _run_sudo(["sudo", "chmod", "0600", "/var/run/docker.sock"])
-        rc, msg = _run_sudo(["sudo", "chown", "root:root", "/var/run/docker.sock"])
+        raise RuntimeError(f"getent passwd failed: {passwd_err or passwd_out.strip()}")
+    return _parse_getent_groups(group_out), _parse_regular_users(passwd_out)
 
-    print(f"✓ {docker_service} configuration updated")
 
-    # Verify socket permissions
-    rc, output = _run_sudo(["sudo", "ls", "-l", "/var/run/docker.sock"])
-    print(f"\nDocker socket permissions:\n{output}")
+def find_docker_service() -> str | None:
+    """First of DOCKER_SERVICES systemd knows about, from one `systemctl show`."""
+    if not shutil.which("systemctl"):
+        return None
+    rc, output, _ = _run(["systemctl", "show", "-p", "Id", "-p", "LoadState", *DOCKER_SERVICES])
+    if rc != 0:
+        return None
+    for block in output.split("\n\n"):
+        props = dict(line.split("=", 1) for line in block.splitlines() if "=" in line)
+        if props.get("LoadState") == "loaded":
+            return props.get("Id")
+    return None
 
-    print("\n" + "=" * 60)
-    print("DOCKER LOCKED SUCCESSFULLY")
-    print("=" * 60)
-    print("Normal users can no longer run 'docker' commands directly.")
-    print("All container access must go through: sudo python setup.py")
-    print("=" * 60 + "\n")
-    
-    return True
 
+def _summarize(users, limit=8) -> str:
+    shown = ", ".join(users[:limit])
+    return shown + (f", ... (+{len(users) - limit})" if len(users) > limit else "")
 
-def remove_users_from_docker_group() -> bool:
-    """
-    Automatically remove all non-root users from the docker group.
-    This prevents them from bypassing the wrapper.
-    """
-    print("\n" + "=" * 60)
-    print("REMOVING USERS FROM DOCKER GROUP")
-    print("=" * 60)
-    
-    # Get list of users in docker group
-    rc, output = _run_sudo(["sudo", "getent", "group", "docker"])
-    if rc != 0:
-        print("Could not find docker group. Skipping.")
-        return True
-    
-    # Parse: docker:x:999:user1,user2,user3
-    parts = output.split(":")
-    if len(parts) < 4 or not parts[3].strip():
-        print("No users in docker group. Nothing to do.")
-        return True
-    
-    users_in_docker = [u.strip() for u in parts[3].split(",") if u.strip()]
-    
-    if not users_in_docker:
-        print("No users in docker group. Nothing to do.")
+
+def _set_group_members(group, members, current, log) -> bool:
+    """Make members the exact member list of group, in one command if it fits."""
+    joined = ",".join(members)
+    if len(joined) <= GPASSWD_MAX_ARG:
+        rc, msg = _run_sudo(["sudo", "gpasswd", "-M", joined, group])
+        if rc != 0:
+            log.append(f"✗ gpasswd -M {group}: {msg}")
+            return False
+        log.append(f"✓ {group}: {len(members)} member(s) set")
         return True
-    
-    print(f"Found {len(users_in_docker)} user(s) in docker group: {', '.join(users_in_docker)}")
-    
-    # Remove each user
+    # too long for one argument: per member (sequential, gpasswd locks /etc/group)
+    wanted, have = set(members), set(current)
     failed = []
-    for user in users_in_docker:
-        print(f"Removing {user} from docker group...")
-        rc, msg = _run_sudo(["sudo", "gpasswd", "-d", user, "docker"])
-        if rc != 0:
-            print(f"  ✗ Failed: {msg}")
+    for user in sorted(wanted - have):
+        if _run_sudo(["sudo", "gpasswd", "-a", user, group])[0] != 0:
+            failed.append(user)
+    for user in sorted(have - wanted):
+        if _run_sudo(["sudo", "gpasswd", "-d", user, group])[0] != 0:
             failed.append(user)
-        else:
-            print(f"  ✓ Removed {user}")
-    
     if failed:
-        print(f"\n✗ Failed to remove: {', '.join(failed)}")
+        log.append(f"✗ {group}: failed for {_summarize(failed)}")
         return False
-    
-    print("\n✓ All users removed from docker group")
-    print("Note: Users must log out and back in for this to take effect.")
-    print("=" * 60 + "\n")
+    log.append(f"✓ {group}: {len(wanted - have)} added, {len(have - wanted)} removed")
     return True
 
 
-def setup_developers_group() -> bool:
-    """
-    Automatically create developers group and add all non-root users to it.
-    """
-    print("\n" + "=" * 60)
-    print("SETTING UP DEVELOPERS GROUP")
-    print("=" * 60)
-    
-    # Check if developers group exists
-    rc, _ = _run_sudo(["sudo", "getent", "group", "developers"])
-    if rc == 0:
-        print("Group 'developers' already exists.")
-    else:
-        print("Creating 'developers' group...")
-        rc, msg = _run_sudo(["sudo", "groupadd", "developers"])
-        if rc != 0:
-            print(f"✗ Failed to create group: {msg}")
-            return False
-        print("✓ Created 'developers' group")
-    
-    # Get all regular users (UID >= 1000, excluding nobody)
-    rc, output = _run_sudo(["sudo", "getent", "passwd"])
-    if rc != 0:
-        print("Failed to get user list")
-        return False
-    
-    regular_users = []
-    for line in output.split("\n"):
-        if not line.strip():
-            continue
-        parts = line.split(":")
-        if len(parts) >= 3:
-            username = parts[0]
-            uid = int(parts[2])
-            # Regular users typically have UID >= 1000
-            if uid >= 1000 and username != "nobody":
-                regular_users.append(username)
-    
-    if not regular_users:
-        print("No regular users found to add to developers group.")
-        return True
-    
-    print(f"\nAdding {len(regular_users)} user(s) to developers group...")
-    
-    failed = []
-    for user in regular_users:
-        print(f"Adding {user}...")
-        rc, msg = _run_sudo(["sudo", "usermod", "-aG", "developers", user])
-        if rc != 0:
-            print(f"  ✗ Failed: {msg}")
-            failed.append(user)
-        else:
-            print(f"  ✓ Added {user}")
-    
-    if failed:
-        print(f"\n✗ Failed to add: {', '.join(failed)}")
+def _read_file(path: str):
+    """Contents of path, None if missing, False if we may not read it."""
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+    except PermissionError:
         return False
-    
-    print("\n✓ All users added to developers group")
-    print("Note: Users must log out and back in for this to take effect.")
-    print("=" * 60 + "\n")
+
+
+def _digest(data) -> str:
+    if data is None:
+        return "missing"
+    if data is False:
+        return "unreadable"
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def _socket_locked() -> bool | None:
+    """True if the Docker socket is root:root 0600, None if there is no socket."""
+    try:
+        st = os.stat(DOCKER_SOCKET)
+    except OSError:
+        return None
+    return stat.S_IMODE(st.st_mode) == 0o600 and st.st_uid == 0 and st.st_gid == 0
+
+
+def _lock_socket(log) -> bool:
+    rc, msg = _run_sudo(["sudo", "chmod", "0600", DOCKER_SOCKET])
+    if rc != 0:
+        log.append(f"✗ Failed to lock socket: {msg} (manual intervention may be required)")
+        return True  # Don't fail setup
+    rc, msg = _run_sudo(["sudo", "chown", "root:root", DOCKER_SOCKET])
+    if rc != 0:
+        log.append(f"✗ Failed to change socket ownership: {msg}")
+    log.append(f"✓ {DOCKER_SOCKET} set to root:root 0600")
     return True
 
 
-def setup_sudoers_automated() -> bool:
+def plan_docker_lock(service) -> Step | None:
     """
-    Automatically create sudoers configuration.
-    This writes /etc/sudoers.d/scam with proper permissions and validation.
+    Lock Docker so normal users cannot access /var/run/docker.sock.
+
+    How it works (systemd drop-in approach):
+    1. Creates /etc/systemd/system/docker.service.d/scam-lock.conf
+    2. Adds ExecStartPost hooks to force root-only socket permissions
+    3. Reloads systemd and restarts docker
+
+    Why this is needed:
+    - Prevents users from bypassing the wrapper with direct 'docker exec'
+    - Enforces that all container access goes through this gatekeeper
+
+    Security note:
+    - This does NOT protect against root users
+    - Requires removing developers from 'docker' group
+    - Requires sudoers policy restricting 'docker' command
+
+    Docker is only restarted when the drop-in is missing or different; a
+    socket that merely lost its permissions is fixed in place. Without a
+    systemd unit (Docker Desktop on WSL2, manual installs) the socket is
+    locked directly, which lasts until Docker restarts. Never fails setup.
+    None when there is nothing to change.
     """
+    locked = _socket_locked()
+    if service is None:
+        # no socket either: Docker isn't installed yet (check_docker says so)
+        if locked is None or locked:
+            return None
+
+        def lock_socket(log):
+            log.append("⚠ Docker service not found in systemd; locking the socket directly.")
+            _lock_socket(log)
+            log.append("⚠ Socket locked manually (will reset on Docker restart)")
+            return True
+
+        return Step("Lock Docker socket", [f"chmod 0600 + chown root:root {DOCKER_SOCKET} (no systemd unit)"],
+                    lock_socket, "docker")
+
+    dropin_dir = f"/etc/systemd/system/{service}.d"
+    dropin_path = f"{dropin_dir}/{DOCKER_DROPIN_NAME}"
+    current = _read_file(dropin_path)
+    if current == DOCKER_DROPIN.encode():
+        if locked is False:
+            return Step("Lock Docker socket",
+                        [f"{dropin_path} up to date", f"chmod 0600 + chown root:root {DOCKER_SOCKET} (no restart)"],
+                        _lock_socket, "docker")
+        return None
+
+    def lock(log):
+        for cmd, data, what in (
+            (["sudo", "mkdir", "-p", dropin_dir], None, f"create {dropin_dir}"),
+            (["sudo", "tee", dropin_path], DOCKER_DROPIN.encode(), f"write {dropin_path}"),
+            (["sudo", "systemctl", "daemon-reload"], None, "reload systemd"),
+        ):
+            rc, msg = _run_sudo(cmd, input_bytes=data)
+            if rc != 0:
+                log.append(f"✗ Failed to {what}: {msg}")
+                return False
+        log.append(f"✓ Wrote {dropin_path}")
+        rc, msg = _run_sudo(["sudo", "systemctl", "restart", service])
+        if rc != 0:
+            log.append(f"⚠ Failed to restart {service}: {msg}; applying permissions manually")
+            _run_sudo(["sudo", "chmod", "0600", DOCKER_SOCKET])
+            _run_sudo(["sudo", "chown", "root:root", DOCKER_SOCKET])
+        try:
+            st = os.stat(DOCKER_SOCKET)
+            log.append(f"✓ {DOCKER_SOCKET}: mode {oct(st.st_mode & 0o777)}, uid {st.st_uid}, gid {st.st_gid}")
+        except OSError as e:
+            log.append(f"⚠ {DOCKER_SOCKET}: {e.strerror}")
+        return True
+
+    state = "missing" if current is None else "differs"
+    return Step("Lock Docker socket",
+                [f"write {dropin_path} ({state})", "systemctl daemon-reload", f"systemctl restart {service}"],
+                lock, "docker")
+
+
+def plan_docker_group(groups) -> Step | None:
+    """Remove every member from the docker group so nobody can bypass the wrapper."""
+    members = groups.get("docker")
+    if not members:
+        return None
+
+    def clear(log):
+        return _set_group_members("docker", [], members, log)
+
+    return Step("Remove users from docker group",
+                [f"remove {len(members)} user(s): {_summarize(members)}", "gpasswd -M '' docker"],
+                clear, "groups")
+
+
+def plan_developers_group(groups, regular_users) -> Step | None:
+    """Create the developers group if needed and add all regular users to it."""
+    current = groups.get(DEVELOPERS_GROUP)
+    have = current or []
+    target = sorted(set(have) | set(regular_users))
+    missing = [u for u in target if u not in set(have)]
+    if current is not None and not missing:
+        return None
+    details = []
+    if current is None:
+        details.append(f"groupadd {DEVELOPERS_GROUP}")
+    if missing:
+        details.append(f"add {len(missing)} user(s): {_summarize(missing)}")
+        details.append(f"gpasswd -M <{len(target)} members> {DEVELOPERS_GROUP}")
+
+    def apply(log):
+        if current is None:
+            rc, msg = _run_sudo(["sudo", "groupadd", DEVELOPERS_GROUP])
+            if rc != 0:
+                log.append(f"✗ Failed to create group: {msg}")
+                return False
+            log.append(f"✓ Created '{DEVELOPERS_GROUP}' group")
+        if not missing:
+            return True
+        return _set_group_members(DEVELOPERS_GROUP, target, have, log)
+
+    return Step(f"Set up {DEVELOPERS_GROUP} group", details, apply, "groups")
+
+
+def sudoers_policy() -> str:
     # Get absolute path to this script
     script_path = os.path.abspath(__file__)
     python_path = sys.executable
-    
-    sudoers_file = "/etc/sudoers.d/scam"
-    sudoers_content = f"""# Secure Container Access Manager - Gatekeeper Policy
+    return f"""# Secure Container Access Manager - Gatekeeper Policy
 # Created automatically by setup.py
 
 # Allow developers to run ONLY the wrapper, not docker directly
@@ -321,88 +400,167 @@ def setup_sudoers_automated() -> bool:
 %developers ALL=(ALL) !/usr/bin/docker, !/usr/bin/docker-compose
 """
 
-    print("\n" + "=" * 60)
-    print("SUDOERS CONFIGURATION (Automated)")
-    print("=" * 60)
-    print(f"Creating: {sudoers_file}")
-    print(f"Script path: {script_path}")
-    print(f"Python path: {python_path}")
-    print()
-    
-    # Write sudoers file with strict permissions
-    rc, msg = _run_sudo(
-        ["sudo", "tee", sudoers_file],
-        input_bytes=sudoers_content.encode()
-    )
-    if rc != 0:
-        print(f"Failed to write {sudoers_file}: {msg}")
-        return False
-    
-    # Set proper permissions (0440 is standard for sudoers files)
-    rc, msg = _run_sudo(["sudo", "chmod", "0440", sudoers_file])
-    if rc != 0:
-        print(f"Failed to set permissions on {sudoers_file}: {msg}")
-        return False
-    
-    print(f"✓ Created {sudoers_file}")
-    
-    # Validate using visudo
-    print("Validating sudoers syntax...")
-    rc, msg = _run_sudo(["sudo", "visudo", "-c", "-f", sudoers_file])
-    if rc != 0:
-        print(f"✗ Syntax validation failed: {msg}")
-        print("Removing invalid sudoers file...")
-        _run_sudo(["sudo", "rm", "-f", sudoers_file])
-        return False
-    
-    print("✓ Sudoers syntax validated")
-    
-    print("\n" + "=" * 60)
-    print("SUDOERS CONFIGURED SUCCESSFULLY")
-    print("=" * 60)
-    print("Developers in the 'developers' group can now run:")
-    print(f"  sudo {python_path} {script_path}")
-    print("=" * 60 + "\n")
-    
-    return True
-    
-def create_system_directories() -> bool:
+
+def plan_sudoers() -> Step | None:
     """
-    Create required system directories with proper permissions.
-    Must be called with sudo privileges.
+    Write /etc/sudoers.d/scam with proper permissions and validate it
+    with visudo; an invalid file is removed again. Compared by hash and
+    mode first, so an up-to-date policy is left alone.
     """
-    directories = [
-        ("/var/lib/secure-container-access", 0o755),
-        ("/var/log/secure-container-access/sessions", 0o750),
-    ]
-    
-    print("\n" + "=" * 60)
-    print("CREATING SYSTEM DIRECTORIES")
-    print("=" * 60)
-    
-    for dir_path, mode in directories:
-        print(f"Creating {dir_path}...")
-        rc, msg = _run_sudo(["sudo", "mkdir", "-p", dir_path])
+    content = sudoers_policy().encode()
+    current = _read_file(SUDOERS_FILE)
+    if current == content:
+        if stat.S_IMODE(os.stat(SUDOERS_FILE).st_mode) == 0o440:
+            return None
+
+        def fix_mode(log):
+            rc, msg = _run_sudo(["sudo", "chmod", "0440", SUDOERS_FILE])
+            if rc != 0:
+                log.append(f"✗ Failed to set permissions on {SUDOERS_FILE}: {msg}")
+                return False
+            log.append(f"✓ {SUDOERS_FILE} set to 0440")
+            return True
+
+        return Step("Configure sudoers policy", [f"chmod 0440 {SUDOERS_FILE} (content up to date)"],
+                    fix_mode, "sudoers")
+
+    def write(log):
+        rc, msg = _run_sudo(["sudo", "tee", SUDOERS_FILE], input_bytes=content)
         if rc != 0:
-            print(f"✗ Failed to create {dir_path}: {msg}")
+            log.append(f"✗ Failed to write {SUDOERS_FILE}: {msg}")
             return False
-        
-        # Set permissions
-        rc, msg = _run_sudo(["sudo", "chmod", oct(mode)[2:], dir_path])
+        # Set proper permissions (0440 is standard for sudoers files)
+        rc, msg = _run_sudo(["sudo", "chmod", "0440", SUDOERS_FILE])
         if rc != 0:
-            print(f"✗ Failed to set permissions on {dir_path}: {msg}")
+            log.append(f"✗ Failed to set permissions on {SUDOERS_FILE}: {msg}")
             return False
-        
-        print(f"✓ Created {dir_path} with permissions {oct(mode)}")
-    
-    print("✓ All system directories created successfully")
-    print("=" * 60 + "\n")
-    return True
+        rc, msg = _run_sudo(["sudo", "visudo", "-c", "-f", SUDOERS_FILE])
+        if rc != 0:
+            log.append(f"✗ Syntax validation failed: {msg}; removed {SUDOERS_FILE}")
+            _run_sudo(["sudo", "rm", "-f", SUDOERS_FILE])
+            return False
+        log.append(f"✓ Wrote and validated {SUDOERS_FILE}")
+        log.append(f"  Developers can now run: sudo {sys.executable} {os.path.abspath(__file__)}")
+        return True
+
+    return Step("Configure sudoers policy",
+                [f"write {SUDOERS_FILE} (sha256 {_digest(current)} -> {_digest(content)}, 0440)",
+                 f"visudo -c -f {SUDOERS_FILE}"], write, "sudoers")
+
+
+SYSTEM_DIRECTORIES = [
+    ("/var/lib/secure-container-access", 0o755),
+    ("/var/log/secure-container-access/sessions", 0o750),
+    ("/var/log/secure-container-access/archive", 0o750),
+]
+
+
+def plan_directories() -> Step | None:
+    """
+    Create missing system directories and fix wrong modes.
+    Checked with stat() first; None when everything is in place.
+    """
+    todo = []
+    for path, mode in SYSTEM_DIRECTORIES:
+        try:
+            current = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            current = None
+        if current != mode:
+            todo.append((path, mode, current))
+    if not todo:
+        return None
+    details = [f"mkdir {path} ({oct(mode)})" if current is None
+               else f"chmod {oct(mode)[2:]} {path} (is {oct(current)})"
+               for path, mode, current in todo]
+
+    def apply(log):
+        for path, mode, current in todo:
+            if current is None:
+                rc, msg = _run_sudo(["sudo", "mkdir", "-p", path])
+                if rc != 0:
+                    log.append(f"✗ Failed to create {path}: {msg}")
+                    return False
+            rc, msg = _run_sudo(["sudo", "chmod", oct(mode)[2:], path])
+            if rc != 0:
+                log.append(f"✗ Failed to set permissions on {path}: {msg}")
+                return False
+            log.append(f"✓ {path} ({oct(mode)})")
+        return True
+
+    return Step("Create system directories", details, apply, "dirs")
+
+
+def plan_provisioning() -> list:
+    """Compare the system with the desired state; the steps that close the gap.
+
+    Everything is inspected in-process or with one read-only command each;
+    an up-to-date system yields an empty plan.
+    """
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        accounts = pool.submit(read_accounts)
+        service = pool.submit(find_docker_service)
+        groups, regular_users = accounts.result()
+        docker_service = service.result()
+    steps = [
+        plan_directories(),
+        plan_docker_lock(docker_service),
+        plan_docker_group(groups),
+        plan_developers_group(groups, regular_users),
+        plan_sudoers(),
+    ]
+    return [s for s in steps if s is not None]
+
+
+def print_plan(steps, seconds=None):
+    _print_header("PROVISIONING PLAN")
+    for n, step in enumerate(steps, 1):
+        print(f"{n}) {step.title}  [{step.lane}]")
+        for line in step.details:
+            print(f"     - {line}")
+    lanes = len({s.lane for s in steps})
+    print(f"\n{len(steps)} step(s) in {lanes} concurrent lane(s)")
+    if seconds is not None:
+        print(f"Planned in {seconds * 1000:.0f} ms")
+    print("=" * 60)
+
+
+def apply_plan(steps) -> bool:
+    """Run the steps (lanes concurrently) and report each; True if all succeeded."""
+    lanes = {}
+    for step in steps:
+        lanes.setdefault(step.lane, []).append(step)
+    print_lock = threading.Lock()
+
+    def run_lane(lane_steps):
+        for step in lane_steps:
+            ok = step.run()
+            with print_lock:
+                print(f"{'✓' if ok else '✗'} {step.title} ({step.seconds:.1f}s)", flush=True)
+            if not ok:
+                # later steps in a lane build on earlier ones
+                return
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, len(lanes))) as pool:
+        list(pool.map(run_lane, lanes.values()))
+    elapsed = time.perf_counter() - t0
+
+    for step in steps:
+        if step.log:
+            print(f"\n{step.title}:")
+            for line in step.log:
+                print(f"  {line}")
+    failed = [s.title for s in steps if not s.ok]
+    print(f"\nApplied {len(steps) - len(failed)}/{len(steps)} step(s) in {elapsed:.1f}s")
+    if failed:
+        print(f"✗ Failed or skipped: {', '.join(failed)}")
+    return not failed
 
 
 def check_required_commands() -> bool:
     """Check if required system commands are available."""
-    required = ["systemctl", "groupadd", "usermod", "gpasswd", "getent"]
+    required = ["systemctl", "groupadd", "gpasswd", "getent"]
     optional = ["script", "visudo", "docker"]
     
     print("\n" + "=" * 60)
@@ -411,7 +569,7 @@ def check_required_commands() -> bool:
     
     all_ok = True
     for cmd in required:
-        if subprocess.run(["which", cmd], capture_output=True).returncode == 0:
+        if shutil.which(cmd):
             print(f"✓ {cmd} found")
         else:
             print(f"✗ {cmd} NOT FOUND (REQUIRED)")
@@ -419,7 +577,7 @@ def check_required_commands() -> bool:
     
     print("\nOptional commands:")
     for cmd in optional:
-        if subprocess.run(["which", cmd], capture_output=True).returncode == 0:
+        if shutil.which(cmd):
             print(f"✓ {cmd} found")
         else:
             print(f"⚠ {cmd} not found (optional, but recommended)")
@@ -439,25 +597,14 @@ def _print_header(title: str):
     print("=" * 60)
 
 
-def menu():
-    # Check required commands first
-    if not check_required_commands():
-        print("Cannot proceed without required system commands.")
-        sys.exit(1)
+def _import_src(name: str):
+    """Import a module from src/ on first use.
 
-    # Create system directories first (requires sudo)
-    if not create_system_directories():
-        print("✗ Failed to create system directories. Aborting.")
-        sys.exit(1)
-    
-    # Import modules that require dependencies
+    Explains the usual cause (sudo running the system Python instead of the
+    venv) and exits if its dependencies are missing.
+    """
     try:
-        from db import init_db
-        import check_docker
-        import enter
-        import admin as admin_mod
-        import user as user_mod
-        from accounts import count_users, list_users
+        return importlib.import_module(name)
     except ImportError as e:
         print(f"\n✗ Import error: {e}")
         print("\nLikely cause: Running with sudo uses system Python, not your venv.")
@@ -469,41 +616,50 @@ def menu():
         print("\n  3. Install packages system-wide (NOT recommended):")
         print("     sudo pip3 install -r requirements.txt")
         sys.exit(1)
-    
-    init_db()
+
+
+def menu():
+    # Check required commands first
+    if not check_required_commands():
+        print("Cannot proceed without required system commands.")
+        sys.exit(1)
+
+    # System directories first (the database lives there); only what is
+    # missing or has the wrong mode is touched
+    step = plan_directories()
+    if step is not None:
+        print_plan([step])
+        if not apply_plan([step]):
+            print("✗ Failed to create system directories. Aborting.")
+            sys.exit(1)
+    
+    # Only what the menu itself needs; every option imports its own modules
+    # on first use (the Docker SDK alone adds ~100ms to startup)
+    db = _import_src("db")
+    accounts = _import_src("accounts")
+    db.init_db()
 
     _print_header("Secure Container Access Manager")
-    
-    # Check Docker availability
-    if not check_docker.check():
-        print("\n✗ Docker is not available. Please install and start Docker first.")
-        print("Continuing anyway, but container operations will fail...\n")
-        # Don't exit - allow admin setup to continue
 
-    if count_users(role="admin") == 0:
+    if accounts.count_users(role="admin") == 0:
         _print_header("FIRST-TIME SETUP")
         print("No admins found. Running FULLY AUTOMATED initial setup.")
         print("This will configure everything for production security.")
         print()
+
+        # Check Docker availability
+        if not _import_src("check_docker").check():
+            print("\n✗ Docker is not available. Please install and start Docker first.")
+            print("Continuing anyway, but container operations will fail...\n")
+            # Don't exit - allow admin setup to continue
         
-        # Step 1: Lock Docker to enforce gatekeeper
-        if not lock_docker_systemwide():
-            print("✗ Docker lock failed. Aborting setup.")
-            return
-        
-        # Step 2: Remove users from docker group (prevent bypass)
-        if not remove_users_from_docker_group():
-            print("✗ Failed to remove users from docker group. Aborting setup.")
-            return
-        
-        # Step 3: Create developers group and add users
-        if not setup_developers_group():
-            print("✗ Failed to setup developers group. Aborting setup.")
-            return
-        
-        # Step 4: Configure sudoers policy
-        if not setup_sudoers_automated():
-            print("✗ Sudoers setup failed. Aborting setup.")
+        # Steps 1-4: lock Docker, empty the docker group, set up the
+        # developers group and the sudoers policy (see plan_provisioning)
+        t0 = time.perf_counter()
+        steps = plan_provisioning()
+        print_plan(steps, time.perf_counter() - t0)
+        if not apply_plan(steps):
+            print("✗ Provisioning failed. Aborting setup.")
             return
         
         # Step 5: Create first admin
@@ -513,7 +669,7 @@ def menu():
         print("All security configurations complete!")
         print("Now create the first admin account.")
         print()
-        admin_mod.bootstrap_admin()
+        _import_src("admin").bootstrap_admin()
         
         print("\n" + "=" * 60)
         print("SETUP COMPLETE!")
@@ -539,49 +695,77 @@ def menu():
     choice = input("Select one option: ").strip()
 
     if choice == "1":
-        admins = list_users(role="admin")
-        if not admins:
+        found = False
+        for username, role in accounts.iter_users(role="admin"):
+            print(f"- {username} ({role})")
+            found = True
+        if not found:
             print("(no admins)")
-        else:
-            for username, role in admins:
-                print(f"- {username} ({role})")
         return
 
     if choice == "2":
-        admin_mod.add_admin()
+        _import_src("admin").add_admin()
         return
 
     if choice == "3":
-        admin_mod.remove_admin()
+        _import_src("admin").remove_admin()
         return
 
     if choice == "4":
-        users = list_users(role="user")
-        if not users:
+        found = False
+        for username, role in accounts.iter_users(role="user"):
+            print(f"- {username} ({role})")
+            found = True
+        if not found:
             print("(no regular users)")
-        else:
-            for username, role in users:
-                print(f"- {username} ({role})")
         return
 
     if choice == "5":
-        user_mod.prompt_create()
+        _import_src("user").prompt_create()
         return
 
     if choice == "6":
-        admin_mod.delete_regular_user()
+        _import_src("admin").delete_regular_user()
         return
 
     if choice == "7":
-        enter.main()
+        _import_src("enter").main()
         return
 
     print("Invalid choice.")
     return
 
 
+def dry_run():
+    """Print the provisioning diff and how long planning took; changes nothing."""
+    check_required_commands()
+    t0 = time.perf_counter()
+    steps = plan_provisioning()
+    if steps:
+        print_plan(steps, time.perf_counter() - t0)
+    else:
+        print(f"✓ System is up to date, nothing to do ({(time.perf_counter() - t0) * 1000:.0f} ms)")
+
+
+def reconcile() -> bool:
+    """Bring a configured host back to the desired state, non-interactively."""
+    t0 = time.perf_counter()
+    steps = plan_provisioning()
+    if not steps:
+        print(f"✓ System is up to date, nothing to do ({(time.perf_counter() - t0) * 1000:.0f} ms)")
+        return True
+    print_plan(steps, time.perf_counter() - t0)
+    return apply_plan(steps)
+
+
 def main():
     _ensure_src_on_path()
+    parser = argparse.ArgumentParser(description="Secure Container Access Manager setup")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only show what first-time provisioning would change (no sudo needed)")
+    parser.add_argument("--reconcile", action="store_true",
+                        help="Apply only the provisioning changes this host needs, then exit")
+    args = parser.parse_args()
 
     # Check if running on Linux
     if not sys.platform.startswith('linux'):
@@ -589,10 +773,19 @@ def main():
         print(f"Current platform: {sys.platform}")
         sys.exit(1)
 
+    if args.dry_run:
+        dry_run()
+        return
+
     if not verify_linux_password_with_sudo():
         print("Aborting.")
         sys.exit(1)
 
+    if args.reconcile:
+        if not check_required_commands() or not reconcile():
+            sys.exit(1)
+        return
+
     try:
         menu()
     except KeyboardInterrupt:
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""Batched writer for access_logs.
+
+Session starts and ends are queued and a single writer thread commits
+them, several per transaction (group commit): while one commit is in
+flight new events pile up and go out together in the next one, so sessions
+starting at the same time no longer queue on the write lock one by one.
+ACCESS_LOG_DELAY_MS optionally waits a little longer for a batch to fill
+up; ACCESS_LOG_MAX_BATCH caps it.
+
+Starts are acknowledged (the caller needs the row id), ends are
+fire-and-forget. Queued ends are flushed at interpreter exit; if the
+process dies before that, reconcile_open_sessions() closes its rows on
+the next startup using the recording's last modification time.
+
+    sudo python3 src/access_log.py reconcile
+"""
+
+from __future__ import annotations
+
+import argparse
+import atexit
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING
+
+from db import init_db, connection, transaction
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+ACCESS_LOG_DELAY_MS = float(os.environ.get("SCAM_ACCESS_LOG_DELAY_MS", "0") or 0)
+ACCESS_LOG_MAX_BATCH = int(os.environ.get("SCAM_ACCESS_LOG_MAX_BATCH", "256") or 256)
+# a failed commit is retried this many times before its events are failed
+COMMIT_RETRIES = 5
+
+# columns end_session() may fill in besides ts_end
+END_COLUMNS = ("bytes_in", "bytes_out", "peak_out_bps", "exit_code", "duration_ms",
+               "cpu_ms", "mem_peak_bytes", "mem_delta_bytes")
+
+
+def utc_timestamp(ts: float | None = None) -> str:
+    """Unix time -> 'YYYY-MM-DD HH:MM:SS' (UTC), the format of CURRENT_TIMESTAMP."""
+    ts = time.time() if ts is None else ts
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class AccessLogWriter:
+    """Queue of access_logs writes drained by one thread in batched transactions."""
+
+    def __init__(self, *, max_batch: int = ACCESS_LOG_MAX_BATCH, delay_ms: float = ACCESS_LOG_DELAY_MS):
+        self.max_batch = max_batch
+        self.delay = delay_ms / 1000
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self.commits = 0
+        self.events = 0
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("access log writer is closed")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="access-log-writer", daemon=True)
+                self._thread.start()
+
+    def _put(self, event) -> Future:
+        # imported here: concurrent.futures pulls in logging, which the
+        # CLIs would otherwise load before their first prompt
+        from concurrent.futures import Future
+
+        self._ensure_thread()
+        result = Future()
+        result.set_running_or_notify_cancel()
+        self._queue.put((event, result))
+        return result
+
+    def start_session(self, username: str, container_name: str, typescript_path: str) -> Future:
+        """Future resolving to the new access_logs id."""
+        return self._put(("start", (username, container_name, typescript_path, utc_timestamp(), os.getpid())))
+
+    def end_session(self, log_id: int, *, ts_end: str | None = None, **columns) -> Future:
+        """Queue ts_end (now by default) and any END_COLUMNS for a session."""
+        unknown = set(columns) - set(END_COLUMNS)
+        if unknown:
+            raise ValueError(f"unknown access_logs columns: {', '.join(sorted(unknown))}")
+        return self._put(("end", (log_id, ts_end or utc_timestamp(), columns)))
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Wait until everything queued so far is committed."""
+        if self._thread is None:
+            return True
+        try:
+            self._put(("barrier", None)).result(timeout)
+        except Exception:
+            return False
+        return True
+
+    def close(self, timeout: float | None = 10):
+        """Flush and stop the writer thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+    # ---- writer thread -----------------------------------------------------
+
+    def _collect(self, first) -> tuple[list, bool]:
+        batch = [first]
+        deadline = time.monotonic() + self.delay
+        while len(batch) < self.max_batch:
+            try:
+                if self.delay:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _apply(self, conn, event):
+        kind, args = event
+        if kind == "start":
+            c = conn.execute(
+                "INSERT INTO access_logs (username, container_name, typescript_path, ts_start, pid) "
+                "VALUES (?, ?, ?, ?, ?)",
+                args,
+            )
+            return c.lastrowid
+        if kind == "end":
+            log_id, ts_end, columns = args
+            sets = ", ".join(["ts_end = ?"] + [f"{name} = ?" for name in columns])
+            conn.execute(f"UPDATE access_logs SET {sets} WHERE id = ?", (ts_end, *columns.values(), log_id))
+        return None
+
+    def _commit(self, batch):
+        for attempt in range(COMMIT_RETRIES):
+            try:
+                with transaction(immediate=True) as conn:
+                    return [self._apply(conn, event) for event, _ in batch]
+            except sqlite3.OperationalError as e:
+                error = e
+                time.sleep(0.05 * (attempt + 1))
+        raise error
+
+    def _run(self):
+        init_db()
+        stop = False
+        while not stop:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch, stop = self._collect(first)
+            try:
+                results = self._commit(batch)
+            except Exception as e:
+                print(f"access log: commit of {len(batch)} events failed: {e}", file=sys.stderr)
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.commits += 1
+            self.events += len(batch)
+            for (_, future), value in zip(batch, results):
+                future.set_result(value)
+        # drain whatever raced with close()
+        leftover = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                leftover.append(item)
+        if leftover:
+            try:
+                for (_, future), value in zip(leftover, self._commit(leftover)):
+                    future.set_result(value)
+            except Exception as e:
+                for _, future in leftover:
+                    future.set_exception(e)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> AccessLogWriter:
+    """Process-wide writer (created on first use, flushed at exit)."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = AccessLogWriter()
+            atexit.register(_writer.close)
+        return _writer
+
+
+def log_session_start(username: str, container_name: str, typescript_path: str) -> int:
+    return get_writer().start_session(username, container_name, typescript_path).result()
+
+
+def log_session_end(log_id: int, **columns):
+    get_writer().end_session(log_id, **columns)
+
+
+# ---- reporting -------------------------------------------------------------
+
+REPORT_GROUPS = {"user": "username", "container": "container_name"}
+
+
+def session_report(*, by: str = "user", since: str | None = None, until: str | None = None,
+                   limit: int | None = None):
+    """Per-user or per-container session totals for sessions started in [since, until).
+
+    Rows are dicts, heaviest output first. Sessions recorded before the
+    metadata columns existed count as sessions but add no bytes/CPU.
+    """
+    init_db()
+    key = REPORT_GROUPS[by]
+    where, params = ["1 = 1"], []
+    if since is not None:
+        where.append("ts_start >= ?")
+        params.append(since)
+    if until is not None:
+        where.append("ts_start < ?")
+        params.append(until)
+    sql = f"""SELECT {key} AS name,
+                     COUNT(*) AS sessions,
+                     SUM(duration_ms) AS duration_ms,
+                     MAX(duration_ms) AS longest_ms,
+                     SUM(bytes_in) AS bytes_in,
+                     SUM(bytes_out) AS bytes_out,
+                     MAX(peak_out_bps) AS peak_out_bps,
+                     SUM(cpu_ms) AS cpu_ms,
+                     MAX(mem_peak_bytes) AS mem_peak_bytes,
+                     SUM(exit_code IS NOT NULL AND exit_code != 0) AS failed
+              FROM access_logs WHERE {" AND ".join(where)}
+              GROUP BY {key}
+              ORDER BY COALESCE(SUM(bytes_out), 0) DESC, sessions DESC"""
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return [dict(r) for r in connection().execute(sql, params)]
+
+
+# ---- crash recovery --------------------------------------------------------
+
+def _boot_time() -> float:
+    try:
+        with open("/proc/stat") as f:
+            for line in f:
+                if line.startswith("btime "):
+                    return float(line.split()[1])
+    except OSError:
+        pass
+    return 0.0
+
+
+def _pid_alive(pid) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _parse_ts(value) -> float:
+    return datetime.strptime(str(value)[:19], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+
+
+def reconcile_open_sessions() -> int:
+    """Close sessions whose recording process is gone; returns how many.
+
+    A row without ts_end is stale if it was started before the last boot,
+    or if the process that wrote it (access_logs.pid) no longer exists.
+    Rows from before the pid column are only closed after a reboot. ts_end
+    becomes the recording's mtime, the last moment anything was written.
+    """
+    init_db()
+    boot = _boot_time()
+    rows = connection().execute(
+        "SELECT id, pid, ts_start, typescript_path FROM access_logs WHERE ts_end IS NULL"
+    ).fetchall()
+    updates = []
+    for row in rows:
+        started = _parse_ts(row["ts_start"])
+        if started >= boot and (row["pid"] is None or _pid_alive(row["pid"])):
+            continue
+        try:
+            ended = max(started, os.path.getmtime(row["typescript_path"]))
+        except OSError:
+            ended = started
+        updates.append((utc_timestamp(ended), row["id"]))
+    if updates:
+        with transaction(immediate=True) as conn:
+            conn.executemany("UPDATE access_logs SET ts_end = ? WHERE id = ? AND ts_end IS NULL", updates)
+    return len(updates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="access_logs maintenance")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("reconcile", help="Close sessions left open by crashed or killed processes")
+    args = parser.parse_args()
+
+    if args.cmd == "reconcile":
+        print(f"{reconcile_open_sessions()} open sessions closed")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,30 +2,282 @@
 
 from __future__ import annotations
 
+import os
+import sqlite3
+import threading
+import time
+from typing import TYPE_CHECKING
+
 import bcrypt
 
-from db import init_db, get_conn
+import authcache
+from db import init_db, connection, transaction
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future, ProcessPoolExecutor
+
+# bcrypt worker processes (0 = one per core) and how many requests may be
+# queued or running before callers get AuthEngineBusy.
+AUTH_WORKERS = int(os.environ.get("SCAM_AUTH_WORKERS", "0") or 0)
+AUTH_MAX_PENDING = int(os.environ.get("SCAM_AUTH_MAX_PENDING", "0") or 0)
+
+# bcrypt cost factor (log2 rounds) for new hashes. Existing hashes with a
+# different cost are upgraded/downgraded on the next successful login.
+BCRYPT_ROUNDS = int(os.environ.get("SCAM_BCRYPT_ROUNDS", "12") or 12)
+
+
+class AuthEngineBusy(RuntimeError):
+    """Raised when the bcrypt queue is full and the caller would not wait."""
+
+
+def _bcrypt_hash(plain: bytes, rounds: int) -> tuple[bytes, float]:
+    t0 = time.perf_counter()
+    hashed = bcrypt.hashpw(plain, bcrypt.gensalt(rounds))
+    return hashed, time.perf_counter() - t0
+
+
+def _bcrypt_check(plain: bytes, hashed: bytes) -> tuple[bool, float]:
+    t0 = time.perf_counter()
+    ok = bcrypt.checkpw(plain, hashed)
+    return ok, time.perf_counter() - t0
+
+
+class AuthEngine:
+    """Runs bcrypt on a process pool with a bounded number of pending jobs.
+
+    submit_hash()/submit_check() return concurrent.futures.Future objects
+    (wrap them with asyncio.wrap_future() from async code). When
+    max_pending jobs are already queued or running, submitting blocks for
+    up to `timeout` seconds and then raises AuthEngineBusy, which gives
+    callers backpressure instead of an unbounded queue.
+
+    With inline=True there is no pool: jobs run in the submitting thread
+    and the returned futures are already done (see gatekeeper workers).
+    """
+
+    def __init__(self, workers: int = 0, max_pending: int = 0, *, inline: bool = False):
+        self.inline = inline
+        self.workers = 1 if inline else (workers or os.cpu_count() or 1)
+        self.max_pending = max_pending or self.workers * 4
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pool = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._submitted = 0
+        self._rejected = 0
+        self._completed = {"hash": 0, "check": 0}
+        self._cpu_total = {"hash": 0.0, "check": 0.0}
+        self._wall_total = {"hash": 0.0, "check": 0.0}
+        self._wall_max = {"hash": 0.0, "check": 0.0}
+
+    def _executor(self) -> ProcessPoolExecutor:
+        # imported on first use: concurrent.futures and multiprocessing are
+        # a large part of the CLIs' startup time otherwise
+        from concurrent.futures import ProcessPoolExecutor
+
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    def _submit(self, kind: str, fn, *args, timeout: float | None = None) -> Future:
+        from concurrent.futures import Future
+
+        if not self._slots.acquire(timeout=timeout):
+            with self._lock:
+                self._rejected += 1
+            raise AuthEngineBusy(f"{self.max_pending} bcrypt jobs already pending")
+
+        with self._lock:
+            self._pending += 1
+            self._submitted += 1
+        started = time.perf_counter()
+        result = Future()
+        result.set_running_or_notify_cancel()
+
+        def _done(inner: Future):
+            wall = time.perf_counter() - started
+            self._slots.release()
+            with self._lock:
+                self._pending -= 1
+            exc = inner.exception()
+            if exc is not None:
+                result.set_exception(exc)
+                return
+            value, cpu = inner.result()
+            with self._lock:
+                self._completed[kind] += 1
+                self._cpu_total[kind] += cpu
+                self._wall_total[kind] += wall
+                self._wall_max[kind] = max(self._wall_max[kind], wall)
+            result.set_result(value)
+
+        if self.inline:
+            inner = Future()
+            try:
+                inner.set_result(fn(*args))
+            except Exception as e:
+                inner.set_exception(e)
+            _done(inner)
+            return result
+        try:
+            self._executor().submit(fn, *args).add_done_callback(_done)
+        except Exception:
+            self._slots.release()
+            with self._lock:
+                self._pending -= 1
+            raise
+        return result
+
+    def submit_hash(self, plain: str, *, rounds: int | None = None,
+                    timeout: float | None = None) -> Future:
+        """Future resolving to the bcrypt hash of plain (BCRYPT_ROUNDS by default)."""
+        return self._submit("hash", _bcrypt_hash, plain.encode(), rounds or BCRYPT_ROUNDS,
+                            timeout=timeout)
+
+    def submit_check(self, plain: str, hashed: bytes, *, timeout: float | None = None) -> Future:
+        """Future resolving to True if plain matches hashed."""
+        return self._submit("check", _bcrypt_check, plain.encode(), bytes(hashed), timeout=timeout)
+
+    def stats(self) -> dict:
+        """Queue depth and latency counters (seconds).
+
+        cpu_* is time spent inside bcrypt in the worker, wall_* includes
+        queueing and IPC.
+        """
+        with self._lock:
+            out = {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "submitted": self._submitted,
+                "rejected": self._rejected,
+            }
+            for kind in ("hash", "check"):
+                n = self._completed[kind]
+                out[f"{kind}_completed"] = n
+                out[f"{kind}_cpu_avg"] = self._cpu_total[kind] / n if n else 0.0
+                out[f"{kind}_wall_avg"] = self._wall_total[kind] / n if n else 0.0
+                out[f"{kind}_wall_max"] = self._wall_max[kind]
+            return out
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_auth_engine() -> AuthEngine:
+    """Process-wide AuthEngine (created on first use)."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AuthEngine(AUTH_WORKERS, AUTH_MAX_PENDING)
+        return _engine
+
+
+def use_inline_auth_engine():
+    """Hash in the calling process from now on instead of on a pool."""
+    global _engine
+    with _engine_lock:
+        _engine = AuthEngine(inline=True)
+
+
+def _forget_engine():
+    # a forked child (gatekeeper worker) can't use the parent's pool or lock
+    global _engine, _engine_lock
+    _engine, _engine_lock = None, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_engine)
 
 
 def hash_password(plain: str) -> bytes:
-    return bcrypt.hashpw(plain.encode(), bcrypt.gensalt())
+    return get_auth_engine().submit_hash(plain).result()
 
 
 def check_password(plain: str, hashed: bytes) -> bool:
-    return bcrypt.checkpw(plain.encode(), hashed)
+    return get_auth_engine().submit_check(plain, hashed).result()
+
+
+def hash_rounds(hashed: bytes) -> int | None:
+    """Cost factor encoded in a bcrypt hash ($2b$<cost>$...), None if unparsable."""
+    try:
+        return int(bytes(hashed).split(b"$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def needs_rehash(hashed: bytes) -> bool:
+    return hash_rounds(hashed) != BCRYPT_ROUNDS
+
+
+def _rehash(row, plain_password: str):
+    """Store a BCRYPT_ROUNDS hash for row's user; return the updated row (or the old one)."""
+    try:
+        new_hash = hash_password(plain_password)
+        with transaction() as conn:
+            # only replace the hash we verified; a concurrent password change wins
+            cur = conn.execute(
+                "UPDATE users SET password_hash = ? WHERE username = ? AND password_hash = ?",
+                (new_hash, row["username"], row["password_hash"]),
+            )
+    except (sqlite3.Error, AuthEngineBusy):
+        return row
+    if cur.rowcount != 1:
+        return row
+    authcache.invalidate(row["username"])
+    return {"username": row["username"], "password_hash": new_hash, "role": row["role"]}
+
+
+def password_matches(row, plain_password: str) -> bool:
+    """Check plain_password against a users row.
+
+    Goes through the opt-in verdict cache first (see authcache) and only
+    runs bcrypt on a miss; a successful bcrypt check refreshes the cache
+    and, if the stored hash uses a different cost than BCRYPT_ROUNDS,
+    transparently rehashes it.
+    """
+    plain_password = plain_password or ""
+    if authcache.lookup(row, plain_password):
+        return True
+    if check_password(plain_password, row["password_hash"]):
+        if needs_rehash(row["password_hash"]):
+            row = _rehash(row, plain_password)
+        authcache.store(row, plain_password)
+        return True
+    return False
+
+
+def benchmark_bcrypt_cost(min_rounds: int = 10, max_rounds: int = 14, samples: int = 3):
+    """Yield (rounds, median seconds per hash) measured on this host.
+
+    Runs inline on the calling thread so the numbers reflect one core, which
+    is what a single login pays.
+    """
+    for rounds in range(min_rounds, max_rounds + 1):
+        times = sorted(_bcrypt_hash(b"benchmark-password", rounds)[1] for _ in range(samples))
+        yield rounds, times[len(times) // 2]
+
+
+def recommend_bcrypt_cost(results, target_seconds: float) -> int | None:
+    """Highest cost whose measured time stays within target_seconds."""
+    fitting = [rounds for rounds, secs in results if secs <= target_seconds]
+    return max(fitting) if fitting else None
 
 
 def get_user(username: str):
     """Return sqlite Row for user or None."""
     init_db()
-    conn = get_conn()
-    try:
-        return conn.execute(
-            "SELECT username, password_hash, role FROM users WHERE username = ?",
-            (username.strip(),),
-        ).fetchone()
-    finally:
-        conn.close()
+    return connection().execute(
+        "SELECT username, password_hash, role FROM users WHERE username = ?",
+        (username.strip(),),
+    ).fetchone()
 
 
 def verify_user_password(username: str, plain_password: str) -> tuple[bool, str]:
@@ -38,7 +290,7 @@ def verify_user_password(username: str, plain_password: str) -> tuple[bool, str]
     if not row:
         return False, f"No such user '{username}'."
 
-    if check_password(plain_password or "", row["password_hash"]):
+    if password_matches(row, plain_password):
         return True, "Password verified."
     return False, "Wrong password."
 
@@ -64,43 +316,119 @@ def verify_user_role_password(
     if row["role"] != required_role:
         return False, f"User '{username}' is not an {required_role}."
 
-    if check_password(plain_password or "", row["password_hash"]):
+    if password_matches(row, plain_password):
         return True, "Password verified."
     return False, "Wrong password."
 
 
-def create_user(username: str, plain_password: str, role: str) -> tuple[bool, str]:
-    """Create a user with the given role ('user' or 'admin')."""
+def _validate_new_user(username: str, plain_password: str, role: str) -> str | None:
+    """Error message for invalid create_user input, None if it is acceptable."""
     if role not in ("admin", "user"):
-        return False, "Invalid role. Must be 'admin' or 'user'."
-
-    username = (username or "").strip()
+        return "Invalid role. Must be 'admin' or 'user'."
     if not username:
-        return False, "Username can't be empty."
-
+        return "Username can't be empty."
     if len(plain_password or "") < 8:
-        return False, "Password needs to be at least 8 characters long."
+        return "Password needs to be at least 8 characters long."
+    return None
+
+
+def create_user(username: str, plain_password: str, role: str) -> tuple[bool, str]:
+    """Create a user with the given role ('user' or 'admin')."""
+    username = (username or "").strip()
+    err = _validate_new_user(username, plain_password, role)
+    if err:
+        return False, err
 
     init_db()
-    conn = get_conn()
+    existing = connection().execute(
+        "SELECT username FROM users WHERE username = ?",
+        (username,),
+    ).fetchone()
+    if existing:
+        return False, f"User '{username}' already exists."
+
+    # Hash outside the transaction so bcrypt time is not spent holding the write lock.
+    hashed = hash_password(plain_password)
     try:
-        cur = conn.cursor()
-        existing = cur.execute(
-            "SELECT username FROM users WHERE username = ?",
-            (username,),
-        ).fetchone()
-        if existing:
-            return False, f"User '{username}' already exists."
+        with transaction() as conn:
+            conn.execute(
+                "INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
+                (username, hashed, role),
+            )
+    except sqlite3.IntegrityError:
+        return False, f"User '{username}' already exists."
+    return True, f"User '{username}' created with role '{role}'."
+
+
+def _existing_usernames(conn, usernames) -> set[str]:
+    found = set()
+    names = list(usernames)
+    # stay well below SQLITE_MAX_VARIABLE_NUMBER
+    for i in range(0, len(names), 500):
+        chunk = names[i:i + 500]
+        placeholders = ",".join("?" * len(chunk))
+        found.update(
+            r["username"]
+            for r in conn.execute(f"SELECT username FROM users WHERE username IN ({placeholders})", chunk)
+        )
+    return found
+
 
-        hashed = hash_password(plain_password)
-        cur.execute(
+def create_users_bulk(records, *, default_role: str = "user"):
+    """Create many users in one transaction.
+
+    records is an iterable of (ref, username, plain_password, role) where ref
+    identifies the input row (e.g. a line number) and role may be None for
+    default_role. Passwords are hashed in parallel on the AuthEngine pool;
+    the INSERTs run as a single executemany under BEGIN IMMEDIATE.
+
+    Returns (created, errors) where errors is a list of (ref, username,
+    message). A bad row never aborts the rest of the batch.
+    """
+    init_db()
+    errors = []
+    candidates = {}
+    for ref, username, plain_password, role in records:
+        username = (username or "").strip()
+        role = role or default_role
+        err = _validate_new_user(username, plain_password, role)
+        if err is None and username in candidates:
+            err = "Duplicate username in input."
+        if err:
+            errors.append((ref, username, err))
+            continue
+        candidates[username] = (ref, plain_password, role)
+
+    for username in _existing_usernames(connection(), candidates):
+        ref, _, _ = candidates.pop(username)
+        errors.append((ref, username, f"User '{username}' already exists."))
+
+    engine = get_auth_engine()
+    futures = [
+        (username, ref, role, engine.submit_hash(plain_password))
+        for username, (ref, plain_password, role) in candidates.items()
+    ]
+    rows = []
+    for username, ref, role, fut in futures:
+        try:
+            rows.append((username, fut.result(), role, ref))
+        except Exception as e:
+            errors.append((ref, username, f"Hashing failed: {e}"))
+
+    with transaction(immediate=True) as conn:
+        # re-check under the write lock: someone may have added a user meanwhile
+        taken = _existing_usernames(conn, (r[0] for r in rows))
+        for username, _, _, ref in rows:
+            if username in taken:
+                errors.append((ref, username, f"User '{username}' already exists."))
+        rows = [r for r in rows if r[0] not in taken]
+        conn.executemany(
             "INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
-            (username, hashed, role),
+            (r[:3] for r in rows),
         )
-        conn.commit()
-        return True, f"User '{username}' created with role '{role}'."
-    finally:
-        conn.close()
+
+    errors.sort(key=lambda e: e[0])
+    return len(rows), errors
 
 
 def delete_user(username: str, *, role: str | None = None) -> tuple[bool, str]:
@@ -115,10 +443,8 @@ def delete_user(username: str, *, role: str | None = None) -> tuple[bool, str]:
         return False, "Invalid role filter. Must be 'admin', 'user', or omitted."
 
     init_db()
-    conn = get_conn()
-    try:
-        cur = conn.cursor()
-        row = cur.execute(
+    with transaction(immediate=True) as conn:
+        row = conn.execute(
             "SELECT username, role FROM users WHERE username = ?",
             (username,),
         ).fetchone()
@@ -127,11 +453,9 @@ def delete_user(username: str, *, role: str | None = None) -> tuple[bool, str]:
         if role is not None and row["role"] != role:
             return False, f"User '{username}' is role '{row['role']}', not '{role}'."
 
-        cur.execute("DELETE FROM users WHERE username = ?", (username,))
-        conn.commit()
-        return True, f"User '{username}' deleted."
-    finally:
-        conn.close()
+        conn.execute("DELETE FROM users WHERE username = ?", (username,))
+    authcache.invalidate(username)
+    return True, f"User '{username}' deleted."
 
 
 def list_users(*, role: str | None = None) -> list[tuple[str, str]]:
@@ -140,37 +464,110 @@ def list_users(*, role: str | None = None) -> list[tuple[str, str]]:
         raise ValueError("role must be 'admin', 'user', or None")
 
     init_db()
-    conn = get_conn()
-    try:
-        if role is None:
-            rows = conn.execute(
-                "SELECT username, role FROM users ORDER BY role DESC, username"
-            ).fetchall()
-        else:
-            rows = conn.execute(
-                "SELECT username, role FROM users WHERE role = ? ORDER BY username",
-                (role,),
-            ).fetchall()
-        return [(r["username"], r["role"]) for r in rows]
-    finally:
-        conn.close()
-
-
-def count_users(*, role: str | None = None) -> int:
-    """Count all users, optionally filtered by role."""
+    conn = connection()
+    if role is None:
+        rows = conn.execute(
+            "SELECT username, role FROM users ORDER BY role DESC, username"
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            "SELECT username, role FROM users WHERE role = ? ORDER BY username",
+            (role,),
+        ).fetchall()
+    return [(r["username"], r["role"]) for r in rows]
+
+
+def _prefix_upper_bound(prefix: str) -> str | None:
+    """Smallest string greater than every string starting with prefix.
+
+    None if there is none (the prefix is all U+10FFFF).
+    """
+    # SQLite compares TEXT bytewise (UTF-8), which follows code point order
+    prefix = prefix.rstrip("\U0010ffff")
+    if not prefix:
+        return None
+    code = ord(prefix[-1]) + 1
+    if 0xD800 <= code <= 0xDFFF:
+        # surrogates can't be encoded; U+E000 is the next code point in UTF-8
+        code = 0xE000
+    return prefix[:-1] + chr(code)
+
+
+def _prefix_clause(prefix: str, where: list, params: list):
+    where.append("username >= ?")
+    params.append(prefix)
+    upper = _prefix_upper_bound(prefix)
+    if upper is not None:
+        where.append("username < ?")
+        params.append(upper)
+
+
+def iter_users(
+    *,
+    role: str | None = None,
+    prefix: str | None = None,
+    after: str | None = None,
+    limit: int | None = None,
+    page_size: int = 500,
+):
+    """Yield (username, role) ordered by username, one page at a time.
+
+    Uses keyset pagination on the UNIQUE username index: each page is a
+    fresh `username > last_seen ... LIMIT page_size` query, so memory stays
+    flat and no read transaction is held while the caller consumes rows.
+    `after` resumes behind a given username, `prefix` restricts to names
+    starting with it (as an index range, not LIKE), `limit` caps the total.
+    """
     if role is not None and role not in ("admin", "user"):
         raise ValueError("role must be 'admin', 'user', or None")
+    if limit is not None and limit <= 0:
+        return
 
     init_db()
-    conn = get_conn()
-    try:
-        if role is None:
-            row = conn.execute("SELECT COUNT(*) as cnt FROM users").fetchone()
-        else:
-            row = conn.execute(
-                "SELECT COUNT(*) as cnt FROM users WHERE role = ?",
-                (role,),
-            ).fetchone()
-        return int(row["cnt"])
-    finally:
-        conn.close()
+    conn = connection()
+    where = []
+    params = []
+    if role is not None:
+        where.append("role = ?")
+        params.append(role)
+    if prefix:
+        _prefix_clause(prefix, where, params)
+    last = after
+    remaining = limit
+    while True:
+        n = page_size if remaining is None else min(page_size, remaining)
+        clauses = where + (["username > ?"] if last is not None else [])
+        sql = "SELECT username, role FROM users"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY username LIMIT ?"
+        rows = conn.execute(sql, params + ([last] if last is not None else []) + [n]).fetchall()
+        for r in rows:
+            yield r["username"], r["role"]
+        if len(rows) < n:
+            return
+        last = rows[-1]["username"]
+        if remaining is not None:
+            remaining -= len(rows)
+            if remaining <= 0:
+                return
+
+
+def count_users(*, role: str | None = None, prefix: str | None = None) -> int:
+    """Count all users, optionally filtered by role and/or username prefix."""
+    if role is not None and role not in ("admin", "user"):
+        raise ValueError("role must be 'admin', 'user', or None")
+
+    init_db()
+    where = []
+    params = []
+    if role is not None:
+        where.append("role = ?")
+        params.append(role)
+    if prefix:
+        _prefix_clause(prefix, where, params)
+    sql = "SELECT COUNT(*) as cnt FROM users"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    row = connection().execute(sql, params).fetchone()
+    return int(row["cnt"])
@@ -2,12 +2,21 @@
 
 import argparse
 import getpass
+import sys
+import time
+
+import ownership
+from user import print_users
+
+from access_log import REPORT_GROUPS, session_report, utc_timestamp
 
 from accounts import (
+        BCRYPT_ROUNDS,
+        benchmark_bcrypt_cost,
         count_users,
         create_user,
         delete_user,
-        list_users,
+        recommend_bcrypt_cost,
         verify_user_password,
     verify_user_role_password,
 )
@@ -17,15 +26,6 @@ def _count_admins() -> int:
     return count_users(role="admin")
 
 
-def _print_admins():
-    admins = list_users(role="admin")
-    if not admins:
-        print("(no admins)")
-        return
-    for username, role in admins:
-        print(f"- {username} ({role})")
-
-
 def bootstrap_admin() -> bool:
     """Create the first admin if no admins exist.
 
@@ -66,12 +66,12 @@ def remove_admin() -> bool:
     Safety rule:
     - Prevent deleting the last remaining admin.
     """
-    admins = list_users(role="admin")
+    admins = _count_admins()
     if not admins:
         print("No admins exist.")
         return False
 
-    if len(admins) == 1:
+    if admins == 1:
         print("Refusing to delete the last admin.")
         return False
 
@@ -114,15 +114,190 @@ def delete_regular_user() -> bool:
     return ok
 
 
+def bcrypt_cost_report(target_ms: float, min_rounds: int, max_rounds: int, samples: int):
+    """Time bcrypt on this host for each cost and recommend one for target_ms."""
+    print(f"Measuring bcrypt cost {min_rounds}..{max_rounds} ({samples} samples each)")
+    print(f"Configured cost (SCAM_BCRYPT_ROUNDS): {BCRYPT_ROUNDS}")
+    results = []
+    for rounds, secs in benchmark_bcrypt_cost(min_rounds, max_rounds, samples):
+        results.append((rounds, secs))
+        marker = " <- configured" if rounds == BCRYPT_ROUNDS else ""
+        print(f"  cost {rounds:2d}: {secs * 1000:8.1f} ms{marker}")
+
+    best = recommend_bcrypt_cost(results, target_ms / 1000)
+    if best is None:
+        print(f"No measured cost fits {target_ms:.0f} ms; lower --min or raise --target-ms.")
+        return None
+    print(f"Recommended cost for <= {target_ms:.0f} ms: {best}")
+    if best != BCRYPT_ROUNDS:
+        print(f"Set SCAM_BCRYPT_ROUNDS={best}; existing hashes are rehashed on next login.")
+    return best
+
+
+def _size(n) -> str:
+    if n is None:
+        return "-"
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(n) < 1024 or unit == "GiB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+
+def _hours(ms) -> str:
+    return "-" if ms is None else f"{ms / 3_600_000:.1f}h"
+
+
+def print_session_stats(by: str, *, days: int | None = 30, since=None, until=None, limit=None):
+    """Session totals per user or container for the chosen window."""
+    if since is None and days:
+        since = utc_timestamp(time.time() - days * 86400)
+    rows = session_report(by=by, since=since, until=until, limit=limit)
+    window = f"since {since}" if since else "all time"
+    if until:
+        window += f" until {until}"
+    print(f"Sessions by {by} ({window}, UTC)")
+    if not rows:
+        print("(no sessions)")
+        return
+    print(f"{by:<20} {'sess':>5} {'failed':>6} {'time':>7} {'longest':>7} {'in':>10} {'out':>10} "
+          f"{'peak out/s':>10} {'cpu':>7} {'mem peak':>10}")
+    for r in rows:
+        cpu = "-" if r["cpu_ms"] is None else f"{r['cpu_ms'] / 1000:.0f}s"
+        print(f"{r['name']:<20} {r['sessions']:>5} {r['failed'] or 0:>6} {_hours(r['duration_ms']):>7} "
+              f"{_hours(r['longest_ms']):>7} {_size(r['bytes_in']):>10} {_size(r['bytes_out']):>10} "
+              f"{_size(r['peak_out_bps']):>10} {cpu:>7} {_size(r['mem_peak_bytes']):>10}")
+
+
+def _docker_api():
+    # the Docker SDK takes ~100ms to import; only container commands need it
+    import docker_client
+    return docker_client.get_client().api
+
+
+def _select_containers(args, *, from_docker: bool) -> list[str]:
+    """Names given on the command line plus those matching --pattern/--label.
+
+    Labels always need Docker's listing; patterns are matched against it
+    (from_docker, for claims) or against the containers table.
+    """
+    names = list(args.names)
+    if args.pattern or args.label:
+        if args.label or from_docker:
+            candidates = ownership.docker_names(_docker_api(), labels=args.label)
+        else:
+            candidates = [name for name, _ in ownership.list_containers()]
+        names += ownership.match(candidates, args.pattern)
+    return list(dict.fromkeys(names))
+
+
+def _print_changes(verb: str, selected: int, changes, conflicts, dry_run: bool):
+    for name, old, new in changes:
+        print(f"  {name}: {old or '(unclaimed)'} -> {new or '(unclaimed)'}")
+    for name, msg in conflicts:
+        print(f"  {name}: conflict, {msg}")
+    unchanged = selected - len(changes) - len(conflicts)
+    note = " (dry run, nothing written)" if dry_run else ""
+    print(f"{verb} {len(changes)}, unchanged {unchanged}, conflicts {len(conflicts)}{note}")
+
+
+def containers_command(args) -> bool:
+    """admin.py containers ...; False if anything could not be done."""
+    if args.ccmd == "list":
+        rows = ownership.list_containers(patterns=args.pattern, owner=args.owner, unclaimed=args.unclaimed)
+        for name, owner in rows:
+            print(f"- {name} ({owner or 'unclaimed'})")
+        if not rows:
+            print("(no containers)")
+        return True
+
+    if args.ccmd == "sync":
+        t0 = time.perf_counter()
+        running = ownership.docker_names(_docker_api(), running_only=True)
+        added, stale = ownership.sync(running, prune=args.prune, dry_run=args.dry_run)
+        for name in added:
+            print(f"  + {name}")
+        for name, owner in stale:
+            print(f"  {'-' if args.prune else '?'} {name} ({owner or 'unclaimed'}) not running")
+        note = " (dry run, nothing written)" if args.dry_run else ""
+        stale_verb = "removed" if args.prune else "not running"
+        print(f"{len(running)} running: added {len(added)}, {stale_verb} {len(stale)} "
+              f"in {time.perf_counter() - t0:.2f}s{note}")
+        return True
+
+    if not (args.names or args.pattern or args.label):
+        print("Select containers by name, --pattern or --label (use --pattern '*' for all).")
+        return False
+    for user in (args.owner, getattr(args, "to", None)):
+        if user is not None and not ownership.user_exists(user):
+            print(f"No such user '{user}'.")
+            return False
+
+    names = _select_containers(args, from_docker=args.ccmd == "claim")
+    if args.ccmd == "claim":
+        changes, conflicts = ownership.claim(names, args.owner, force=args.force, dry_run=args.dry_run)
+        verb = "Claimed"
+    elif args.ccmd == "release":
+        changes, conflicts = ownership.release(names, owner=args.owner, dry_run=args.dry_run)
+        verb = "Released"
+    else:
+        changes, conflicts = ownership.transfer(names, args.owner, args.to, dry_run=args.dry_run)
+        verb = "Transferred"
+    _print_changes(verb, len(names), changes, conflicts, args.dry_run)
+    return not conflicts
+
+
+def _add_container_selection(p):
+    p.add_argument("names", nargs="*", help="Container names")
+    p.add_argument("--pattern", action="append", default=[],
+                   help="Glob on container names, e.g. 'ci-*' (repeatable)")
+    p.add_argument("--label", action="append", default=[],
+                   help="Docker label filter KEY or KEY=VALUE (repeatable, all must match)")
+    p.add_argument("--dry-run", action="store_true", help="Only report what would change")
+
+
 def main():
     parser = argparse.ArgumentParser(description="Bootstrap and manage admin users")
     sub = parser.add_subparsers(dest="cmd", required=True)
 
     sub.add_parser("bootstrap", help="Create first admin if none exist")
-    sub.add_parser("list", help="List admins")
+    p_list = sub.add_parser("list", help="List admins")
+    p_list.add_argument("--limit", type=int, help="Show at most N admins")
+    p_list.add_argument("--after", help="Resume after this username (keyset cursor)")
+    p_list.add_argument("--prefix", help="Only usernames starting with this prefix")
     sub.add_parser("add", help="Add an admin")
     sub.add_parser("remove", help="Remove an admin")
     sub.add_parser("delete-user", help="Delete a regular user (admin-only)")
+    p_cost = sub.add_parser("bcrypt-cost", help="Benchmark bcrypt costs and recommend one")
+    p_cost.add_argument("--target-ms", type=float, default=250, help="Acceptable time per login hash")
+    p_cost.add_argument("--min", dest="min_rounds", type=int, default=10)
+    p_cost.add_argument("--max", dest="max_rounds", type=int, default=14)
+    p_cost.add_argument("--samples", type=int, default=3)
+    p_stats = sub.add_parser("stats", help="Session usage per user or container")
+    p_stats.add_argument("--by", choices=sorted(REPORT_GROUPS), default="user")
+    p_stats.add_argument("--days", type=int, default=30, help="Window: sessions started in the last N days (0 = all)")
+    p_stats.add_argument("--since", help="Window start (YYYY-MM-DD[ HH:MM:SS], UTC); overrides --days")
+    p_stats.add_argument("--until", help="Window end (exclusive)")
+    p_stats.add_argument("--limit", type=int, help="Show the N heaviest only")
+    p_cont = sub.add_parser("containers", help="List, claim, release, transfer or sync container ownership")
+    csub = p_cont.add_subparsers(dest="ccmd", required=True)
+    p_clist = csub.add_parser("list", help="List containers and their owners")
+    p_clist.add_argument("--pattern", action="append", default=[], help="Glob on container names (repeatable)")
+    p_clist.add_argument("--owner", help="Only containers owned by this user")
+    p_clist.add_argument("--unclaimed", action="store_true", help="Only unclaimed containers")
+    p_claim = csub.add_parser("claim", help="Make a user the owner of the selected containers")
+    p_claim.add_argument("owner", help="New owner")
+    _add_container_selection(p_claim)
+    p_claim.add_argument("--force", action="store_true", help="Also take containers owned by someone else")
+    p_release = csub.add_parser("release", help="Mark the selected containers unclaimed")
+    _add_container_selection(p_release)
+    p_release.add_argument("--owner", help="Only release containers owned by this user")
+    p_transfer = csub.add_parser("transfer", help="Hand one user's containers to another")
+    p_transfer.add_argument("owner", help="Current owner")
+    p_transfer.add_argument("to", help="New owner")
+    _add_container_selection(p_transfer)
+    p_sync = csub.add_parser("sync", help="Add Docker's running containers to the table (one API call)")
+    p_sync.add_argument("--prune", action="store_true", help="Delete rows of containers that are not running")
+    p_sync.add_argument("--dry-run", action="store_true", help="Only report what would change")
 
     args = parser.parse_args()
 
@@ -130,7 +305,7 @@ def main():
         bootstrap_admin()
         return
     if args.cmd == "list":
-        _print_admins()
+        print_users("admin", prefix=args.prefix, after=args.after, limit=args.limit, empty="(no admins)")
         return
     if args.cmd == "add":
         add_admin()
@@ -141,6 +316,16 @@ def main():
     if args.cmd == "delete-user":
         delete_regular_user()
         return
+    if args.cmd == "bcrypt-cost":
+        bcrypt_cost_report(args.target_ms, args.min_rounds, args.max_rounds, args.samples)
+        return
+    if args.cmd == "stats":
+        print_session_stats(args.by, days=args.days, since=args.since, until=args.until, limit=args.limit)
+        return
+    if args.cmd == "containers":
+        if not containers_command(args):
+            sys.exit(1)
+        return
 
 
 if __name__ == "__main__":
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Short-lived authentication verdict cache.
+
+After a successful bcrypt check we can hand out a signed token bound to the
+account, the invoking Linux user and the controlling tty. A later login from
+the same place within AUTH_CACHE_TTL seconds compares an HMAC of the typed
+password against the token instead of running bcrypt again, so the password
+is still required but costs microseconds instead of ~250ms.
+
+Rules:
+- Off unless SCAM_AUTH_CACHE_TTL > 0 (opt-in).
+- Only used when running as root; tokens and the signing key live in a
+  root-only directory on tmpfs, so they vanish on reboot.
+- A token embeds a fingerprint of the stored password hash and role. If
+  either changes the token no longer matches and is discarded.
+"""
+
+from __future__ import annotations
+
+import glob
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+
+AUTH_CACHE_TTL = int(os.environ.get("SCAM_AUTH_CACHE_TTL", "0") or 0)
+AUTH_CACHE_DIR = "/run/secure-container-access/auth"
+
+_key: bytes | None = None
+
+
+def enabled() -> bool:
+    return AUTH_CACHE_TTL > 0 and hasattr(os, "geteuid") and os.geteuid() == 0
+
+
+def _ensure_dir():
+    os.makedirs(AUTH_CACHE_DIR, mode=0o700, exist_ok=True)
+    os.chmod(AUTH_CACHE_DIR, 0o700)
+
+
+def _signing_key() -> bytes:
+    global _key
+    if _key is not None:
+        return _key
+    _ensure_dir()
+    path = os.path.join(AUTH_CACHE_DIR, "key")
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, "rb") as f:
+            _key = f.read()
+    else:
+        _key = os.urandom(32)
+        with os.fdopen(fd, "wb") as f:
+            f.write(_key)
+    return _key
+
+
+def _caller() -> tuple[str, str]:
+    """(tty, invoking uid) the token is bound to."""
+    try:
+        tty = os.ttyname(sys.stdin.fileno())
+    except (OSError, ValueError):
+        tty = "notty"
+    uid = os.environ.get("SUDO_UID") or str(os.getuid())
+    return tty, uid
+
+
+def _digest(*parts: str) -> str:
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()[:32]
+
+
+def _token_path(username: str) -> str:
+    tty, uid = _caller()
+    return os.path.join(AUTH_CACHE_DIR, f"{_digest(username)}-{_digest(tty, uid)}.tok")
+
+
+def _fingerprint(row) -> str:
+    return hashlib.sha256(bytes(row["password_hash"]) + b"\0" + row["role"].encode()).hexdigest()
+
+
+def _mac(data: bytes) -> str:
+    return hmac.new(_signing_key(), data, hashlib.sha256).hexdigest()
+
+
+def store(row, plain_password: str):
+    """Issue a token after a successful bcrypt verification of row."""
+    if not enabled():
+        return
+    try:
+        tty, uid = _caller()
+        body = {
+            "username": row["username"],
+            "tty": tty,
+            "uid": uid,
+            "exp": time.time() + AUTH_CACHE_TTL,
+            "fp": _fingerprint(row),
+            "pw": _mac(b"pw\0" + row["username"].encode() + b"\0" + plain_password.encode()),
+        }
+        payload = json.dumps(body, sort_keys=True).encode()
+        path = _token_path(row["username"])
+        tmp = f"{path}.{os.getpid()}"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload + b"\n" + _mac(payload).encode())
+        os.replace(tmp, path)
+    except OSError:
+        # cache is best-effort; never block a login on it
+        pass
+
+
+def lookup(row, plain_password: str) -> bool:
+    """True if a valid token vouches for this password on this account."""
+    if not enabled():
+        return False
+    path = _token_path(row["username"])
+    try:
+        with open(path, "rb") as f:
+            payload, _, sig = f.read().partition(b"\n")
+    except OSError:
+        return False
+
+    try:
+        if not hmac.compare_digest(_mac(payload), sig.decode()):
+            raise ValueError("bad signature")
+        body = json.loads(payload)
+        tty, uid = _caller()
+        valid = (
+            body["username"] == row["username"]
+            and body["tty"] == tty
+            and body["uid"] == uid
+            and body["exp"] > time.time()
+            and hmac.compare_digest(body["fp"], _fingerprint(row))
+        )
+    except (ValueError, KeyError, OSError):
+        valid = False
+
+    if not valid:
+        _unlink(path)
+        return False
+    expected = _mac(b"pw\0" + row["username"].encode() + b"\0" + plain_password.encode())
+    return hmac.compare_digest(body["pw"], expected)
+
+
+def invalidate(username: str):
+    """Drop every token issued for username (all ttys)."""
+    if not enabled():
+        return
+    for path in glob.glob(os.path.join(AUTH_CACHE_DIR, f"{_digest(username)}-*.tok")):
+        _unlink(path)
+
+
+def _unlink(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
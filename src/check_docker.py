@@ -1,11 +1,12 @@
 import docker
 import sys
 
+import docker_client
+
 def check():
     """Check if Docker is available and running."""
     try:
-        client = docker.from_env()
-        info = client.ping()  # raises if not reachable
+        docker_client.ping()  # raises if not reachable
         print("✓ Docker API reachable (ping ok).")
         return True
     except docker.errors.DockerException as e:
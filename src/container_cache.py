@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""Container state cache fed by the Docker events stream.
+
+enter.check_container_running used to inspect the container on every run
+(one or two full round trips). A watcher keeps a name -> state map current
+instead: one `containers(all=True)` listing to seed it, then start / stop /
+die / destroy / rename / ... events from `GET /events`.
+
+The map is published to CONTAINER_CACHE_PATH (root-only tmpfs) together
+with a heartbeat timestamp. Readers only trust it while the heartbeat is
+younger than CONTAINER_CACHE_MAX_AGE; if the watcher is not running or
+lost its stream the cache is stale and callers inspect as before.
+
+    sudo python3 src/container_cache.py watch              # keep the cache warm
+    sudo python3 src/container_cache.py record events.jsonl
+    python3 src/container_cache.py replay events.jsonl      # rebuild map from a fixture
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+CONTAINER_CACHE_PATH = "/run/secure-container-access/containers.json"
+# Seconds after the last watcher heartbeat during which the cache is trusted.
+CONTAINER_CACHE_MAX_AGE = float(os.environ.get("SCAM_CONTAINER_CACHE_MAX_AGE", "15") or 15)
+HEARTBEAT_INTERVAL = 5
+
+# event action -> resulting status (None = container removed)
+_ACTION_STATUS = {
+    "create": "created",
+    "start": "running",
+    "restart": "running",
+    "unpause": "running",
+    "pause": "paused",
+    "stop": "exited",
+    "die": "exited",
+    "oom": None,  # followed by die; keep whatever die says
+    "destroy": None,
+}
+
+
+class ContainerStateCache:
+    """Thread-safe map of container name -> {"id", "status", "image_id"}."""
+
+    def __init__(self):
+        self.containers: dict[str, dict] = {}
+        # wall-clock time the map was last known to be in sync with the daemon
+        self.heartbeat = 0.0
+        # daemon time of the last applied event (used as `since` on reconnect)
+        self.last_event = 0
+        self._lock = threading.Lock()
+
+    # ---- reading -----------------------------------------------------------
+
+    def is_fresh(self, now: float | None = None) -> bool:
+        now = time.time() if now is None else now
+        return now - self.heartbeat <= CONTAINER_CACHE_MAX_AGE
+
+    def get(self, name: str) -> dict | None:
+        """Cached state for name, or None if unknown or the cache is stale."""
+        if not self.is_fresh():
+            return None
+        with self._lock:
+            entry = self.containers.get(name)
+            return dict(entry) if entry else None
+
+    # ---- feeding -----------------------------------------------------------
+
+    def load_listing(self, listing):
+        """Replace the map with the output of APIClient.containers(all=True)."""
+        fresh = {}
+        for c in listing:
+            for raw in c.get("Names") or []:
+                fresh[raw.lstrip("/")] = {
+                    "id": c.get("Id"),
+                    "status": c.get("State"),
+                    "image_id": c.get("ImageID"),
+                }
+        with self._lock:
+            self.containers = fresh
+            self.heartbeat = time.time()
+
+    def apply_event(self, event: dict):
+        """Apply one decoded Docker event (other types/actions are ignored)."""
+        if event.get("Type", event.get("type")) != "container":
+            return
+        # exec_start: bash, health_status: healthy, ... -> not state changes
+        action = (event.get("Action") or event.get("status") or "").split(":")[0]
+        actor = event.get("Actor") or {}
+        attrs = actor.get("Attributes") or {}
+        name = attrs.get("name")
+        cid = actor.get("ID") or event.get("id")
+        if not name:
+            return
+
+        with self._lock:
+            self.last_event = max(self.last_event, int(event.get("time") or 0))
+            if action == "rename":
+                old = (attrs.get("oldName") or "").lstrip("/")
+                entry = self.containers.pop(old, None) or {"id": cid, "status": None, "image_id": None}
+                self.containers[name] = entry
+                return
+            if action == "destroy":
+                self.containers.pop(name, None)
+                return
+            if action not in _ACTION_STATUS or _ACTION_STATUS[action] is None:
+                return
+            entry = self.containers.setdefault(name, {"id": cid, "status": None, "image_id": None})
+            entry["id"] = cid or entry["id"]
+            entry["status"] = _ACTION_STATUS[action]
+            if action == "create":
+                # events carry the image reference, not the resolved ID; force an inspect later
+                entry["image_id"] = None
+
+    def touch(self):
+        self.heartbeat = time.time()
+
+    # ---- persistence -------------------------------------------------------
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "heartbeat": self.heartbeat,
+                "last_event": self.last_event,
+                "containers": dict(self.containers),
+            }
+
+    def save(self, path: str = CONTAINER_CACHE_PATH):
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        # the heartbeat and events threads both save: each gets its own
+        # temporary file (mkstemp creates it 0600)
+        fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.to_dict(), f)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    @classmethod
+    def load(cls, path: str = CONTAINER_CACHE_PATH) -> "ContainerStateCache":
+        cache = cls()
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            cache.containers = data.get("containers") or {}
+            cache.heartbeat = float(data.get("heartbeat") or 0)
+            cache.last_event = int(data.get("last_event") or 0)
+        except (OSError, ValueError):
+            pass
+        return cache
+
+    # ---- live --------------------------------------------------------------
+
+    def sync(self, api):
+        """Seed from one listing call. api is a docker.APIClient (client.api)."""
+        self.load_listing(api.containers(all=True))
+
+    def watch(self, api, *, stop: threading.Event | None = None, path: str | None = None,
+              record=None):
+        """Follow the events stream until stop is set, reconnecting on errors.
+
+        If path is given the map is saved there after every event and on each
+        heartbeat. record, if given, is a file object that receives every raw
+        event as one JSON line (for fixtures).
+        """
+        stop = stop or threading.Event()
+
+        def _heartbeat():
+            while not stop.wait(HEARTBEAT_INTERVAL):
+                if not connected.is_set():
+                    continue
+                try:
+                    self.touch()
+                    if path:
+                        self.save(path)
+                except Exception as e:
+                    print(f"container cache: heartbeat error: {e}", file=sys.stderr)
+
+        connected = threading.Event()
+        threading.Thread(target=_heartbeat, daemon=True).start()
+        while not stop.is_set():
+            try:
+                self.sync(api)
+                since = int(self.heartbeat) - 1
+                stream = api.events(since=since, decode=True, filters={"type": "container"})
+                connected.set()
+                if path:
+                    self.save(path)
+                for event in stream:
+                    if record is not None:
+                        record.write(json.dumps(event) + "\n")
+                        record.flush()
+                    self.apply_event(event)
+                    self.touch()
+                    if path:
+                        self.save(path)
+                    if stop.is_set():
+                        break
+                stream.close()
+            except Exception as e:
+                print(f"container cache: events stream error: {e}", file=sys.stderr)
+            connected.clear()
+            stop.wait(1)
+
+
+def replay(events, cache: ContainerStateCache | None = None) -> ContainerStateCache:
+    """Apply recorded events (iterable of dicts or JSON lines) to a cache."""
+    cache = cache or ContainerStateCache()
+    for ev in events:
+        if isinstance(ev, str):
+            if not ev.strip():
+                continue
+            ev = json.loads(ev)
+        cache.apply_event(ev)
+    cache.touch()
+    return cache
+
+
+_shared = None
+_shared_mtime = None
+
+
+def lookup(name: str) -> dict | None:
+    """State for name from the published cache, None if cold/stale/unknown.
+
+    The file is re-read only when the watcher has rewritten it.
+    """
+    global _shared, _shared_mtime
+    try:
+        mtime = os.stat(CONTAINER_CACHE_PATH).st_mtime_ns
+    except OSError:
+        return None
+    if _shared is None or mtime != _shared_mtime:
+        _shared = ContainerStateCache.load(CONTAINER_CACHE_PATH)
+        _shared_mtime = mtime
+    return _shared.get(name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Docker events driven container state cache")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("watch", help=f"Follow Docker events and publish {CONTAINER_CACHE_PATH}")
+    p_rec = sub.add_parser("record", help="Follow Docker events and append them to a JSONL fixture")
+    p_rec.add_argument("path")
+    p_rep = sub.add_parser("replay", help="Rebuild the map from a JSONL fixture and print it")
+    p_rep.add_argument("path")
+    sub.add_parser("show", help="Print the published cache")
+    args = parser.parse_args()
+
+    if args.cmd in ("watch", "record"):
+        import docker_client
+
+        cache = ContainerStateCache()
+        try:
+            if args.cmd == "watch":
+                cache.watch(docker_client.get_client().api, path=CONTAINER_CACHE_PATH)
+            else:
+                with open(args.path, "a") as f:
+                    cache.watch(docker_client.get_client().api, record=f)
+        except KeyboardInterrupt:
+            pass
+        return
+    if args.cmd == "replay":
+        with open(args.path) as f:
+            data = replay(f).to_dict()
+    else:
+        data = ContainerStateCache.load(CONTAINER_CACHE_PATH).to_dict()
+    for name, entry in sorted(data["containers"].items()):
+        print(f"{name}\t{entry.get('status')}\t{entry.get('id') or ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,54 +1,276 @@
-import sqlite3
-import os
-
-# All users must share the same auth database
-DB_PATH = "/var/lib/secure-container-access/db.sqlite"
-
-def get_conn():
-    # Directory should already exist from setup.py
-    # But try to create it anyway for compatibility
-    try:
-        os.makedirs(os.path.dirname(DB_PATH), mode=0o755, exist_ok=True)
-    except PermissionError:
-        print(f"Error: Cannot access {os.path.dirname(DB_PATH)}")
-        print("Please run 'sudo python3 setup.py' first to initialize the system.")
-        raise
-    
-    try:
-        conn = sqlite3.connect(DB_PATH, timeout=10, check_same_thread=False)
-    except PermissionError:
-        print(f"Error: Cannot access database at {DB_PATH}")
-        print("Please run 'sudo python3 setup.py' first to initialize the system.")
-        raise
-    
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def init_db():
-    conn = get_conn()
-    c = conn.cursor()
-    c.executescript("""
-    CREATE TABLE IF NOT EXISTS users (
-      id INTEGER PRIMARY KEY,
-      username TEXT UNIQUE NOT NULL,
-      password_hash BLOB NOT NULL,
-      role TEXT NOT NULL CHECK(role IN ('admin','user')),	--role constrain admin/user only possilbe 
-      created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    CREATE TABLE IF NOT EXISTS containers (
-      id INTEGER PRIMARY KEY,
-      container_name TEXT UNIQUE NOT NULL,
-      owner_username TEXT,
-      FOREIGN KEY(owner_username) REFERENCES users(username)
-    );
-    CREATE TABLE IF NOT EXISTS access_logs (
-      id INTEGER PRIMARY KEY,
-      username TEXT NOT NULL,
-      container_name TEXT NOT NULL,
-      ts_start TIMESTAMP DEFAULT CURRENT_TIMESTAMP,	-- start time
-      ts_end TIMESTAMP,					-- end time
-      typescript_path TEXT NOT NULL			-- Path to session recording/script
-    );
-    """)
-    conn.commit()
-    conn.close()
+from __future__ import annotations
+
+import sqlite3
+import os
+import threading
+import atexit
+from contextlib import contextmanager
+
+# All users must share the same auth database
+DB_PATH = "/var/lib/secure-container-access/db.sqlite"
+
+# Connection tuning. WAL lets readers proceed while a session start/end is
+# being written; NORMAL sync is safe under WAL (only the last commit can be
+# lost on power failure, the DB never corrupts).
+BUSY_TIMEOUT_MS = 10000
+CACHE_SIZE_KIB = 8192
+MMAP_SIZE = 64 * 1024 * 1024
+
+_local = threading.local()
+_all_conns = []
+_all_lock = threading.Lock()
+_dir_checked = False
+_generation = 0
+
+
+def _ensure_db_dir():
+    global _dir_checked
+    if _dir_checked:
+        return
+    # Directory should already exist from setup.py
+    # But try to create it anyway for compatibility
+    try:
+        os.makedirs(os.path.dirname(DB_PATH), mode=0o755, exist_ok=True)
+    except PermissionError:
+        print(f"Error: Cannot access {os.path.dirname(DB_PATH)}")
+        print("Please run 'sudo python3 setup.py' first to initialize the system.")
+        raise
+    _dir_checked = True
+
+
+def _apply_pragmas(conn):
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    try:
+        conn.execute("PRAGMA journal_mode = WAL")
+    except sqlite3.OperationalError:
+        # read-only DB or filesystem without shared memory support; keep default journal
+        pass
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+
+
+def get_conn():
+    """Open a new, private connection (caller must close it).
+
+    Most code should use connection()/transaction() instead, which reuse a
+    per-thread connection.
+    """
+    _ensure_db_dir()
+
+    try:
+        # isolation_level=None: autocommit, transactions are opened explicitly
+        conn = sqlite3.connect(
+            DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False, isolation_level=None
+        )
+    except (PermissionError, sqlite3.OperationalError):
+        print(f"Error: Cannot access database at {DB_PATH}")
+        print("Please run 'sudo python3 setup.py' first to initialize the system.")
+        raise
+
+    conn.row_factory = sqlite3.Row
+    _apply_pragmas(conn)
+    return conn
+
+
+def connection():
+    """Return this thread's long-lived connection, opening it on first use.
+
+    Connections are not shared across threads or across fork(); a child
+    process transparently gets its own.
+    """
+    conn = getattr(_local, "conn", None)
+    if (conn is not None and _local.pid == os.getpid()
+            and _local.path == DB_PATH and _local.gen == _generation):
+        return conn
+    conn = get_conn()
+    _local.conn = conn
+    _local.pid = os.getpid()
+    _local.path = DB_PATH
+    _local.gen = _generation
+    with _all_lock:
+        _all_conns.append(conn)
+    return conn
+
+
+@contextmanager
+def transaction(*, immediate=False):
+    """Run a block inside one transaction on the pooled connection.
+
+    Commits on success, rolls back on any exception. With immediate=True the
+    write lock is taken up front (BEGIN IMMEDIATE), which avoids lock
+    upgrade deadlocks for read-then-write sequences. Nested use joins the
+    outer transaction.
+    """
+    conn = connection()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
+
+def close_all():
+    """Close every pooled connection opened by this process."""
+    global _generation
+    with _all_lock:
+        _generation += 1
+        conns = list(_all_conns)
+        _all_conns.clear()
+    for conn in conns:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+atexit.register(close_all)
+
+
+# Versioned schema. Each entry is (version, description, statements); the
+# statements of one migration are applied in a single transaction together
+# with the schema_version row. Never edit a released migration, append a new
+# one instead.
+MIGRATIONS = [
+    (1, "initial schema", [
+        """CREATE TABLE IF NOT EXISTS users (
+          id INTEGER PRIMARY KEY,
+          username TEXT UNIQUE NOT NULL,
+          password_hash BLOB NOT NULL,
+          role TEXT NOT NULL CHECK(role IN ('admin','user')),	--role constrain admin/user only possilbe
+          created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        """CREATE TABLE IF NOT EXISTS containers (
+          id INTEGER PRIMARY KEY,
+          container_name TEXT UNIQUE NOT NULL,
+          owner_username TEXT,
+          FOREIGN KEY(owner_username) REFERENCES users(username)
+        )""",
+        """CREATE TABLE IF NOT EXISTS access_logs (
+          id INTEGER PRIMARY KEY,
+          username TEXT NOT NULL,
+          container_name TEXT NOT NULL,
+          ts_start TIMESTAMP DEFAULT CURRENT_TIMESTAMP,	-- start time
+          ts_end TIMESTAMP,					-- end time
+          typescript_path TEXT NOT NULL			-- Path to session recording/script
+        )""",
+    ]),
+    (2, "access_logs and containers lookup indexes", [
+        # per-user audit trail, newest first
+        "CREATE INDEX IF NOT EXISTS idx_access_logs_user_ts ON access_logs(username, ts_start)",
+        # per-container audit trail / time windows
+        "CREATE INDEX IF NOT EXISTS idx_access_logs_container_ts ON access_logs(container_name, ts_start)",
+        # sessions still in progress (small: only rows without ts_end)
+        "CREATE INDEX IF NOT EXISTS idx_access_logs_open ON access_logs(ts_start) WHERE ts_end IS NULL",
+        # containers owned by a user
+        "CREATE INDEX IF NOT EXISTS idx_containers_owner ON containers(owner_username)",
+    ]),
+    (3, "users (role, username) index for paged listing", [
+        "CREATE INDEX IF NOT EXISTS idx_users_role_username ON users(role, username)",
+    ]),
+    (4, "full-text index over recorded sessions", [
+        # the FTS5 table itself (session_text) is created on first use by
+        # session_index.py: not every SQLite build has FTS5, and the
+        # migrations after this one must apply without it
+        """CREATE TABLE IF NOT EXISTS session_index_state (
+          log_id INTEGER PRIMARY KEY,
+          lines INTEGER NOT NULL,
+          indexed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+          FOREIGN KEY(log_id) REFERENCES access_logs(id)
+        )""",
+    ]),
+    (5, "access_logs.pid for reconciling sessions of dead processes", [
+        "ALTER TABLE access_logs ADD COLUMN pid INTEGER",
+    ]),
+    (6, "per-session metadata columns", [
+        # terminal traffic (bytes typed / shown) and its peak rate
+        "ALTER TABLE access_logs ADD COLUMN bytes_in INTEGER",
+        "ALTER TABLE access_logs ADD COLUMN bytes_out INTEGER",
+        "ALTER TABLE access_logs ADD COLUMN peak_out_bps INTEGER",
+        # exit status of docker exec (negative = killed by signal), wall time
+        "ALTER TABLE access_logs ADD COLUMN exit_code INTEGER",
+        "ALTER TABLE access_logs ADD COLUMN duration_ms INTEGER",
+        # container resource usage during the session (Docker stats API)
+        "ALTER TABLE access_logs ADD COLUMN cpu_ms INTEGER",
+        "ALTER TABLE access_logs ADD COLUMN mem_peak_bytes INTEGER",
+        "ALTER TABLE access_logs ADD COLUMN mem_delta_bytes INTEGER",
+    ]),
+    (7, "shell found in each container image", [
+        # image IDs are content hashes, so an entry never goes stale; a
+        # container moved to another image simply misses (see exec_session).
+        # shell '' = the image has no usable shell
+        """CREATE TABLE IF NOT EXISTS image_shells (
+          image_id TEXT PRIMARY KEY,
+          shell TEXT NOT NULL,
+          probed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# DB_PATH that has already been brought up to SCHEMA_VERSION in this process
+_migrated_path = None
+_migrate_lock = threading.Lock()
+
+
+def _schema_version(conn) -> int:
+    try:
+        row = conn.execute("SELECT MAX(version) AS v FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        # table does not exist yet (fresh DB or pre-migration DB)
+        return 0
+    return int(row["v"] or 0)
+
+
+def migrate(target: int | None = None) -> int:
+    """Apply pending migrations and return the resulting schema version.
+
+    Idempotent and safe to race against other processes: the version is
+    re-read under the write lock before anything is applied. target stops
+    at an older version (used by benchmarks to compare schemas).
+    """
+    if target is None:
+        target = SCHEMA_VERSION
+    current = _schema_version(connection())
+    if current >= target:
+        return current
+
+    with transaction(immediate=True) as conn:
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS schema_version (
+              version INTEGER PRIMARY KEY,
+              description TEXT NOT NULL,
+              applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )"""
+        )
+        current = _schema_version(conn)
+        for version, description, statements in MIGRATIONS:
+            if version <= current or version > target:
+                continue
+            for stmt in statements:
+                conn.execute(stmt)
+            conn.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description),
+            )
+            current = version
+    return current
+
+
+def init_db():
+    """Make sure the schema is current. Only the first call per process does any work."""
+    global _migrated_path
+    if _migrated_path == DB_PATH:
+        return
+    with _migrate_lock:
+        if _migrated_path != DB_PATH:
+            migrate()
+            _migrated_path = DB_PATH
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Process-wide Docker SDK client.
+
+docker.from_env() builds a new requests session (and a new unix socket
+connection pool) every time, and with no explicit API version it also
+issues GET /version first. Everything in this tool talks to the same local
+daemon, so we create one client lazily and reuse its pooled connections.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+
+import docker
+
+# Seconds before a Docker API call gives up.
+DOCKER_TIMEOUT = float(os.environ.get("SCAM_DOCKER_TIMEOUT", "10") or 10)
+# Keep-alive connections held open to the daemon socket.
+DOCKER_POOL_SIZE = int(os.environ.get("SCAM_DOCKER_POOL_SIZE", "4") or 4)
+# Pin the API version (e.g. "1.43") to skip the GET /version probe; empty = auto.
+DOCKER_API_VERSION = os.environ.get("SCAM_DOCKER_API_VERSION") or None
+
+_client = None
+_pinged = False
+_lock = threading.Lock()
+
+
+def get_client() -> docker.DockerClient:
+    """Return the shared client, creating it on first use.
+
+    Raises docker.errors.DockerException if the daemon cannot be reached.
+    """
+    global _client
+    with _lock:
+        if _client is None:
+            kwargs = {"timeout": DOCKER_TIMEOUT, "max_pool_size": DOCKER_POOL_SIZE}
+            if DOCKER_API_VERSION:
+                kwargs["version"] = DOCKER_API_VERSION
+            _client = docker.from_env(**kwargs)
+        return _client
+
+
+def ping() -> bool:
+    """Health-check the daemon once per process; later calls return the cached result.
+
+    Raises docker.errors.DockerException (or a connection error) on failure,
+    in which case the next call pings again.
+    """
+    global _pinged
+    if _pinged:
+        return True
+    get_client().ping()
+    _pinged = True
+    return True
+
+
+def after_fork():
+    """Call in a forked child that keeps using the client (see gatekeeper).
+
+    The client and its negotiated API version are kept, but the pooled
+    connections are the parent's sockets; drop them so the child opens its own.
+    """
+    global _lock
+    _lock = threading.Lock()
+    if _client is not None:
+        _client.api.close()
+
+
+def reset():
+    """Drop the shared client (e.g. after fork or when the daemon restarted)."""
+    global _client, _pinged
+    with _lock:
+        client, _client = _client, None
+        _pinged = False
+    if client is not None:
+        try:
+            client.close()
+        except Exception:
+            pass
@@ -7,46 +7,60 @@ import getpass
 import sqlite3
 import shutil
 import pty
+import signal
 import subprocess
-from datetime import datetime, timezone
-from db import init_db, get_conn
-import docker
-import bcrypt
+import time
+from db import init_db, connection, transaction
+import access_log
+import container_cache
+import recorder
+import session_stats
+import session_store
+from session_store import TYPESCRIPT_DIR
 
-# System-wide session recording path
-TYPESCRIPT_DIR = "/var/log/secure-container-access/sessions"
+# "cast": timed asciicast recording with seek index (see recorder/replay)
+# "typescript": raw `script -q` output as before
+SESSION_FORMAT = os.environ.get("SCAM_SESSION_FORMAT", "cast")
 
-# Don't fail on import if directory doesn't exist yet
-# It should be created by setup.py
-if not os.path.exists(TYPESCRIPT_DIR):
-    try:
-        os.makedirs(TYPESCRIPT_DIR, mode=0o750, exist_ok=True)
-    except PermissionError:
-        # Will fail later when trying to record, but allow import
-        pass
+# Inline compression of recordings written by the pty recorder: "gzip"
+# (default), "zstd" (needs the zstandard package, else gzip) or "none".
+SESSION_COMPRESSION = recorder.effective_compression(os.environ.get("SCAM_SESSION_COMPRESSION", "gzip"))
+_level = os.environ.get("SCAM_SESSION_COMPRESSION_LEVEL")
+SESSION_COMPRESSION_LEVEL = int(_level) if _level else None
+
+# Add each finished session to the full-text search index (session_index.py)
+SESSION_INDEX = os.environ.get("SCAM_SESSION_INDEX", "1") != "0"
 
-def check_password(plain, hashed):
-    return bcrypt.checkpw(plain.encode(), hashed)
+# "sdk" (default): sessions run through the Docker API in-process (see
+# exec_session); "cli": the docker CLI on a pty, or `script` for typescripts
+EXEC_BACKEND = os.environ.get("SCAM_EXEC_BACKEND") or "sdk"
 
 def authenticate():
     username = input("Username: ").strip()
     pw = getpass.getpass("Password: ")
-    conn = get_conn()
-    row = conn.execute("SELECT username, password_hash, role FROM users WHERE username = ?", (username,)).fetchone()
-    conn.close()
+    # bcrypt is only needed from here on; keep it off the path to the prompt
+    from accounts import get_user, password_matches
+    row = get_user(username)
     if not row:
         print("No such user.")
         return None
-    if check_password(pw, row["password_hash"]):
+    if password_matches(row, pw):
         return {"username": row["username"], "role": row["role"]}
     else:
         print("Wrong password.")
         return None
 
 def check_container_running(container_name):
-    client = docker.from_env()
+    # fast path: events-driven cache (see container_cache); only trusted while
+    # its watcher is alive, and only for the positive answer
+    cached = container_cache.lookup(container_name)
+    if cached and cached.get("status") == "running":
+        return True, None
+    # the Docker SDK takes ~100ms to import; load it only once we need it
+    import docker
+    import docker_client
     try:
-        cont = client.containers.get(container_name)
+        cont = docker_client.get_client().containers.get(container_name)
     except docker.errors.NotFound:
         return False, "not found"
     except Exception as e:
@@ -63,9 +77,7 @@ def check_container_running(container_name):
     return True, None
 
 def get_container_owner(container_name):
-    conn = get_conn()
-    row = conn.execute("SELECT owner_username FROM containers WHERE container_name = ?", (container_name,)).fetchone()
-    conn.close()
+    row = connection().execute("SELECT owner_username FROM containers WHERE container_name = ?", (container_name,)).fetchone()
     return row["owner_username"] if row else None
 
 def claim_container_if_unclaimed(container_name, username):
@@ -73,71 +85,85 @@ def claim_container_if_unclaimed(container_name, username):
     Try to claim container atomically using a DB transaction.
     Returns True if claimed (or already owned by username), False if owned by someone else.
     """
-    conn = get_conn()
     try:
         # acquire write lock to minimize race
-        conn.execute("BEGIN IMMEDIATE")
-        row = conn.execute("SELECT owner_username FROM containers WHERE container_name = ?", (container_name,)).fetchone()
-        if row is None:
-            # not present: insert new claimed row
-            conn.execute("INSERT INTO containers (container_name, owner_username) VALUES (?, ?)",
-                         (container_name, username))
-            conn.commit()
-            return True, None
-        owner = row["owner_username"]
-        if owner is None:
-            conn.execute("UPDATE containers SET owner_username = ? WHERE container_name = ?", (username, container_name))
-            conn.commit()
-            return True, None
-        if owner == username:
-            return True, None
-        return False, owner
+        with transaction(immediate=True) as conn:
+            row = conn.execute("SELECT owner_username FROM containers WHERE container_name = ?", (container_name,)).fetchone()
+            if row is None:
+                # not present: insert new claimed row
+                conn.execute("INSERT INTO containers (container_name, owner_username) VALUES (?, ?)",
+                             (container_name, username))
+                return True, None
+            owner = row["owner_username"]
+            if owner is None:
+                conn.execute("UPDATE containers SET owner_username = ? WHERE container_name = ?", (username, container_name))
+                return True, None
+            if owner == username:
+                return True, None
+            return False, owner
     except sqlite3.OperationalError as e:
-        # lock failure or similar
-        conn.rollback()
+        # lock failure or similar (rolled back by transaction())
         return False, f"db error: {e}"
-    finally:
-        conn.close()
 
 def log_session_start(username, container_name, typescript_path):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("INSERT INTO access_logs (username, container_name, typescript_path) VALUES (?, ?, ?)",
-              (username, container_name, typescript_path))
-    conn.commit()
-    lid = c.lastrowid
-    conn.close()
-    return lid
+    # committed by the batched writer (see access_log); waits for the row id
+    return access_log.log_session_start(username, container_name, typescript_path)
+
+def log_session_end(log_id, **meta):
+    # queued; flushed at exit, or closed by reconcile_open_sessions() after a crash
+    access_log.log_session_end(log_id, **meta)
 
-def log_session_end(log_id):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("UPDATE access_logs SET ts_end = CURRENT_TIMESTAMP WHERE id = ?", (log_id,))
-    conn.commit()
-    conn.close()
+def _safe_typescript_name(container_name, username, ext=".log"):
+    """Generate safe typescript filename in its date/container shard (see session_store)."""
+    try:
+        return session_store.session_path(container_name, username, ext)
+    except PermissionError:
+        print(f"Error: Cannot create session recording directory under {TYPESCRIPT_DIR}")
+        print("Please run 'sudo python3 setup.py' first to initialize the system.")
+        raise
 
-def _safe_typescript_name(container_name, username):
-    """Generate safe typescript filename and ensure directory exists."""
-    # Ensure typescript directory exists
-    if not os.path.exists(TYPESCRIPT_DIR):
+def _docker_cli_session(container_name, shell, sink):
+    """docker exec on a pty (EXEC_BACKEND "cli"), relayed and recorded to sink."""
+    master_fd, slave_fd = pty.openpty()
+    pid = os.fork()
+    if pid == 0:
+        # child -> become the docker exec process attached to pty slave
+        os.setsid()
+        os.dup2(slave_fd, 0)
+        os.dup2(slave_fd, 1)
+        os.dup2(slave_fd, 2)
+        if slave_fd > 2:
+            os.close(slave_fd)
         try:
-            os.makedirs(TYPESCRIPT_DIR, mode=0o750, exist_ok=True)
-        except PermissionError:
-            print(f"Error: Cannot create session recording directory {TYPESCRIPT_DIR}")
-            print("Please run 'sudo python3 setup.py' first to initialize the system.")
-            raise
-    
-    safe = "".join(ch if (ch.isalnum() or ch in "-_.") else "_" for ch in f"{container_name}_{username}")
-    ts_name = f"{safe}_{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}.log"
-    return os.path.join(TYPESCRIPT_DIR, ts_name)
+            os.execvp("docker", ["docker", "exec", "-it", container_name, shell])
+        finally:
+            # if exec fails, exit child
+            os._exit(127)
+    # parent: relay terminal <-> pty and record output (see recorder)
+    os.close(slave_fd)
+    try:
+        return recorder.relay(master_fd, sink, child_pid=pid)
+    finally:
+        os.close(master_fd)
 
 def spawn_and_record(container_name, username):
     """
-    Tries to use "script" command if available (nicer with control sequences).
-    Otherwise falls back to pty.fork & os-level piping to record raw bytes.
+    With SESSION_FORMAT "cast" (default) runs the shell through the Docker
+    API in-process (see exec_session) and records a timed asciicast file
+    plus seek index through recorder.CastWriter.
+    With "typescript" the pty recorder writes raw bytes instead.
+    SCAM_EXEC_BACKEND=cli runs the docker CLI on a pty instead of the API,
+    and for "typescript" uses the "script" command if available.
     Returns True on success.
     """
-    ts_path = _safe_typescript_name(container_name, username)
+    use_cast = SESSION_FORMAT == "cast"
+    use_sdk = EXEC_BACKEND == "sdk"
+    # Determine if `script` is available
+    script_bin = None if use_cast or use_sdk else shutil.which("script")
+    # `script` writes its own plain file; only the pty recorder compresses
+    compression = None if script_bin else SESSION_COMPRESSION
+    ext = (".cast" if use_cast else ".log") + recorder.COMPRESSION_SUFFIX[compression]
+    ts_path = _safe_typescript_name(container_name, username, ext)
 
     # minimal sanitization for docker exec args:
     if not all(ch.isalnum() or ch in "-_./" for ch in container_name):
@@ -147,67 +173,54 @@ def spawn_and_record(container_name, username):
     # log DB entry before spawn to get id
     log_id = log_session_start(username, container_name, ts_path)
 
-    shell_candidates = ["/bin/bash", "/bin/sh"]
-    # build docker exec arguments; we'll let docker pick a shell (try bash then sh)
-    # Determine if `script` is available
-    script_bin = shutil.which("script")
+    # per-session metadata written with the end record (see access_log.END_COLUMNS)
+    meta = {}
+    started = time.monotonic()
+    sampler = None
 
     try:
+        import exec_session
+        api = None
+        if use_sdk or session_stats.STATS_INTERVAL > 0:
+            # the Docker SDK takes ~100ms to import; load it only once we need it
+            import docker_client
+            api = docker_client.get_client().api
+        # bash if the image has it, else sh; probed once per image through
+        # the selected backend (see exec_session)
+        shell = exec_session.detect_shell(api if use_sdk else None, container_name)
+        if shell is None:
+            print("No shell found inside container (looked for bash/sh).")
+            return False
+        if session_stats.STATS_INTERVAL > 0:
+            sampler = session_stats.ContainerStatsSampler(api, container_name).start()
         print("Starting session. Typescript:", ts_path)
         print("Type 'exit' or Ctrl-D to finish the session.")
 
         if script_bin:
             # Use script to record: script -q <ts_path> -c "docker exec -it <container> <shell>"
-            # For portability pass an explicit shell; we try bash first then sh.
-            for sh in shell_candidates:
-                cmd = ["script", "-q", ts_path, "-c", f"docker exec -it {container_name} {sh}"]
-                # run as subprocess so we can continue afterwards
-                rc = subprocess.call(cmd)
-                if rc == 0:
-                    break
-                # non-zero return likely means shell not found inside container; try next shell
-            else:
-                print("Failed to start shell inside container (tried bash/sh).")
-                return False
+            # run as subprocess so we can continue afterwards; -e returns the
+            # session's own exit status (the shell is known to exist)
+            cmd = ["script", "-q", "-e", ts_path, "-c", f"docker exec -it {container_name} {shell}"]
+            meta["exit_code"] = subprocess.call(cmd)
         else:
-            # fallback: pty.spawn approach using fork
-            master_fd, slave_fd = pty.openpty()
-            pid = os.fork()
-            if pid == 0:
-                # child -> become the docker exec process attached to pty slave
-                os.setsid()
-                os.dup2(slave_fd, 0)
-                os.dup2(slave_fd, 1)
-                os.dup2(slave_fd, 2)
-                if slave_fd > 2:
-                    os.close(slave_fd)
-                # try each shell candidate; if bash not present docker will return non-zero and exit
-                for sh in shell_candidates:
-                    os.execvp("docker", ["docker", "exec", "-it", container_name, sh])
-                # if exec returns, exit child
-                os._exit(127)
+            if use_cast:
+                cols, rows = shutil.get_terminal_size()
+                sink = recorder.CastWriter(ts_path, width=cols, height=rows,
+                                           title=f"{username}@{container_name}",
+                                           compression=compression, level=SESSION_COMPRESSION_LEVEL)
             else:
-                # parent: read from master_fd and write both to stdout and logfile
-                with open(ts_path, "wb") as f:
-                    try:
-                        while True:
-                            try:
-                                data = os.read(master_fd, 4096)
-                            except OSError:
-                                break
-                            if not data:
-                                break
-                            # write to terminal
-                            os.write(sys.stdout.fileno(), data)
-                            # write to file
-                            f.write(data)
-                            f.flush()
-                    finally:
-                        # ensure child cleaned up
-                        try:
-                            os.waitpid(pid, 0)
-                        except ChildProcessError:
-                            pass
+                sink = recorder.TypescriptWriter(ts_path, compression=compression,
+                                                 level=SESSION_COMPRESSION_LEVEL)
+            try:
+                if use_sdk:
+                    relay_stats = exec_session.run(api, container_name, shell, sink)
+                else:
+                    relay_stats = _docker_cli_session(container_name, shell, sink)
+                meta.update(bytes_in=relay_stats.bytes_in, bytes_out=relay_stats.bytes_out,
+                            peak_out_bps=int(relay_stats.peak_out_rate),
+                            exit_code=relay_stats.exit_status)
+            finally:
+                sink.close()
 
         # set restrictive perms on log
         try:
@@ -225,25 +238,44 @@ def spawn_and_record(container_name, username):
         return False
     finally:
         # ensure we always write session end timestamp
+        meta["duration_ms"] = int((time.monotonic() - started) * 1000)
+        if sampler is not None:
+            try:
+                meta.update(sampler.stop())
+            except Exception:
+                pass
         try:
-            log_session_end(log_id)
+            log_session_end(log_id, **meta)
         except Exception:
             pass
+        if SESSION_INDEX:
+            try:
+                import session_index
+                session_index.index_in_background(log_id)
+            except Exception:
+                # searchable later via `session_index.py index`
+                pass
 
-def main():
-    init_db()
+def _exit_on_signal(signum, frame):
+    # turn SIGTERM/SIGHUP (terminal closed) into a normal exit so the
+    # session end is logged and queued access_logs writes are flushed
+    raise SystemExit(128 + signum)
+
+def enter_container(container=None):
+    """
+    authenticate -> check_container_running -> ownership -> spawn_and_record.
+    Asks for the container if none is given. Returns True if a session ran
+    and finished normally. Used by main() and by the gatekeeper daemon.
+    """
     user = authenticate()
     if not user:
-        return
-    # Check if container name provided as argument
-    if len(sys.argv) > 1:
-        container = sys.argv[1].strip()
-    else:
+        return False
+    if not container:
         container = input("Container to enter: ").strip()
     ok, err = check_container_running(container)
     if not ok:
         print("Cannot enter:", err)
-        return
+        return False
 
     owner = get_container_owner(container)
     if owner is None:
@@ -253,12 +285,12 @@ def main():
             claimed, info = claim_container_if_unclaimed(container, user["username"])
             if not claimed:
                 print("Could not claim container. Owner:", info)
-                return
+                return False
             else:
                 print("Claim successful. You are now owner of", container)
         else:
             print("Not claiming. Aborting.")
-            return
+            return False
 
     owner = get_container_owner(container)  # refresh
     if user["role"] == "admin" or user["username"] == owner:
@@ -267,8 +299,21 @@ def main():
             print("Goodbye.")
         else:
             print("Session failed or interrupted.")
+        return success
     else:
         print(f"Access denied. Owner: {owner}. Your role: {user['role']}")
+        return False
+
+def main():
+    init_db()
+    signal.signal(signal.SIGTERM, _exit_on_signal)
+    signal.signal(signal.SIGHUP, _exit_on_signal)
+    try:
+        access_log.reconcile_open_sessions()
+    except sqlite3.OperationalError:
+        pass
+    # Check if container name provided as argument
+    enter_container(sys.argv[1].strip() if len(sys.argv) > 1 else None)
 
 if __name__ == "__main__":
     main()
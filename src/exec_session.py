@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""In-process `docker exec` for enter.spawn_and_record.
+
+The old path ran `script -q <file> -c "docker exec -it <c> /bin/bash"`, and
+ran it again with /bin/sh if that failed: a fork, the script binary and a
+docker CLI process per attempt, each re-reading its config and opening a
+new connection to the daemon. Here the session is an exec instance created
+through the shared Docker SDK client (see docker_client):
+
+    exec_create(tty, stdin) -> exec_start(socket=True) -> recorder.relay()
+
+The hijacked API connection is relayed like the pty master was and
+recorded in-process by the same sinks. Terminal size changes become
+exec_resize calls.
+
+The shell is chosen once per image with a single probe exec and stored in
+the image_shells table, keyed by image ID: later sessions, from any user,
+skip the probe. A container recreated from another image has another image
+ID and is probed again.
+SCAM_EXEC_BACKEND=cli (see enter.py) goes back to the docker CLI. The
+shell is then probed and cached the same way, but through `docker exec`
+and `docker inspect`, without the SDK.
+
+    python3 bench/bench_exec.py <container>   # compare with the script path
+"""
+
+from __future__ import annotations
+
+import io
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+
+import container_cache
+import recorder
+from db import connection, transaction
+
+# Runs inside the container: prints the shell a session should use.
+SHELL_PROBE = "if [ -x /bin/bash ]; then echo /bin/bash; elif [ -x /bin/sh ]; then echo /bin/sh; fi"
+
+# image ID -> shell path ("" = the image has no usable shell); in front of
+# the image_shells table for processes that enter more than once
+_shells: dict[str, str] = {}
+
+
+def image_id(api, container: str) -> str | None:
+    """ID of the image the container runs, from the state cache if it knows it.
+
+    With api None it is asked from the docker CLI (None if that fails).
+    """
+    cached = container_cache.lookup(container)
+    if cached and cached.get("image_id"):
+        return cached["image_id"]
+    if api is not None:
+        return api.inspect_container(container)["Image"]
+    proc = subprocess.run(["docker", "inspect", "--type", "container", "--format", "{{.Image}}", container],
+                          stdin=subprocess.DEVNULL, capture_output=True, text=True)
+    return (proc.stdout.strip() or None) if proc.returncode == 0 else None
+
+
+def probe_shell(api, container: str) -> str | None:
+    """Ask the container which shell to use; one exec (`docker exec` if api is None).
+
+    Returns the shell, "" if the image has none, or None if the probe
+    itself failed (nothing to cache then).
+    """
+    if api is None:
+        proc = subprocess.run(["docker", "exec", container, "/bin/sh", "-c", SHELL_PROBE],
+                              stdin=subprocess.DEVNULL, capture_output=True)
+        output, code = proc.stdout, proc.returncode
+    else:
+        # imported here: the cli backend uses this module without the SDK
+        from docker.errors import APIError
+
+        exec_id = api.exec_create(container, ["/bin/sh", "-c", SHELL_PROBE])["Id"]
+        try:
+            output = api.exec_start(exec_id)
+            code = api.exec_inspect(exec_id).get("ExitCode")
+        except APIError:
+            return None
+    if code in (126, 127):
+        # no /bin/sh to run the probe with (distroless and the like)
+        return ""
+    if code != 0:
+        return None
+    shell = output.decode(errors="replace").strip()
+    return shell if shell.startswith("/") else ""
+
+
+def cached_shell(image: str) -> str | None:
+    """Shell recorded for image, "" for none, None if it was never probed."""
+    if image in _shells:
+        return _shells[image]
+    row = connection().execute("SELECT shell FROM image_shells WHERE image_id = ?", (image,)).fetchone()
+    if row is None:
+        return None
+    _shells[image] = row["shell"]
+    return row["shell"]
+
+
+def remember_shell(image: str, shell: str):
+    _shells[image] = shell
+    try:
+        with transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO image_shells (image_id, shell) VALUES (?, ?)", (image, shell))
+    except sqlite3.OperationalError:
+        # still cached for this process; the next one probes again
+        pass
+
+
+def detect_shell(api, container: str) -> str | None:
+    """Shell for container: probed once per image, then read from the DB.
+
+    api is a docker.APIClient, or None to go through the docker CLI.
+    """
+    image = image_id(api, container)
+    shell = cached_shell(image) if image else None
+    if shell is None:
+        shell = probe_shell(api, container)
+        if shell is None:
+            return None
+        if image:
+            remember_shell(image, shell)
+    return shell or None
+
+
+def _read_ahead(sock) -> bytes:
+    """Bytes the HTTP layer buffered past the upgrade response, b"" if none.
+
+    There is no public interface for them: docker-py hands out the raw
+    socket under http.client's buffered reader (response.raw._fp.fp). The
+    layout is checked before reading, and anything unexpected counts as an
+    empty buffer; the daemon normally sends the first output after the
+    headers anyway.
+    """
+    response = getattr(sock, "_response", None)
+    try:
+        reader = response.raw._fp.fp
+    except AttributeError:
+        return b""
+    if not isinstance(reader, io.BufferedReader) or reader.raw is not sock:
+        return b""
+    try:
+        # the socket is non-blocking: this returns what is buffered and
+        # never waits for more
+        return reader.read1(65536) or b""
+    except (BlockingIOError, ValueError):
+        return b""
+
+
+class ExecSession:
+    """An interactive exec instance attached over the API connection.
+
+    start() returns the connection's file descriptor; read and write it
+    like a pty master. Output the HTTP layer already buffered while reading
+    the upgrade response is in `pending` and must be shown first.
+    """
+
+    def __init__(self, api, container: str, cmd: list, *, environment: dict | None = None):
+        self.api = api
+        self.exec_id = api.exec_create(container, cmd, stdin=True, tty=True, environment=environment)["Id"]
+        self.pending = b""
+        self._sock = None
+
+    def start(self, cols: int, rows: int) -> int:
+        self._sock = self.api.exec_start(self.exec_id, tty=True, socket=True)
+        fd = self._sock.fileno()
+        os.set_blocking(fd, False)
+        self.pending = _read_ahead(self._sock)
+        self.resize(cols, rows)
+        return fd
+
+    def resize(self, cols: int, rows: int):
+        from docker.errors import APIError
+
+        try:
+            self.api.exec_resize(self.exec_id, height=rows, width=cols)
+        except APIError:
+            # the exec already ended
+            pass
+
+    def exit_code(self, wait: float = 1.0) -> int | None:
+        """Exit code of the command; the daemon records it just after the stream ends."""
+        deadline = time.monotonic() + wait
+        while True:
+            info = self.api.exec_inspect(self.exec_id)
+            if not info.get("Running") or time.monotonic() >= deadline:
+                return info.get("ExitCode")
+            time.sleep(0.02)
+
+    def close(self):
+        if self._sock is not None:
+            # closing the connection hangs up the exec's terminal
+            self._sock.close()
+            self._sock = None
+
+
+def run(api, container: str, shell: str, sink, *, stdin_fd: int | None = None,
+        stdout_fd: int | None = None) -> recorder.RelayStats:
+    """Run shell in container on the caller's terminal, recording to sink."""
+    stdout_fd = sys.stdout.fileno() if stdout_fd is None else stdout_fd
+    session = ExecSession(api, container, [shell],
+                          environment={"TERM": os.environ.get("TERM") or "xterm"})
+    cols, rows = shutil.get_terminal_size()
+    try:
+        fd = session.start(cols, rows)
+        if session.pending:
+            recorder._write_all(stdout_fd, session.pending)
+            sink.write_output(session.pending, time.monotonic())
+        stats = recorder.relay(fd, sink, stdin_fd=stdin_fd, stdout_fd=stdout_fd, on_resize=session.resize)
+    finally:
+        session.close()
+    from docker.errors import APIError
+
+    try:
+        stats.exit_status = session.exit_code()
+    except APIError:
+        pass
+    return stats
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""Long-running gatekeeper daemon.
+
+Every `sudo enter.py` starts a fresh interpreter, imports docker, requests
+and bcrypt, opens the database and negotiates with the Docker daemon
+before the first prompt. The gatekeeper does that once: it runs as root,
+keeps the database, the Docker client and the container state cache warm,
+and serves entries over a unix socket.
+
+A client (gatekeeper_client.py, no sudo and no third-party imports)
+connects and hands over its terminal: stdin/stdout/stderr travel as
+SCM_RIGHTS ancillary data with the request. The caller is identified with
+SO_PEERCRED and must be root or in GATEKEEPER_GROUP. The daemon forks a
+worker per accepted connection; the worker receives the request and runs
+the usual enter.enter_container() flow (authenticate ->
+check_container_running -> ownership -> spawn_and_record) directly on the
+client's terminal. The pty and the recording stay in the
+root worker, so a client cannot get at the session without it being
+recorded.
+
+After the handshake the socket only carries control traffic:
+- client -> worker: b"W" when the terminal was resized;
+- client -> worker: EOF when the client went away (the session is hung up);
+- worker -> client: one JSON line {"status": <exit code>} at the end.
+
+    sudo python3 src/gatekeeper.py serve
+    python3 src/gatekeeper_client.py web
+"""
+
+from __future__ import annotations
+
+import argparse
+import grp
+import json
+import os
+import pwd
+import signal
+import socket
+import sqlite3
+import struct
+import sys
+import threading
+
+import access_log
+import accounts
+import container_cache
+import docker
+import docker_client
+import enter
+from db import init_db
+
+GATEKEEPER_SOCKET = os.environ.get("SCAM_GATEKEEPER_SOCKET") or "/run/secure-container-access/gatekeeper.sock"
+# Group whose members may connect (besides root); also the socket's group
+GATEKEEPER_GROUP = os.environ.get("SCAM_GATEKEEPER_GROUP") or "developers"
+# Seconds a client gets to send its request after connecting
+HANDSHAKE_TIMEOUT = 5
+MAX_REQUEST = 4096
+
+_UCRED = struct.Struct("3i")
+
+
+def peer_credentials(conn: socket.socket) -> tuple[int, int, int]:
+    """(pid, uid, gid) of the process on the other end, from the kernel."""
+    return _UCRED.unpack(conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, _UCRED.size))
+
+
+def _group_gid(name: str):
+    try:
+        return grp.getgrnam(name).gr_gid
+    except KeyError:
+        return None
+
+
+def caller_allowed(uid: int, group: str = GATEKEEPER_GROUP) -> bool:
+    if uid == 0:
+        return True
+    gid = _group_gid(group)
+    if gid is None:
+        return False
+    try:
+        pw = pwd.getpwuid(uid)
+    except KeyError:
+        return False
+    return gid in os.getgrouplist(pw.pw_name, pw.pw_gid)
+
+
+def _send(conn: socket.socket, message: dict):
+    try:
+        conn.sendall((json.dumps(message) + "\n").encode())
+    except OSError:
+        pass
+
+
+def _reap(signum, frame):
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+
+
+# ---- worker (one forked process per session) --------------------------------
+
+def _control_loop(conn: socket.socket, finished: threading.Event):
+    """Turn client control traffic into signals for the main thread.
+
+    recorder.relay() resizes the pty on SIGWINCH (reading the size from the
+    client's terminal), and enter turns SIGHUP into a normal exit.
+    """
+    while True:
+        try:
+            data = conn.recv(64)
+        except OSError:
+            data = b""
+        if finished.is_set():
+            return
+        if not data:
+            os.kill(os.getpid(), signal.SIGHUP)
+            return
+        if b"W" in data:
+            os.kill(os.getpid(), signal.SIGWINCH)
+
+
+def _worker(conn: socket.socket, fds: list[int], uid: int, request: dict) -> int:
+    os.setsid()
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, enter._exit_on_signal)
+    signal.signal(signal.SIGHUP, enter._exit_on_signal)
+    docker_client.after_fork()
+    # A session checks one password (plus a rehash at most), so a bcrypt
+    # pool would cost process starts per session and parallelize nothing:
+    # hash right here. Concurrent sessions still hash in parallel as
+    # separate workers, but SCAM_AUTH_WORKERS/MAX_PENDING don't bound them.
+    accounts.use_inline_auth_engine()
+
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    # fresh, line-buffered streams on the client's terminal
+    sys.stdin = open(0, closefd=False)
+    sys.stdout = open(1, "w", buffering=1, closefd=False)
+    sys.stderr = open(2, "w", buffering=1, closefd=False)
+
+    # what sudo would have set; authcache binds tokens to it
+    try:
+        pw = pwd.getpwuid(uid)
+        os.environ.update(SUDO_UID=str(uid), SUDO_GID=str(pw.pw_gid), SUDO_USER=pw.pw_name)
+    except KeyError:
+        os.environ["SUDO_UID"] = str(uid)
+    term = request.get("term")
+    if isinstance(term, str) and term.isprintable() and len(term) < 64:
+        os.environ["TERM"] = term
+
+    finished = threading.Event()
+    threading.Thread(target=_control_loop, args=(conn, finished), daemon=True).start()
+    status = 1
+    try:
+        try:
+            access_log.reconcile_open_sessions()
+        except sqlite3.OperationalError:
+            pass
+        container = request.get("container")
+        container = container.strip() if isinstance(container, str) else None
+        status = 0 if enter.enter_container(container) else 1
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else 1
+    except (KeyboardInterrupt, EOFError):
+        print()
+        status = 130
+    except Exception as e:
+        print("Error:", e)
+    finally:
+        finished.set()
+        _send(conn, {"status": status})
+        access_log.get_writer().close()
+    return status
+
+
+# ---- daemon -------------------------------------------------------------------
+
+def _listen(path: str, group: str) -> socket.socket:
+    directory = os.path.dirname(path)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    # clients must be able to reach the socket; everything else in there
+    # stays private through its own permissions
+    mode = os.stat(directory).st_mode & 0o777
+    if mode & 0o011 != 0o011:
+        os.chmod(directory, mode | 0o011)
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    gid = _group_gid(group)
+    if gid is not None:
+        os.chown(path, 0, gid)
+        os.chmod(path, 0o660)
+    else:
+        os.chmod(path, 0o600)
+    sock.listen(64)
+    return sock
+
+
+def warm_up(watch: bool = True):
+    """Open the database, reach Docker and start the container cache watcher."""
+    init_db()
+    try:
+        access_log.reconcile_open_sessions()
+    except sqlite3.OperationalError:
+        pass
+    try:
+        docker_client.ping()
+    except Exception as e:
+        print(f"gatekeeper: Docker not reachable yet: {e}", file=sys.stderr)
+    if watch:
+        # own client: the events stream holds its connection open, and the
+        # shared client must be idle whenever a worker is forked
+        try:
+            api = docker.from_env().api
+        except docker.errors.DockerException as e:
+            print(f"gatekeeper: container cache disabled: {e}", file=sys.stderr)
+        else:
+            cache = container_cache.ContainerStateCache()
+            threading.Thread(target=cache.watch, args=(api,),
+                             kwargs={"path": container_cache.CONTAINER_CACHE_PATH},
+                             name="container-cache", daemon=True).start()
+
+
+def _handshake(conn: socket.socket):
+    """Receive the request and the client's terminal; (request, fds) or None.
+
+    Runs in the forked worker, so a client that connects and then sends
+    nothing only holds up its own process, never the accept loop.
+    """
+    try:
+        conn.settimeout(HANDSHAKE_TIMEOUT)
+        data, fds, flags, _ = socket.recv_fds(conn, MAX_REQUEST, 3)
+        conn.settimeout(None)
+    except OSError as e:
+        print(f"gatekeeper: handshake failed: {e}", file=sys.stderr)
+        return None
+    try:
+        request = json.loads(data or b"{}")
+    except ValueError:
+        request = None
+    error = None
+    if not isinstance(request, dict) or len(fds) != 3 or flags & socket.MSG_CTRUNC:
+        error = "bad request"
+    elif not os.isatty(fds[0]):
+        error = "a terminal is required"
+    if error:
+        _send(conn, {"error": error})
+        for fd in fds:
+            os.close(fd)
+        return None
+    return request, fds
+
+
+def _handle(listener: socket.socket, conn: socket.socket):
+    try:
+        pid, uid, _ = peer_credentials(conn)
+    except OSError as e:
+        print(f"gatekeeper: handshake failed: {e}", file=sys.stderr)
+        return
+    if not caller_allowed(uid):
+        print(f"gatekeeper: refused uid {uid} (pid {pid}): not in group {GATEKEEPER_GROUP}", file=sys.stderr)
+        _send(conn, {"error": f"not allowed: join the '{GATEKEEPER_GROUP}' group"})
+        return
+    sys.stdout.flush()
+    sys.stderr.flush()
+    child = os.fork()
+    if child == 0:
+        listener.close()
+        status = 1
+        try:
+            received = _handshake(conn)
+            if received is not None:
+                status = _worker(conn, received[1], uid, received[0])
+        finally:
+            os._exit(status if 0 <= status < 256 else 1)
+    print(f"gatekeeper: session worker {child} for uid {uid} (pid {pid})", file=sys.stderr)
+
+
+def serve(path: str = GATEKEEPER_SOCKET, *, watch: bool = True):
+    if os.geteuid() != 0:
+        sys.exit("gatekeeper must run as root")
+    warm_up(watch)
+    signal.signal(signal.SIGTERM, enter._exit_on_signal)
+    signal.signal(signal.SIGCHLD, _reap)
+    listener = _listen(path, GATEKEEPER_GROUP)
+    print(f"gatekeeper: listening on {path}", file=sys.stderr)
+    try:
+        while True:
+            conn, _ = listener.accept()
+            with conn:
+                _handle(listener, conn)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gatekeeper daemon for container entry")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_serve = sub.add_parser("serve", help=f"Serve entries on {GATEKEEPER_SOCKET}")
+    p_serve.add_argument("--socket", default=GATEKEEPER_SOCKET, help="Unix socket path")
+    p_serve.add_argument("--no-watch", action="store_true",
+                         help="Don't follow Docker events (use a separate container_cache.py watch)")
+    args = parser.parse_args()
+
+    if args.cmd == "serve":
+        serve(args.socket, watch=not args.no_watch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Enter a container through the gatekeeper daemon (see gatekeeper.py).
+
+Runs as the calling user, without sudo, and imports only the standard
+library so it starts in a few milliseconds. It passes its terminal to the
+daemon, which prompts, checks access and records the session on it, and
+exits with the session's status.
+
+    python3 src/gatekeeper_client.py [container]
+"""
+
+import json
+import os
+import signal
+import socket
+import sys
+import termios
+
+GATEKEEPER_SOCKET = os.environ.get("SCAM_GATEKEEPER_SOCKET") or "/run/secure-container-access/gatekeeper.sock"
+
+
+def main():
+    if not os.isatty(0):
+        sys.exit("A terminal is required.")
+    container = sys.argv[1].strip() if len(sys.argv) > 1 else None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(GATEKEEPER_SOCKET)
+    except OSError as e:
+        sys.exit(f"Cannot reach the gatekeeper at {GATEKEEPER_SOCKET}: {e.strerror}\n"
+                 "Is `gatekeeper.py serve` running? Otherwise use: sudo python3 src/enter.py")
+
+    request = {"container": container, "term": os.environ.get("TERM")}
+    saved = termios.tcgetattr(0)
+    # the daemon reads the new size from the terminal itself
+    signal.signal(signal.SIGWINCH, lambda *_: sock.send(b"W"))
+    status = 1
+    try:
+        socket.send_fds(sock, [json.dumps(request).encode()], [0, 1, 2])
+        reply = b""
+        while not reply.endswith(b"\n"):
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            reply += chunk
+        message = json.loads(reply or b"{}")
+        if "error" in message:
+            print(f"Gatekeeper: {message['error']}", file=sys.stderr)
+        status = message.get("status", status)
+    except KeyboardInterrupt:
+        print()
+        status = 130
+    except (OSError, ValueError) as e:
+        print(f"Gatekeeper connection lost: {e}", file=sys.stderr)
+    finally:
+        signal.signal(signal.SIGWINCH, signal.SIG_DFL)
+        sock.close()
+        termios.tcsetattr(0, termios.TCSAFLUSH, saved)
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
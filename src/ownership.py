@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""Container ownership in bulk (`admin.py containers`).
+
+enter.claim_container_if_unclaimed claims one container at a time, each in
+its own BEGIN IMMEDIATE transaction, when a user first enters it. For
+fleets of CI-created containers an admin selects containers by name, glob
+pattern or Docker label instead, and claim / release / transfer / sync
+apply the whole selection at once:
+
+- Docker is asked once, with one container listing (label filters are
+  applied by the daemon).
+- Current owners are read and all changes written in one transaction, as
+  executemany batches.
+- A container that cannot be changed as asked is reported as a conflict
+  and never aborts the rest of the batch.
+
+Every operation returns (changes, conflicts): changes is a list of
+(container, old_owner, new_owner), conflicts a list of (container, message).
+"""
+
+from __future__ import annotations
+
+import fnmatch
+
+from db import connection, init_db, transaction
+
+# stay well below SQLITE_MAX_VARIABLE_NUMBER
+_CHUNK = 500
+
+
+def docker_names(api, *, labels=None, running_only: bool = False) -> list[str]:
+    """Names of Docker's containers, from a single listing call.
+
+    labels are Docker label filters ("key" or "key=value"); a container
+    must match all of them.
+    """
+    filters = {"label": list(labels)} if labels else None
+    names = []
+    for c in api.containers(all=not running_only, filters=filters):
+        for raw in c.get("Names") or []:
+            names.append(raw.lstrip("/"))
+    return sorted(set(names))
+
+
+def match(names, patterns) -> list[str]:
+    """names matching any of the glob patterns (all names if there are none)."""
+    if not patterns:
+        return list(names)
+    return [n for n in names if any(fnmatch.fnmatchcase(n, p) for p in patterns)]
+
+
+def _owners(conn, names) -> dict:
+    """container -> owner (None = unclaimed) for the names that have a row."""
+    found = {}
+    names = list(names)
+    for i in range(0, len(names), _CHUNK):
+        chunk = names[i:i + _CHUNK]
+        placeholders = ",".join("?" * len(chunk))
+        for r in conn.execute(
+            f"SELECT container_name, owner_username FROM containers WHERE container_name IN ({placeholders})",
+            chunk,
+        ):
+            found[r["container_name"]] = r["owner_username"]
+    return found
+
+
+def user_exists(username: str) -> bool:
+    init_db()
+    return connection().execute("SELECT 1 FROM users WHERE username = ?", (username,)).fetchone() is not None
+
+
+def list_containers(*, patterns=None, owner: str | None = None, unclaimed: bool = False) -> list[tuple]:
+    """(container, owner) rows ordered by name, optionally filtered."""
+    init_db()
+    sql = "SELECT container_name, owner_username FROM containers"
+    params = []
+    if owner is not None:
+        sql += " WHERE owner_username = ?"
+        params.append(owner)
+    elif unclaimed:
+        sql += " WHERE owner_username IS NULL"
+    sql += " ORDER BY container_name"
+    rows = [(r["container_name"], r["owner_username"]) for r in connection().execute(sql, params)]
+    if patterns:
+        wanted = set(match((name for name, _ in rows), patterns))
+        rows = [r for r in rows if r[0] in wanted]
+    return rows
+
+
+def _apply(names, decide, *, dry_run: bool = False):
+    """Read the owners of names and write what decide() asks, in one transaction.
+
+    decide(owner) gets a container's current owner (None = unclaimed or no
+    row yet) and returns None (leave as is), ("set", new_owner) or
+    ("conflict", message).
+    """
+    init_db()
+    names = list(dict.fromkeys(names))
+    changes, conflicts = [], []
+    inserts, updates = [], []
+    with transaction(immediate=True) as conn:
+        owners = _owners(conn, names)
+        for name in names:
+            owner = owners.get(name)
+            verdict = decide(owner)
+            if verdict is None:
+                continue
+            kind, value = verdict
+            if kind == "conflict":
+                conflicts.append((name, value))
+                continue
+            changes.append((name, owner, value))
+            if name in owners:
+                updates.append((value, name))
+            else:
+                inserts.append((name, value))
+        if not dry_run:
+            conn.executemany("INSERT INTO containers (container_name, owner_username) VALUES (?, ?)", inserts)
+            conn.executemany("UPDATE containers SET owner_username = ? WHERE container_name = ?", updates)
+    return changes, conflicts
+
+
+def claim(names, owner: str, *, force: bool = False, dry_run: bool = False):
+    """Make owner the owner of names. Containers owned by someone else are
+    conflicts unless force is set."""
+    def decide(current):
+        if current == owner:
+            return None
+        if current is not None and not force:
+            return "conflict", f"owned by {current}"
+        return "set", owner
+    return _apply(names, decide, dry_run=dry_run)
+
+
+def release(names, *, owner: str | None = None, dry_run: bool = False):
+    """Mark names unclaimed. With owner, only containers owned by owner are
+    released; others are conflicts."""
+    def decide(current):
+        if current is None:
+            return None
+        if owner is not None and current != owner:
+            return "conflict", f"owned by {current}, not {owner}"
+        return "set", None
+    return _apply(names, decide, dry_run=dry_run)
+
+
+def transfer(names, from_owner: str, to_owner: str, *, dry_run: bool = False):
+    """Hand names owned by from_owner over to to_owner."""
+    def decide(current):
+        if current == to_owner:
+            return None
+        if current != from_owner:
+            return "conflict", (f"owned by {current}, not {from_owner}" if current else "unclaimed")
+        return "set", to_owner
+    return _apply(names, decide, dry_run=dry_run)
+
+
+def sync(running, *, prune: bool = False, dry_run: bool = False):
+    """Match the containers table to Docker's list of running containers.
+
+    Running containers without a row are added unclaimed. Rows of containers
+    that are not running are returned as stale (container, owner) and, with
+    prune, deleted. Returns (added, stale).
+    """
+    init_db()
+    running = set(running)
+    with transaction(immediate=True) as conn:
+        known = {r["container_name"]: r["owner_username"]
+                 for r in conn.execute("SELECT container_name, owner_username FROM containers")}
+        added = sorted(running - known.keys())
+        stale = sorted((name, owner) for name, owner in known.items() if name not in running)
+        if not dry_run:
+            conn.executemany("INSERT INTO containers (container_name) VALUES (?)", ((n,) for n in added))
+            if prune:
+                conn.executemany("DELETE FROM containers WHERE container_name = ?", ((n,) for n, _ in stale))
+    return added, stale
@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""Session recorder for the pty fallback of enter.spawn_and_record.
+
+relay() multiplexes the user's terminal and the pty master with selectors
+(epoll on Linux): keystrokes go to the container, output goes to the
+terminal and to a sink. Reads grow from READ_MIN to READ_MAX while the
+child keeps filling them (bulk output such as `cat` of a big log) and
+shrink back for interactive traffic; each wakeup drains everything the pty
+has buffered before writing it out once.
+
+Sinks write through an in-memory buffer that is flushed when it reaches
+FLUSH_BYTES or when FLUSH_INTERVAL seconds have passed, instead of
+write+flush per chunk:
+- TypescriptWriter: raw output bytes, like `script -q`.
+- CastWriter: asciicast v2 event stream (one JSON line per event with its
+  time offset) plus a sidecar seek index, see replay.py.
+Both can compress inline (gzip, or zstd when the optional `zstandard`
+package is installed); readers in replay.py detect this from the magic bytes.
+"""
+
+from __future__ import annotations
+
+import codecs
+import fcntl
+import json
+import os
+import selectors
+import signal
+import struct
+import sys
+import termios
+import time
+import tty
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # optional: only needed for SCAM_SESSION_COMPRESSION=zstd
+    zstandard = None
+
+READ_MIN = 4096
+READ_MAX = 256 * 1024
+FLUSH_BYTES = 256 * 1024
+FLUSH_INTERVAL = 1.0
+
+# Seek index (<recording>.idx): magic, then fixed-size (time, offset) entries,
+# one at least every INDEX_SECONDS of session time or INDEX_BYTES of file.
+INDEX_SUFFIX = ".idx"
+INDEX_MAGIC = b"SCAMIDX1"
+INDEX_ENTRY = struct.Struct("<dQ")
+INDEX_SECONDS = 5.0
+INDEX_BYTES = 1024 * 1024
+
+
+COMPRESSION_SUFFIX = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+class _GzipStream:
+    """One gzip stream for the whole recording.
+
+    Regular flushes use Z_SYNC_FLUSH: everything written so far can be
+    decompressed even if the session crashes before the trailer. Seek
+    points use Z_FULL_FLUSH, which also resets the dictionary, so a raw
+    inflater can start at that byte offset.
+    """
+
+    def __init__(self, level: int):
+        self._z = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def sync(self, data) -> bytes:
+        return self._z.compress(data) + self._z.flush(zlib.Z_SYNC_FLUSH)
+
+    def seek_point(self, data) -> bytes:
+        return self._z.compress(data) + self._z.flush(zlib.Z_FULL_FLUSH)
+
+    def finish(self, data) -> bytes:
+        return self._z.compress(data) + self._z.flush(zlib.Z_FINISH)
+
+
+class _ZstdStream:
+    """zstd blocks, with a new frame at every seek point."""
+
+    def __init__(self, level: int):
+        self._c = zstandard.ZstdCompressor(level=level)
+        self._obj = self._c.compressobj()
+
+    def sync(self, data) -> bytes:
+        return self._obj.compress(bytes(data)) + self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def seek_point(self, data) -> bytes:
+        out = self.finish(data)
+        self._obj = self._c.compressobj()
+        return out
+
+    def finish(self, data) -> bytes:
+        return self._obj.compress(bytes(data)) + self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+class _PlainStream:
+    def sync(self, data):
+        return data
+
+    seek_point = finish = sync
+
+
+def _stream(compression: str | None, level: int | None):
+    if compression == "gzip":
+        return _GzipStream(6 if level is None else level)
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd compression needs the 'zstandard' package")
+        return _ZstdStream(3 if level is None else level)
+    return _PlainStream()
+
+
+def effective_compression(requested: str | None) -> str | None:
+    """Map a configured compression name to one this host can write."""
+    requested = (requested or "").lower()
+    if requested in ("", "none", "off"):
+        return None
+    if requested == "zstd" and zstandard is None:
+        return "gzip"
+    return requested if requested in COMPRESSION_SUFFIX else "gzip"
+
+
+class TypescriptWriter:
+    """Buffered raw typescript file (output bytes only, like `script -q`).
+
+    With compression ("gzip" or "zstd") the file is compressed as it is
+    written; every flush leaves a decodable prefix on disk.
+    """
+
+    def __init__(self, path: str, *, flush_bytes: int = FLUSH_BYTES, flush_interval: float = FLUSH_INTERVAL,
+                 compression: str | None = None, level: int | None = None):
+        self.path = path
+        self._stream = _stream(compression, level)
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        self._buf = bytearray()
+        self._flush_bytes = flush_bytes
+        self._flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+        self.flushes = 0
+        # bytes handed to the writer / bytes actually on disk
+        self.raw_bytes = 0
+        self.disk_bytes = 0
+
+    def write_output(self, data: bytes, now: float):
+        self._buf += data
+        self.maybe_flush(now)
+
+    def write_input(self, data: bytes, now: float):
+        # raw typescripts only contain what the terminal showed
+        pass
+
+    def maybe_flush(self, now: float):
+        if len(self._buf) >= self._flush_bytes or (
+            self._buf and now - self._last_flush >= self._flush_interval
+        ):
+            self.flush(now)
+
+    def _write(self, data):
+        view = memoryview(data)
+        while view:
+            n = os.write(self._fd, view)
+            view = view[n:]
+        view.release()
+        self.disk_bytes += len(data)
+
+    def flush(self, now: float | None = None, *, mode: str = "sync"):
+        """Write the buffer. mode is "sync", "seek_point" or "finish"."""
+        if self._buf or mode != "sync":
+            self.raw_bytes += len(self._buf)
+            self._write(getattr(self._stream, mode)(self._buf))
+        if self._buf:
+            self.flushes += 1
+        self._buf.clear()
+        self._last_flush = time.monotonic() if now is None else now
+
+    def close(self):
+        if self._fd is None:
+            return
+        try:
+            self.flush(mode="finish")
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+
+class CastWriter(TypescriptWriter):
+    """asciicast v2 recording with a seek index.
+
+    File layout: a JSON header line, then `[seconds, "o", "text"]` lines.
+    Output is decoded incrementally as UTF-8; invalid bytes are kept as
+    lone surrogates (surrogateescape) so replay can restore them exactly.
+    Keystrokes are only stored ("i" events) with
+    record_input=True since they may contain secrets typed in the container.
+
+    Index entries are (time, file offset of a seek point). A seek point is
+    where reading can start cold: a line boundary, and with compression
+    also a full flush (gzip) or frame start (zstd).
+    """
+
+    def __init__(self, path: str, *, width: int = 80, height: int = 24, title: str | None = None,
+                 record_input: bool = False, index_seconds: float = INDEX_SECONDS,
+                 index_bytes: int = INDEX_BYTES, **kwargs):
+        super().__init__(path, **kwargs)
+        self.started = time.monotonic()
+        self._record_input = record_input
+        self._decoders = {
+            "o": codecs.getincrementaldecoder("utf-8")("surrogateescape"),
+            "i": codecs.getincrementaldecoder("utf-8")("surrogateescape"),
+        }
+        self._index_seconds = index_seconds
+        self._index_bytes = index_bytes
+        self._index_buf = bytearray()
+        self._last_index = None  # (t, logical offset) of the last index entry
+        self._idx_fd = os.open(path + INDEX_SUFFIX, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.write(self._idx_fd, INDEX_MAGIC)
+
+        header = {"version": 2, "width": width, "height": height, "timestamp": int(time.time())}
+        if title:
+            header["title"] = title
+        self.offset = 0
+        self._append(json.dumps(header).encode() + b"\n")
+
+    def _append(self, line: bytes):
+        self._buf += line
+        self.offset += len(line)
+
+    def _event(self, code: str, data: bytes, now: float, final: bool = False):
+        text = self._decoders[code].decode(data, final)
+        if not text:
+            return
+        t = max(0.0, now - self.started)
+        last = self._last_index
+        if last is None or t - last[0] >= self._index_seconds or self.offset - last[1] >= self._index_bytes:
+            self.flush(now, mode="seek_point")
+            self._index_buf += INDEX_ENTRY.pack(t, self.disk_bytes)
+            self._last_index = (t, self.offset)
+        line = json.dumps([round(t, 6), code, text], ensure_ascii=False)
+        # lone surrogates -> literal \udcXX, which is a valid JSON escape
+        self._append(line.encode("utf-8", "backslashreplace") + b"\n")
+        self.maybe_flush(now)
+
+    def write_output(self, data: bytes, now: float):
+        self._event("o", data, now)
+
+    def write_input(self, data: bytes, now: float):
+        if self._record_input:
+            self._event("i", data, now)
+
+    def flush(self, now: float | None = None, *, mode: str = "sync"):
+        super().flush(now, mode=mode)
+        # index entries only ever point at data that is already on disk
+        if self._index_buf:
+            os.write(self._idx_fd, self._index_buf)
+            self._index_buf.clear()
+
+    def close(self):
+        if self._fd is None:
+            return
+        try:
+            # a truncated multi-byte sequence at the very end
+            self._event("o", b"", time.monotonic(), final=True)
+            super().close()
+        finally:
+            os.close(self._idx_fd)
+
+
+class RelayStats:
+    """Counters collected by relay()."""
+
+    # output rate is measured over windows of this many seconds
+    RATE_WINDOW = 1.0
+
+    def __init__(self):
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # terminal writes issued for output (one per drained burst)
+        self.output_batches = 0
+        self.started = time.monotonic()
+        self.ended = None
+        self.exit_status = None
+        # highest output rate (bytes/s) seen in any RATE_WINDOW
+        self.peak_out_rate = 0.0
+        self._window_start = self.started
+        self._window_bytes = 0
+
+    def add_output(self, n: int, now: float):
+        self.bytes_out += n
+        self.output_batches += 1
+        if now - self._window_start >= self.RATE_WINDOW:
+            self._close_window(now)
+        self._window_bytes += n
+
+    def _close_window(self, now: float):
+        # everything in the window arrived within RATE_WINDOW of its start
+        self.peak_out_rate = max(self.peak_out_rate, self._window_bytes / self.RATE_WINDOW)
+        self._window_start = now
+        self._window_bytes = 0
+
+    def finish(self):
+        self.ended = time.monotonic()
+        self._close_window(self.ended)
+
+    @property
+    def duration(self) -> float:
+        return (self.ended or time.monotonic()) - self.started
+
+
+def _write_all(fd: int, data) -> None:
+    view = memoryview(data)
+    while view:
+        try:
+            n = os.write(fd, view)
+        except BlockingIOError:
+            # fd is shared non-blocking (e.g. a pipe); wait until it drains
+            sel = selectors.DefaultSelector()
+            sel.register(fd, selectors.EVENT_WRITE)
+            sel.select()
+            sel.close()
+            continue
+        view = view[n:]
+
+
+def _drain(fd: int, limit: int) -> tuple[bytearray, bool]:
+    """Read from non-blocking fd until it would block or limit bytes are collected.
+
+    The kernel hands out pty data in small pieces; batching them means one
+    terminal write and one sink call per burst instead of per piece.
+    Returns (data, eof).
+    """
+    buf = bytearray()
+    while len(buf) < limit:
+        try:
+            chunk = os.read(fd, limit - len(buf))
+        except BlockingIOError:
+            return buf, False
+        except InterruptedError:
+            continue
+        except OSError:
+            # EIO: slave side closed, child is gone
+            return buf, True
+        if not chunk:
+            return buf, True
+        buf += chunk
+    return buf, False
+
+
+def _copy_winsize(src_fd: int, dst_fd: int):
+    try:
+        size = fcntl.ioctl(src_fd, termios.TIOCGWINSZ, struct.pack("HHHH", 0, 0, 0, 0))
+        fcntl.ioctl(dst_fd, termios.TIOCSWINSZ, size)
+    except OSError:
+        pass
+
+
+def _winsize(fd: int) -> tuple[int, int] | None:
+    """(columns, rows) of the terminal on fd."""
+    try:
+        rows, cols, _, _ = struct.unpack("HHHH", fcntl.ioctl(fd, termios.TIOCGWINSZ, struct.pack("HHHH", 0, 0, 0, 0)))
+    except OSError:
+        return None
+    return cols, rows
+
+
+def relay(master_fd: int, sink, *, child_pid: int | None = None,
+          stdin_fd: int | None = None, stdout_fd: int | None = None, on_resize=None) -> RelayStats:
+    """Shuttle bytes between the terminal and master_fd until the child is done.
+
+    Puts the terminal in raw mode for the duration (if stdin is a tty) and
+    forwards window size changes: to the pty behind master_fd, or with
+    on_resize to on_resize(cols, rows) (master_fd is then e.g. a socket,
+    see exec_session). Returns RelayStats; exit_status is filled in when
+    child_pid is given.
+    """
+    stdin_fd = sys.stdin.fileno() if stdin_fd is None else stdin_fd
+    stdout_fd = sys.stdout.fileno() if stdout_fd is None else stdout_fd
+    stats = RelayStats()
+
+    old_attrs = None
+    old_winch = None
+    if os.isatty(stdin_fd):
+        old_attrs = termios.tcgetattr(stdin_fd)
+        tty.setraw(stdin_fd)
+        if on_resize is None:
+            def resize(*_):
+                _copy_winsize(stdin_fd, master_fd)
+            resize()
+        else:
+            # the caller sized its terminal when it started the child
+            def resize(*_):
+                size = _winsize(stdin_fd)
+                if size:
+                    on_resize(*size)
+        try:
+            old_winch = signal.signal(signal.SIGWINCH, resize)
+        except ValueError:
+            # not in the main thread
+            old_winch = None
+
+    sel = selectors.DefaultSelector()
+    sel.register(master_fd, selectors.EVENT_READ, "pty")
+    try:
+        sel.register(stdin_fd, selectors.EVENT_READ, "stdin")
+    except (ValueError, OSError):
+        # stdin closed or not pollable (e.g. /dev/null under some runners)
+        pass
+
+    os.set_blocking(master_fd, False)
+    read_size = READ_MIN
+    try:
+        while True:
+            events = sel.select(timeout=FLUSH_INTERVAL)
+            now = time.monotonic()
+            if not events:
+                sink.maybe_flush(now)
+                continue
+            done = False
+            for key, _ in events:
+                if key.data == "pty":
+                    data, eof = _drain(master_fd, read_size)
+                    if data:
+                        stats.add_output(len(data), now)
+                        _write_all(stdout_fd, data)
+                        sink.write_output(bytes(data), now)
+                        if len(data) >= read_size and read_size < READ_MAX:
+                            read_size *= 2
+                        elif len(data) < read_size // 4 and read_size > READ_MIN:
+                            read_size //= 2
+                    if eof:
+                        done = True
+                        break
+                else:
+                    try:
+                        data = os.read(stdin_fd, READ_MIN)
+                    except OSError:
+                        data = b""
+                    if not data:
+                        # user's stdin hit EOF: stop forwarding, keep reading output
+                        sel.unregister(stdin_fd)
+                        continue
+                    stats.bytes_in += len(data)
+                    sink.write_input(data, now)
+                    _write_all(master_fd, data)
+            if done:
+                break
+    except BaseException:
+        # interrupted (e.g. SIGHUP turned into SystemExit): the child would
+        # otherwise keep waiting on a pty nobody reads while we wait for it
+        if child_pid is not None:
+            try:
+                os.kill(child_pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+        raise
+    finally:
+        sel.close()
+        if old_attrs is not None:
+            termios.tcsetattr(stdin_fd, termios.TCSAFLUSH, old_attrs)
+        if old_winch is not None:
+            signal.signal(signal.SIGWINCH, old_winch)
+        if child_pid is not None:
+            try:
+                _, status = os.waitpid(child_pid, 0)
+                stats.exit_status = os.waitstatus_to_exitcode(status)
+            except ChildProcessError:
+                pass
+        stats.finish()
+    return stats
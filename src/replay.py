@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""Replay, seek and dump recorded sessions.
+
+Works on the asciicast recordings written by recorder.CastWriter. Both the
+recording and its .idx seek index are memory-mapped, so jumping to 5:30:00
+in a six hour session reads one index lookup plus the events after that
+point, not the whole file. gzip/zstd recordings (.cast.gz, .cast.zst) are
+read the same way, inflating only from the nearest seek point. Raw
+typescripts (.log, from `script`) have no timing and can only be dumped.
+
+    sudo python3 src/replay.py SESSION.cast                    # play in real time
+    sudo python3 src/replay.py SESSION.cast --from 1:20:00 --speed 4
+    sudo python3 src/replay.py SESSION.cast --from 10:00 --to 12:30 --dump > out.txt
+    sudo python3 src/replay.py SESSION.cast --info
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import mmap
+import os
+import sys
+import tarfile
+import time
+import zlib
+
+from recorder import INDEX_ENTRY, INDEX_MAGIC, INDEX_SECONDS, INDEX_BYTES, INDEX_SUFFIX, zstandard
+
+
+def parse_time(value: str) -> float:
+    """'90', '1:30', '0:01:30' or '1:30.5' -> seconds."""
+    seconds = 0.0
+    for part in value.strip().split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def format_time(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+CHUNK = 256 * 1024
+
+
+# "<bundle>.tar#<member>": a recording packed into a day archive by retention.py
+ARCHIVE_SEP = "#"
+
+
+def _read_member(path: str) -> bytes | None:
+    bundle, member = path.split(ARCHIVE_SEP, 1)
+    with tarfile.open(bundle) as tar:
+        try:
+            f = tar.extractfile(member)
+        except KeyError:
+            raise FileNotFoundError(path) from None
+        return f.read() or None
+
+
+def _map(path: str):
+    """mmap of the file, or the bytes of an archived member (both read-only)."""
+    if ARCHIVE_SEP in path and not os.path.exists(path):
+        return _read_member(path)
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class Recording:
+    """Read-only, memory-mapped view of a session recording.
+
+    Plain, gzip and zstd recordings are detected from their magic bytes.
+    Recordings moved into a day archive ("bundle.tar#member") are read
+    into memory instead; they are compressed and rarely replayed.
+    Compressed data is inflated incrementally from the mapped file starting
+    at the nearest seek point, never as a whole.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mm = _map(path)
+        self.compression = None
+        if self._mm is not None:
+            if self._mm[:2] == GZIP_MAGIC:
+                self.compression = "gzip"
+            elif self._mm[:4] == ZSTD_MAGIC:
+                self.compression = "zstd"
+        self.header = {}
+        # physical offset of the first event for plain files; compressed
+        # files start at 0 and skip the header line while reading
+        self._body = 0
+        first = next(self._lines(0), b"")
+        if first[:1] == b"{":
+            try:
+                self.header = json.loads(first)
+            except ValueError:
+                self.header = {}
+            if self.compression is None:
+                self._body = len(first) + 1
+        self.timed = self.header.get("version") == 2
+        self._idx = None
+        if self.timed:
+            try:
+                idx = _map(path + INDEX_SUFFIX)
+            except FileNotFoundError:
+                idx = None
+            if idx is not None and idx[:len(INDEX_MAGIC)] == INDEX_MAGIC:
+                self._idx = idx
+
+    def close(self):
+        for m in (self._mm, self._idx):
+            if isinstance(m, mmap.mmap):
+                m.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---- index -------------------------------------------------------------
+
+    @property
+    def index_entries(self) -> int:
+        if self._idx is None:
+            return 0
+        return (len(self._idx) - len(INDEX_MAGIC)) // INDEX_ENTRY.size
+
+    def _index_entry(self, i: int) -> tuple[float, int]:
+        return INDEX_ENTRY.unpack_from(self._idx, len(INDEX_MAGIC) + i * INDEX_ENTRY.size)
+
+    def seek_offset(self, t: float) -> int:
+        """File offset of a seek point at or before time t."""
+        lo, hi = 0, self.index_entries
+        # last entry with time <= t
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._index_entry(mid)[0] <= t:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return self._body
+        offset = self._index_entry(lo - 1)[1]
+        # a crash can leave entries pointing past the flushed data
+        return offset if offset < len(self._mm) else self._body
+
+    # ---- reading -----------------------------------------------------------
+
+    def _chunks(self, pos: int):
+        """Decompressed data starting at file offset pos (0 or a seek point)."""
+        mm = self._mm
+        if mm is None:
+            return
+        if self.compression is None:
+            for i in range(pos, len(mm), CHUNK):
+                yield mm[i:i + CHUNK]
+        elif self.compression == "gzip":
+            # the gzip header only exists at offset 0; seek points are raw deflate
+            d = zlib.decompressobj(31 if pos == 0 else -15)
+            for i in range(pos, len(mm), CHUNK):
+                try:
+                    out = d.decompress(mm[i:i + CHUNK])
+                except zlib.error:
+                    # truncated/corrupt tail of a crashed session
+                    return
+                if out:
+                    yield out
+                if d.eof:
+                    return
+        else:
+            if zstandard is None:
+                raise RuntimeError(f"{self.path} is zstd-compressed; install 'zstandard' to read it")
+            reader = zstandard.ZstdDecompressor().stream_reader(
+                memoryview(mm)[pos:], read_across_frames=True
+            )
+            try:
+                while True:
+                    out = reader.read(CHUNK)
+                    if not out:
+                        return
+                    yield out
+            except zstandard.ZstdError:
+                return
+
+    def _lines(self, pos: int):
+        if self.compression is None and self._mm is not None:
+            mm = self._mm
+            size = len(mm)
+            while pos < size:
+                end = mm.find(b"\n", pos)
+                if end < 0:
+                    end = size
+                yield mm[pos:end]
+                pos = end + 1
+            return
+        pending = b""
+        for chunk in self._chunks(pos):
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            yield from lines
+        if pending:
+            yield pending
+
+    def events(self, start: float = 0.0, end: float | None = None, codes: str = "o"):
+        """Yield (t, code, bytes) for events with start <= t < end."""
+        if not self.timed:
+            return
+        for line in self._lines(self.seek_offset(start)):
+            if line[:1] != b"[":
+                # header line (compressed files are read from offset 0)
+                continue
+            try:
+                t, code, text = json.loads(line)
+            except ValueError:
+                # torn last line of a crashed session
+                continue
+            if end is not None and t >= end:
+                return
+            if t < start or code not in codes:
+                continue
+            yield t, code, text.encode("utf-8", "surrogateescape")
+
+    def duration(self) -> float:
+        if not self.timed:
+            return 0.0
+        if self.compression is not None:
+            # decompress only from the last seek point
+            last = 0.0
+            start = self._index_entry(self.index_entries - 1)[0] if self.index_entries else 0.0
+            for t, _, _ in self.events(start, codes="oi"):
+                last = t
+            return last
+        end = len(self._mm)
+        while end > self._body:
+            start = self._mm.rfind(b"\n", self._body, end - 1) + 1
+            try:
+                return float(json.loads(self._mm[max(start, self._body):end])[0])
+            except (ValueError, IndexError):
+                end = start - 1
+        return 0.0
+
+    def iter_raw(self):
+        """Content of an untimed (raw typescript) recording, chunk by chunk."""
+        yield from self._chunks(self._body)
+
+
+def build_index(path: str, index_seconds: float = INDEX_SECONDS, index_bytes: int = INDEX_BYTES) -> int:
+    """(Re)write the .idx for an existing recording; returns the entry count."""
+    entries = []
+    with Recording(path) as rec:
+        if not rec.timed:
+            raise ValueError(f"{path} is not a timed recording")
+        if rec.compression is not None:
+            # seek points in compressed streams are only created while recording
+            raise ValueError(f"{path} is compressed; its index can only be written by the recorder")
+        pos = rec._body
+        last = None
+        for line in rec._lines(rec._body):
+            try:
+                t = float(json.loads(line)[0])
+            except (ValueError, IndexError):
+                t = None
+            if t is not None and (last is None or t - last[0] >= index_seconds or pos - last[1] >= index_bytes):
+                last = (t, pos)
+                entries.append(INDEX_ENTRY.pack(t, pos))
+            pos += len(line) + 1
+    tmp = f"{path}{INDEX_SUFFIX}.{os.getpid()}"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(INDEX_MAGIC)
+        f.write(b"".join(entries))
+    os.replace(tmp, path + INDEX_SUFFIX)
+    return len(entries)
+
+
+def play(rec: Recording, out, *, start: float = 0.0, end: float | None = None,
+         speed: float = 1.0, idle_limit: float | None = None):
+    """Write output events to out, sleeping between them (scaled by speed)."""
+    prev = None
+    for t, _, data in rec.events(start, end):
+        if prev is not None and speed > 0:
+            delay = t - prev
+            if idle_limit is not None:
+                delay = min(delay, idle_limit)
+            if delay > 0:
+                time.sleep(delay / speed)
+        out.write(data)
+        out.flush()
+        prev = t
+
+
+def dump(rec: Recording, out, *, start: float = 0.0, end: float | None = None):
+    for _, _, data in rec.events(start, end):
+        out.write(data)
+    out.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay or dump a recorded session")
+    parser.add_argument("path", help="Recording (.cast) or raw typescript (.log)")
+    parser.add_argument("--from", dest="start", type=parse_time, default=0.0, help="Start at [[H:]M:]S")
+    parser.add_argument("--to", dest="end", type=parse_time, help="Stop at [[H:]M:]S")
+    parser.add_argument("--speed", type=float, default=1.0, help="Playback speed multiplier")
+    parser.add_argument("--idle-limit", type=float, default=2.0, help="Cap pauses at N seconds (0 = no cap)")
+    parser.add_argument("--dump", action="store_true", help="Write the range without delays")
+    parser.add_argument("--info", action="store_true", help="Show header, duration and index size")
+    parser.add_argument("--reindex", action="store_true", help="Rebuild the seek index")
+    args = parser.parse_args()
+
+    if args.reindex:
+        print(f"{build_index(args.path)} index entries written to {args.path}{INDEX_SUFFIX}")
+        return
+
+    out = sys.stdout.buffer
+    with Recording(args.path) as rec:
+        if args.info:
+            print(json.dumps(rec.header))
+            if rec.timed:
+                print(f"duration: {format_time(rec.duration())}  index entries: {rec.index_entries}")
+            else:
+                print("raw typescript (no timing)")
+            return
+        if not rec.timed:
+            if args.start or args.end is not None or not args.dump:
+                print("Raw typescript has no timing; use --dump to print it.", file=sys.stderr)
+                sys.exit(1)
+            for chunk in rec.iter_raw():
+                out.write(chunk)
+            return
+        try:
+            if args.dump:
+                dump(rec, out, start=args.start, end=args.end)
+            else:
+                play(rec, out, start=args.start, end=args.end, speed=args.speed,
+                     idle_limit=args.idle_limit or None)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
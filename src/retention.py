@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""Retention, rotation and archival of session recordings.
+
+Three tiers, by the time a session ended:
+- hot: younger than HOT_DAYS, one file per session in the sessions directory.
+- archived: packed into one uncompressed tar per day (ARCHIVE_DIR/YYYY-MM-DD.tar,
+  day of ts_start). Plain recordings are gzip-compressed on the way in (the
+  seek index is rewritten to the new offsets); gzip/zstd ones are added as-is.
+  access_logs.typescript_path becomes "<bundle>#<member>", which replay.py
+  and session_index.py read directly.
+- purged: after PURGE_DAYS the recording is deleted, typescript_path is set
+  to '' and its search index rows are dropped. A day bundle is deleted once
+  every session in it is due. With LOG_DAYS the access_logs rows themselves
+  are deleted after that many days.
+
+Rows are visited in keyset batches of BATCH rows, files are streamed, so
+memory stays flat however large the backlog is. Open sessions (ts_end NULL)
+and recently written files are never touched; one run at a time holds an
+flock on ARCHIVE_DIR/.retention.lock, so it is safe to run from cron:
+
+    0 3 * * *  root  /opt/secure-container-access/venv/bin/python3 /opt/secure-container-access/src/retention.py
+"""
+
+from __future__ import annotations
+
+import argparse
+import fcntl
+import io
+import os
+import sys
+import tarfile
+import tempfile
+import time
+from collections import defaultdict
+
+from db import init_db, connection, transaction
+import access_log
+from recorder import INDEX_ENTRY, INDEX_MAGIC, INDEX_SUFFIX, _GzipStream
+from replay import ARCHIVE_SEP, GZIP_MAGIC, ZSTD_MAGIC
+from session_store import TYPESCRIPT_DIR
+import session_index
+
+ARCHIVE_DIR = "/var/log/secure-container-access/archive"
+LOCK_NAME = ".retention.lock"
+
+
+def _days(name: str, default: int) -> int:
+    return int(os.environ.get(name, str(default)) or default)
+
+
+# 0 disables the tier
+HOT_DAYS = _days("SCAM_RETENTION_HOT_DAYS", 30)
+PURGE_DAYS = _days("SCAM_RETENTION_PURGE_DAYS", 0)
+LOG_DAYS = _days("SCAM_RETENTION_LOG_DAYS", 0)
+BATCH = 500
+# never touch a recording modified this recently, whatever the database says
+MIN_IDLE_SECONDS = 300
+
+
+class RetentionStats:
+    def __init__(self):
+        self.archived = 0
+        self.archived_bytes = 0
+        self.bundle_bytes = 0
+        self.purged = 0
+        self.bundles_deleted = 0
+        self.rows_deleted = 0
+        self.skipped = 0
+
+    def summary(self) -> str:
+        ratio = f" ({self.archived_bytes / self.bundle_bytes:.1f}x)" if self.bundle_bytes else ""
+        return (f"archived {self.archived} sessions, {self.archived_bytes / 1e6:.1f} MB -> "
+                f"{self.bundle_bytes / 1e6:.1f} MB{ratio}; purged {self.purged} recordings, "
+                f"{self.bundles_deleted} bundles; deleted {self.rows_deleted} log rows; "
+                f"skipped {self.skipped}")
+
+
+def _cutoff(days: int) -> str:
+    return f"-{days} days"
+
+
+def _batches(sql: str, params: tuple, batch: int):
+    """Keyset-paged rows of `sql` (which must select id and end with `id > ?`)."""
+    after = 0
+    while True:
+        rows = connection().execute(f"{sql} ORDER BY id LIMIT ?", (*params, after, batch)).fetchall()
+        if not rows:
+            return
+        yield rows
+        after = rows[-1]["id"]
+
+
+def _is_compressed(path: str) -> bool:
+    with open(path, "rb") as f:
+        head = f.read(4)
+    return head[:2] == GZIP_MAGIC or head == ZSTD_MAGIC
+
+
+def _compress(src: str, dst_fd: int) -> bytes | None:
+    """gzip src into dst_fd; returns a rewritten seek index, or None if src has none.
+
+    Each old index offset becomes a full-flush seek point in the gzip stream,
+    so seeking in the archived copy works like in a live-compressed one.
+    """
+    try:
+        with open(src + INDEX_SUFFIX, "rb") as f:
+            idx = f.read()
+        if idx[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            idx = None
+    except FileNotFoundError:
+        idx = None
+    entries = []
+    if idx:
+        body = memoryview(idx)[len(INDEX_MAGIC):]
+        entries = [INDEX_ENTRY.unpack_from(body, i)
+                   for i in range(0, len(body) - len(body) % INDEX_ENTRY.size, INDEX_ENTRY.size)]
+
+    stream = _GzipStream(6)
+    written = 0
+    new_entries = []
+
+    def _out(data):
+        nonlocal written
+        view = memoryview(data)
+        while view:
+            n = os.write(dst_fd, view)
+            view = view[n:]
+        written += len(data)
+
+    with open(src, "rb") as f:
+        pos = 0
+        for t, offset in entries:
+            # copy up to the old seek point in bounded pieces, then cut a new one there
+            while pos < offset:
+                chunk = f.read(min(1024 * 1024, offset - pos))
+                if not chunk:
+                    break
+                pos += len(chunk)
+                _out(stream.sync(chunk) if pos < offset else stream.seek_point(chunk))
+            if pos == offset:
+                new_entries.append(INDEX_ENTRY.pack(t, written))
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            _out(stream.sync(chunk))
+    _out(stream.finish(b""))
+    return INDEX_MAGIC + b"".join(new_entries) if idx is not None else None
+
+
+class _Bundle:
+    """Append-only day archive. Appends are rolled back if anything fails.
+
+    Only one retention run works at a time (see run()), so the bundle itself
+    needs no lock; readers only ever look up members that are committed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.existed = os.path.exists(path)
+        # bytes on disk before this append (for the stats)
+        self.size_before = os.path.getsize(path) if self.existed else 0
+        self.tar = tarfile.open(path, "a")
+        # end of the last committed member: new members are written over the
+        # old end-of-archive blocks, which sit before the old file size
+        self.offset = self.tar.offset
+
+    def add_file(self, member: str, fileobj, size: int):
+        info = tarfile.TarInfo(member)
+        info.size = size
+        info.mtime = int(time.time())
+        info.mode = 0o600
+        self.tar.addfile(info, fileobj)
+
+    def commit(self):
+        self.tar.close()
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def rollback(self):
+        try:
+            self.tar.close()
+        except Exception:
+            pass
+        if not self.existed:
+            os.unlink(self.path)
+            return
+        # drop the partial members and write the end-of-archive blocks again,
+        # padded to a full record as TarFile.close() does
+        end = self.offset + 2 * tarfile.BLOCKSIZE
+        end += -end % tarfile.RECORDSIZE
+        with open(self.path, "r+b") as f:
+            f.truncate(self.offset)
+            f.seek(self.offset)
+            f.write(tarfile.NUL * (end - self.offset))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _pack(bundle: _Bundle, log_id: int, path: str, tmpdir: str) -> tuple[str, int]:
+    """Add one recording (and its index) to bundle; returns (member, bytes on disk before)."""
+    # the id keeps member names unique within the bundle
+    name = f"{log_id}_{os.path.basename(path)}"
+    raw = os.path.getsize(path)
+    if _is_compressed(path):
+        member = name
+        with open(path, "rb") as f:
+            bundle.add_file(member, f, raw)
+        idx = None
+        if os.path.exists(path + INDEX_SUFFIX):
+            with open(path + INDEX_SUFFIX, "rb") as f:
+                idx = f.read()
+    else:
+        member = name + ".gz"
+        fd, tmp = tempfile.mkstemp(dir=tmpdir)
+        try:
+            idx = _compress(path, fd)
+            os.lseek(fd, 0, os.SEEK_SET)
+            with os.fdopen(fd, "rb", closefd=False) as f:
+                bundle.add_file(member, f, os.fstat(fd).st_size)
+        finally:
+            os.close(fd)
+            os.unlink(tmp)
+    if idx is not None:
+        bundle.add_file(member + INDEX_SUFFIX, io.BytesIO(idx), len(idx))
+        if os.path.exists(path + INDEX_SUFFIX):
+            raw += os.path.getsize(path + INDEX_SUFFIX)
+    return member, raw
+
+
+def _remove_recording(path: str):
+    for p in (path, path + INDEX_SUFFIX):
+        try:
+            os.unlink(p)
+        except FileNotFoundError:
+            pass
+    # drop emptied date/container shard directories (see session_store)
+    parent = os.path.dirname(path)
+    while parent.startswith(TYPESCRIPT_DIR + "/"):
+        try:
+            os.rmdir(parent)
+        except OSError:
+            break
+        parent = os.path.dirname(parent)
+
+
+def archive(hot_days: int, *, batch: int = BATCH, dry_run: bool = False,
+            stats: RetentionStats | None = None) -> RetentionStats:
+    """Pack ended sessions older than hot_days into their day bundles."""
+    stats = stats or RetentionStats()
+    sql = ("SELECT id, ts_start, typescript_path FROM access_logs "
+           "WHERE ts_end IS NOT NULL AND ts_end < datetime('now', ?) "
+           f"AND typescript_path != '' AND instr(typescript_path, '{ARCHIVE_SEP}') = 0 AND id > ?")
+    os.makedirs(ARCHIVE_DIR, mode=0o750, exist_ok=True)
+    for rows in _batches(sql, (_cutoff(hot_days),), batch):
+        by_day = defaultdict(list)
+        for row in rows:
+            path = row["typescript_path"]
+            try:
+                if time.time() - os.path.getmtime(path) < MIN_IDLE_SECONDS:
+                    stats.skipped += 1
+                    continue
+            except FileNotFoundError:
+                print(f"session {row['id']}: {path} is missing, left as is", file=sys.stderr)
+                stats.skipped += 1
+                continue
+            by_day[str(row["ts_start"])[:10]].append((row["id"], path))
+        for day, sessions in sorted(by_day.items()):
+            bundle_path = os.path.join(ARCHIVE_DIR, f"{day}.tar")
+            if dry_run:
+                print(f"would archive {len(sessions)} sessions into {bundle_path}")
+                stats.archived += len(sessions)
+                continue
+            bundle = _Bundle(bundle_path)
+            moved = []
+            try:
+                before = bundle.size_before
+                for log_id, path in sessions:
+                    member, raw = _pack(bundle, log_id, path, ARCHIVE_DIR)
+                    moved.append((log_id, path, f"{bundle_path}{ARCHIVE_SEP}{member}"))
+                    stats.archived_bytes += raw
+            except BaseException:
+                bundle.rollback()
+                raise
+            bundle.commit()
+            stats.bundle_bytes += os.path.getsize(bundle_path) - before
+            # archive is durable -> point the rows at it -> only then delete the files
+            with transaction(immediate=True) as conn:
+                conn.executemany("UPDATE access_logs SET typescript_path = ? WHERE id = ? AND typescript_path = ?",
+                                 [(new, log_id, old) for log_id, old, new in moved])
+            for _, old, _ in moved:
+                _remove_recording(old)
+            stats.archived += len(moved)
+    return stats
+
+
+def purge(purge_days: int, *, batch: int = BATCH, dry_run: bool = False,
+          stats: RetentionStats | None = None) -> RetentionStats:
+    """Delete recordings of sessions that ended more than purge_days ago."""
+    stats = stats or RetentionStats()
+    cutoff = _cutoff(purge_days)
+    sql = ("SELECT id, typescript_path FROM access_logs "
+           "WHERE ts_end IS NOT NULL AND ts_end < datetime('now', ?) AND typescript_path != '' AND id > ?")
+    checked = set()
+    for rows in _batches(sql, (cutoff,), batch):
+        files = []
+        bundles = set()
+        for row in rows:
+            path = row["typescript_path"]
+            if ARCHIVE_SEP in path and not os.path.exists(path):
+                bundles.add(path.split(ARCHIVE_SEP, 1)[0])
+            else:
+                files.append((row["id"], path))
+        for bundle in bundles - checked:
+            checked.add(bundle)
+            # a bundle goes only when nothing in it is still within retention
+            prefix = bundle + ARCHIVE_SEP
+            keep = connection().execute(
+                "SELECT 1 FROM access_logs WHERE substr(typescript_path, 1, ?) = ? "
+                "AND (ts_end IS NULL OR ts_end >= datetime('now', ?)) LIMIT 1",
+                (len(prefix), prefix, cutoff),
+            ).fetchone()
+            if keep:
+                continue
+            ids = [r["id"] for r in connection().execute(
+                "SELECT id FROM access_logs WHERE substr(typescript_path, 1, ?) = ?", (len(prefix), prefix)
+            )]
+            if dry_run:
+                print(f"would delete {bundle} ({len(ids)} sessions)")
+            else:
+                _forget(ids)
+                try:
+                    os.unlink(bundle)
+                except FileNotFoundError:
+                    pass
+            stats.bundles_deleted += 1
+            stats.purged += len(ids)
+        if not files:
+            continue
+        if dry_run:
+            print(f"would delete {len(files)} hot recordings")
+        else:
+            _forget([log_id for log_id, _ in files])
+            for _, path in files:
+                _remove_recording(path)
+        stats.purged += len(files)
+    return stats
+
+
+def _forget(ids):
+    """Clear typescript_path and the search index for these sessions."""
+    with transaction(immediate=True) as conn:
+        conn.executemany("UPDATE access_logs SET typescript_path = '' WHERE id = ?", [(i,) for i in ids])
+        for i in ids:
+            session_index._clear(conn, i)
+        conn.executemany("UPDATE session_index_state SET lines = 0 WHERE log_id = ?", [(i,) for i in ids])
+
+
+def delete_logs(log_days: int, *, batch: int = BATCH, dry_run: bool = False,
+                stats: RetentionStats | None = None) -> RetentionStats:
+    """Delete access_logs rows whose recording is gone and that ended more than log_days ago."""
+    stats = stats or RetentionStats()
+    sql = ("SELECT id FROM access_logs WHERE ts_end IS NOT NULL AND ts_end < datetime('now', ?) "
+           "AND typescript_path = '' AND id > ?")
+    for rows in _batches(sql, (_cutoff(log_days),), batch):
+        ids = [(r["id"],) for r in rows]
+        if not dry_run:
+            with transaction(immediate=True) as conn:
+                conn.executemany("DELETE FROM session_index_state WHERE log_id = ?", ids)
+                conn.executemany("DELETE FROM access_logs WHERE id = ?", ids)
+        stats.rows_deleted += len(ids)
+    return stats
+
+
+def run(*, hot_days: int = HOT_DAYS, purge_days: int = PURGE_DAYS, log_days: int = LOG_DAYS,
+        batch: int = BATCH, dry_run: bool = False) -> RetentionStats | None:
+    """One retention pass. Returns None if another run holds the lock."""
+    init_db()
+    os.makedirs(ARCHIVE_DIR, mode=0o750, exist_ok=True)
+    lock = os.open(os.path.join(ARCHIVE_DIR, LOCK_NAME), os.O_WRONLY | os.O_CREAT, 0o600)
+    try:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        # sessions of crashed processes would otherwise never become due
+        access_log.reconcile_open_sessions()
+        stats = RetentionStats()
+        if purge_days:
+            purge(purge_days, batch=batch, dry_run=dry_run, stats=stats)
+        if hot_days:
+            archive(hot_days, batch=batch, dry_run=dry_run, stats=stats)
+        if log_days and purge_days:
+            delete_logs(log_days, batch=batch, dry_run=dry_run, stats=stats)
+        return stats
+    finally:
+        os.close(lock)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive and purge old session recordings")
+    parser.add_argument("--hot-days", type=int, default=HOT_DAYS,
+                        help="Keep recordings as single files for N days, then archive (0 = never)")
+    parser.add_argument("--purge-days", type=int, default=PURGE_DAYS,
+                        help="Delete recordings N days after the session ended (0 = never)")
+    parser.add_argument("--log-days", type=int, default=LOG_DAYS,
+                        help="Delete access_logs rows of purged sessions after N days (0 = never)")
+    parser.add_argument("--batch", type=int, default=BATCH, help="access_logs rows per batch")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would happen")
+    args = parser.parse_args()
+
+    if args.purge_days and args.hot_days and args.purge_days <= args.hot_days:
+        print("Note: --purge-days <= --hot-days; recordings are deleted without being archived first.")
+    t0 = time.monotonic()
+    stats = run(hot_days=args.hot_days, purge_days=args.purge_days, log_days=args.log_days,
+                batch=args.batch, dry_run=args.dry_run)
+    if stats is None:
+        print("Another retention run is in progress.")
+        sys.exit(1)
+    print(f"{'(dry run) ' if args.dry_run else ''}{stats.summary()} in {time.monotonic() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
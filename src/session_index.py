@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""Full-text index over recorded sessions.
+
+After a session ends its recording is replayed through a small terminal
+line assembler (ANSI sequences stripped, \\r / backspace / erase-line
+applied) and every resulting line goes into the FTS5 table session_text
+with its offset from the session start. Lines that look like a shell
+prompt followed by input also get the command part in its own column.
+
+Rows for access_logs.id N use rowids N << 24 ..., so deleting or
+re-indexing a session is a rowid range and results come back newest
+session first straight from the index.
+
+    sudo python3 src/session_index.py index                   # index ended, unindexed sessions
+    sudo python3 src/session_index.py search 'rm -rf' --container web --since 2024-05-01
+    sudo python3 src/session_index.py search --commands --match 'docker AND NOT ps'
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+
+import db
+from db import init_db, connection, transaction
+from replay import Recording
+
+# One row per terminal line: command = text after the shell prompt ('' for
+# output), text = whole line without ANSI sequences, offset_ms = ms from
+# session start (NULL if untimed). rowid = access_logs.id << 24 | line
+# number, so a session's rows are one rowid range. Created on first use
+# rather than by a migration, since SQLite may be built without FTS5.
+SESSION_TEXT_DDL = """CREATE VIRTUAL TABLE IF NOT EXISTS session_text USING fts5(
+  command,
+  text,
+  offset_ms UNINDEXED,
+  tokenize = 'unicode61 remove_diacritics 2'
+)"""
+NO_FTS5 = "this SQLite has no FTS5 support; session search is unavailable"
+
+# DB_PATH whose session_text table is known to exist in this process
+_table_path = None
+
+LINE_BITS = 24
+MAX_LINES = (1 << LINE_BITS) - 1
+MAX_LINE_CHARS = 1000
+# rows inserted per transaction while indexing one session
+BATCH_ROWS = 2000
+
+# complete escape sequences: CSI, OSC (BEL or ST terminated), DCS/SOS/PM/APC,
+# charset selection and two-byte escapes
+_TOKEN_RE = re.compile(
+    r"\x1b\[(?P<params>[0-?]*)[ -/]*(?P<final>[@-~])"
+    r"|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)"
+    r"|\x1b[PX^_][^\x1b]*\x1b\\"
+    r"|\x1b[()*+].|\x1b[ -/]*(?![\[\]PX^_])[0-~]"
+    r"|(?P<text>[^\x1b]+)"
+    r"|\x1b",
+    re.S,
+)
+# printable runs, or a single control character
+_RUN_RE = re.compile(r"[^\x00-\x1f\x7f]+|[\x00-\x1f\x7f]")
+# an ESC this close to the end of a chunk may be a sequence split across reads
+_CARRY_MAX = 64
+
+# "$ cmd", "/ # cmd", "root@c1:/app# cmd", "(venv) me@host:~$ cmd", "> cmd"
+_PROMPT_RE = re.compile(r"^(?:[^\s$#>]+ ){0,2}[^\s$#>]*[$#>] (?P<cmd>\S.*)$")
+
+
+class LineAssembler:
+    """Turn terminal output into (offset_ms, line) pairs.
+
+    Not a terminal emulator: full-screen programs (vim, top) come out as
+    fragments, but shell sessions read back the way they looked.
+    """
+
+    def __init__(self):
+        self._line = []
+        self._col = 0
+        self._t = None
+        self._carry = ""
+
+    def _put(self, text: str, t):
+        out = []
+        for m in _RUN_RE.finditer(text):
+            run = m.group()
+            ch = run[0]
+            if ch == "\n":
+                out.append(self._emit())
+            elif ch == "\r":
+                self._col = 0
+            elif ch == "\b":
+                self._col = max(0, self._col - 1)
+            elif ch == "\t":
+                self._move((self._col // 8 + 1) * 8)
+            elif ch < " " or ch == "\x7f":
+                continue
+            elif self._col < MAX_LINE_CHARS:
+                if self._t is None:
+                    self._t = t
+                col = self._col
+                run = run[:MAX_LINE_CHARS - col]
+                # overwrite in place (\r redraws), append past the end
+                self._line[col:col + len(run)] = run
+                self._col = col + len(run)
+        return out
+
+    def _move(self, col: int):
+        self._col = min(MAX_LINE_CHARS, max(0, col))
+        if len(self._line) < self._col:
+            self._line.extend(" " * (self._col - len(self._line)))
+
+    def _csi(self, params: str, final: str):
+        n = int(params) if params.isdigit() else 1
+        if final == "K":
+            # erase in line: 0 = to end, 1 = to cursor, 2 = whole line
+            if params in ("", "0"):
+                del self._line[self._col:]
+            elif params == "1":
+                self._line[:self._col] = [" "] * min(self._col, len(self._line))
+            elif params == "2":
+                self._line.clear()
+        elif final == "D":
+            self._col = max(0, self._col - n)
+        elif final == "C":
+            self._move(self._col + n)
+        elif final == "G":
+            self._move(n - 1)
+        elif final == "P":
+            # delete characters (readline backspace in the middle of a line)
+            del self._line[self._col:self._col + n]
+        elif final == "@":
+            self._line[self._col:self._col] = [" "] * n
+
+    def _emit(self):
+        text = "".join(self._line).rstrip()
+        t = self._t
+        self._line = []
+        self._col = 0
+        self._t = None
+        return (t, text)
+
+    def feed(self, text: str, t=None):
+        """Consume output; t is seconds from session start (None if unknown)."""
+        text = self._carry + text
+        self._carry = ""
+        out = []
+        for m in _TOKEN_RE.finditer(text):
+            if m.group("text") is not None:
+                out.extend(self._put(m.group("text"), t))
+            elif m.group("final") is not None:
+                self._csi(m.group("params"), m.group("final"))
+            elif m.group() == "\x1b" and len(text) - m.start() <= _CARRY_MAX:
+                # incomplete sequence; finish it with the next chunk
+                self._carry = text[m.start():]
+                break
+        return [line for line in out if line[1]]
+
+    def finish(self):
+        self._carry = ""
+        last = self._emit()
+        return [last] if last[1] else []
+
+
+def command_of(line: str) -> str:
+    m = _PROMPT_RE.match(line)
+    return m.group("cmd").strip() if m else ""
+
+
+def extract_lines(path: str):
+    """Yield (offset_ms or None, command, text) for every line of a recording."""
+    asm = LineAssembler()
+
+    def _rows(lines):
+        for t, text in lines:
+            yield (None if t is None else int(t * 1000), command_of(text), text)
+
+    with Recording(path) as rec:
+        if rec.timed:
+            for t, _, data in rec.events():
+                yield from _rows(asm.feed(data.decode("utf-8", "replace"), t))
+        else:
+            for chunk in rec.iter_raw():
+                yield from _rows(asm.feed(bytes(chunk).decode("utf-8", "replace")))
+    yield from _rows(asm.finish())
+
+
+def _rowid(log_id: int, line_no: int) -> int:
+    return (log_id << LINE_BITS) | line_no
+
+
+def ensure_table(conn) -> bool:
+    """Create session_text if needed; False if SQLite has no FTS5."""
+    global _table_path
+    if _table_path == db.DB_PATH:
+        return True
+    try:
+        conn.execute(SESSION_TEXT_DDL)
+    except sqlite3.OperationalError as e:
+        if "no such module" in str(e):
+            return False
+        raise
+    _table_path = db.DB_PATH
+    return True
+
+
+def _require_table(conn):
+    if not ensure_table(conn):
+        raise sqlite3.OperationalError(NO_FTS5)
+
+
+def _clear(conn, log_id: int):
+    if not ensure_table(conn):
+        # nothing can have been indexed
+        return
+    conn.execute("DELETE FROM session_text WHERE rowid BETWEEN ? AND ?",
+                 (_rowid(log_id, 0), _rowid(log_id, MAX_LINES)))
+
+
+def index_session(log_id: int, path: str) -> int:
+    """(Re)index one recording and return the number of lines stored.
+
+    Rows are written in batches of BATCH_ROWS so the write lock is never
+    held for a whole long session; the session only counts as indexed once
+    its session_index_state row exists, so an interrupted run is redone.
+    """
+    init_db()
+    _require_table(connection())
+    with transaction(immediate=True) as conn:
+        conn.execute("DELETE FROM session_index_state WHERE log_id = ?", (log_id,))
+        _clear(conn, log_id)
+
+    n = 0
+    batch = []
+
+    def _flush():
+        with transaction(immediate=True) as conn:
+            conn.executemany(
+                "INSERT INTO session_text (rowid, command, text, offset_ms) VALUES (?, ?, ?, ?)", batch
+            )
+        batch.clear()
+
+    try:
+        for offset_ms, command, text in extract_lines(path):
+            if n >= MAX_LINES:
+                break
+            batch.append((_rowid(log_id, n), command, text, offset_ms))
+            n += 1
+            if len(batch) >= BATCH_ROWS:
+                _flush()
+    except FileNotFoundError:
+        print(f"session {log_id}: recording {path} is missing", file=sys.stderr)
+    if batch:
+        _flush()
+    with transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO session_index_state (log_id, lines) VALUES (?, ?)", (log_id, n))
+    return n
+
+
+def pending_sessions(limit: int = 1000):
+    """Ended sessions that have not been indexed yet, oldest first."""
+    init_db()
+    return connection().execute(
+        """SELECT a.id, a.typescript_path FROM access_logs a
+           LEFT JOIN session_index_state s ON s.log_id = a.id
+           WHERE a.ts_end IS NOT NULL AND s.log_id IS NULL
+           ORDER BY a.id LIMIT ?""",
+        (limit,),
+    ).fetchall()
+
+
+def index_pending(batch: int = 1000) -> tuple[int, int]:
+    """Index every pending session; returns (sessions, lines)."""
+    sessions = lines = 0
+    while True:
+        rows = pending_sessions(batch)
+        if not rows:
+            return sessions, lines
+        for row in rows:
+            lines += index_session(row["id"], row["typescript_path"])
+            sessions += 1
+
+
+def index_in_background(log_id: int):
+    """Index a just-ended session in a detached process (the user is not kept waiting)."""
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "index", "--id", str(log_id)],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True, close_fds=True,
+    )
+
+
+def phrase(query: str) -> str:
+    """Quote free text as one FTS5 phrase (so `rm -rf` is not query syntax)."""
+    return '"' + query.replace('"', '""') + '"'
+
+
+def search(match: str, *, commands_only: bool = False, username: str | None = None,
+           container: str | None = None, since: str | None = None, until: str | None = None,
+           limit: int = 50):
+    """Matching lines as dicts, newest session first, in session order within one.
+
+    match is an FTS5 query expression (see phrase()). Filters apply to the
+    session's access_logs row.
+    """
+    init_db()
+    _require_table(connection())
+    if commands_only:
+        match = f"command : ({match})"
+    where = ["session_text MATCH ?"]
+    params = [match]
+    for clause, value in (("a.username = ?", username), ("a.container_name = ?", container),
+                          ("a.ts_start >= ?", since), ("a.ts_start < ?", until)):
+        if value is not None:
+            where.append(clause)
+            params.append(value)
+    rows = connection().execute(
+        f"""SELECT s.rowid AS rid, s.offset_ms, s.command, s.text,
+                   a.id AS log_id, a.username, a.container_name, a.ts_start, a.typescript_path
+            FROM session_text s JOIN access_logs a ON a.id = s.rowid >> {LINE_BITS}
+            WHERE {" AND ".join(where)}
+            ORDER BY s.rowid DESC LIMIT ?""",
+        (*params, limit),
+    ).fetchall()
+    rows.sort(key=lambda r: (-r["log_id"], r["rid"]))
+    return [dict(r) for r in rows]
+
+
+def _format_offset(ms) -> str:
+    if ms is None:
+        return "-"
+    s, ms = divmod(int(ms), 1000)
+    return f"{s // 3600}:{s // 60 % 60:02d}:{s % 60:02d}.{ms:03d}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-text index and search over recorded sessions")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_idx = sub.add_parser("index", help="Index ended sessions that are not indexed yet")
+    p_idx.add_argument("--id", type=int, help="(Re)index only this access_logs id")
+    p_idx.add_argument("--rebuild", action="store_true", help="Forget the whole index and index everything again")
+    p_s = sub.add_parser("search", help="Find sessions containing a command or output text")
+    p_s.add_argument("query", help="Text to find (a phrase), or an FTS5 expression with --match")
+    p_s.add_argument("--match", action="store_true", help="Treat query as FTS5 syntax (AND/OR/NOT, prefix*, NEAR)")
+    p_s.add_argument("--commands", action="store_true", help="Only match typed commands, not output")
+    p_s.add_argument("--user")
+    p_s.add_argument("--container")
+    p_s.add_argument("--since", help="Sessions started at/after this time (YYYY-MM-DD[ HH:MM:SS], UTC)")
+    p_s.add_argument("--until", help="Sessions started before this time")
+    p_s.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    init_db()
+    if not ensure_table(connection()):
+        print(f"Error: {NO_FTS5}")
+        sys.exit(1)
+
+    if args.cmd == "index":
+        if args.id is not None:
+            init_db()
+            row = connection().execute(
+                "SELECT typescript_path FROM access_logs WHERE id = ?", (args.id,)
+            ).fetchone()
+            if row is None:
+                print(f"No session with id {args.id}")
+                sys.exit(1)
+            print(f"session {args.id}: {index_session(args.id, row['typescript_path'])} lines indexed")
+            return
+        if args.rebuild:
+            init_db()
+            with transaction(immediate=True) as conn:
+                conn.execute("DELETE FROM session_text")
+                conn.execute("DELETE FROM session_index_state")
+        sessions, lines = index_pending()
+        print(f"{sessions} sessions, {lines} lines indexed")
+        return
+
+    try:
+        results = search(args.query if args.match else phrase(args.query), commands_only=args.commands,
+                         username=args.user, container=args.container, since=args.since,
+                         until=args.until, limit=args.limit)
+    except sqlite3.OperationalError as e:
+        print(f"Invalid search: {e}")
+        sys.exit(2)
+    if not results:
+        print("(no matches)")
+        return
+    for r in results:
+        print(f"#{r['log_id']} {r['ts_start']} {r['username']}@{r['container_name']} "
+              f"+{_format_offset(r['offset_ms'])} ({r['offset_ms'] if r['offset_ms'] is not None else '-'} ms)  "
+              f"{r['text']}")
+    if len(results) == args.limit:
+        print(f"(showing {args.limit}; narrow the search or raise --limit)")
+
+
+if __name__ == "__main__":
+    main()
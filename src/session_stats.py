@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Container resource usage sampled over a session.
+
+ContainerStatsSampler asks the Docker stats API for a one-shot sample when
+the session starts, every STATS_INTERVAL seconds while it runs and once
+more when it ends. From those it derives the container's CPU time spent
+during the session and its memory usage (peak, and end minus start). The
+numbers are for the whole container, not just the session's processes.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+
+# Seconds between Docker stats samples during a session. 0 (default) =
+# don't sample: sampling loads the Docker SDK and runs a thread in every
+# session, also with SCAM_EXEC_BACKEND=cli
+STATS_INTERVAL = float(os.environ.get("SCAM_STATS_INTERVAL", "0") or 0)
+
+
+def _cpu_ns(sample: dict):
+    return ((sample.get("cpu_stats") or {}).get("cpu_usage") or {}).get("total_usage")
+
+
+def _mem_bytes(sample: dict):
+    """Memory in use as `docker stats` shows it (page cache that can be dropped excluded)."""
+    mem = sample.get("memory_stats") or {}
+    usage = mem.get("usage")
+    if usage is None:
+        return None
+    extra = mem.get("stats") or {}
+    # cgroup v2 / cgroup v1
+    inactive = extra.get("inactive_file", extra.get("total_inactive_file", 0))
+    return max(0, usage - inactive)
+
+
+class ContainerStatsSampler:
+    """Background sampler for one container; start() then stop() -> access_logs columns."""
+
+    def __init__(self, api, container: str, interval: float = STATS_INTERVAL):
+        self.api = api
+        self.container = container
+        self.interval = interval
+        self.samples = 0
+        self._first_cpu = self._last_cpu = None
+        self._first_mem = self._last_mem = None
+        self._peak_mem = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        try:
+            sample = self.api.stats(self.container, stream=False, one_shot=True)
+        except Exception:
+            # daemon hiccup or container gone; keep what we have
+            return
+        cpu, mem = _cpu_ns(sample), _mem_bytes(sample)
+        if cpu is not None:
+            if self._first_cpu is None:
+                self._first_cpu = cpu
+            self._last_cpu = cpu
+        if mem is not None:
+            if self._first_mem is None:
+                self._first_mem = mem
+            self._last_mem = mem
+            self._peak_mem = mem if self._peak_mem is None else max(self._peak_mem, mem)
+        self.samples += 1
+
+    def _run(self):
+        self._sample()
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        if self.interval <= 0:
+            return self
+        self._thread = threading.Thread(target=self._run, name="container-stats", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> dict:
+        """Take a final sample and return cpu_ms, mem_peak_bytes, mem_delta_bytes (None if unknown)."""
+        if self._thread is None:
+            return {}
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        out = {"cpu_ms": None, "mem_peak_bytes": self._peak_mem, "mem_delta_bytes": None}
+        if self._first_cpu is not None:
+            out["cpu_ms"] = (self._last_cpu - self._first_cpu) // 1_000_000
+        if self._first_mem is not None:
+            out["mem_delta_bytes"] = self._last_mem - self._first_mem
+        return out
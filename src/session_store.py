@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""Where session recordings live on disk.
+
+Recordings are sharded by session start date (UTC) and container:
+
+    TYPESCRIPT_DIR/YYYY/MM/DD/<container>/<container>_<user>_<YYYYmmddHHMMSS>.cast.gz
+
+so no directory grows past one container-day of sessions. Earlier versions
+wrote every recording straight into TYPESCRIPT_DIR; `migrate` moves those
+into their shard and rewrites access_logs.typescript_path.
+
+    sudo python3 src/session_store.py migrate --dry-run
+    sudo python3 src/session_store.py migrate
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from datetime import datetime, timezone
+
+from db import init_db, connection, transaction
+from recorder import INDEX_SUFFIX
+
+# System-wide session recording path
+TYPESCRIPT_DIR = "/var/log/secure-container-access/sessions"
+BATCH = 500
+
+
+def safe_name(text: str) -> str:
+    return "".join(ch if (ch.isalnum() or ch in "-_.") else "_" for ch in text)
+
+
+def shard_dir(container_name: str, when: datetime) -> str:
+    return os.path.join(TYPESCRIPT_DIR, when.strftime("%Y"), when.strftime("%m"), when.strftime("%d"),
+                        safe_name(container_name))
+
+
+def session_path(container_name: str, username: str, ext: str = ".log", when: datetime | None = None) -> str:
+    """Path for a new recording; creates its shard directory."""
+    when = when or datetime.now(timezone.utc)
+    directory = shard_dir(container_name, when)
+    os.makedirs(directory, mode=0o750, exist_ok=True)
+    name = f"{safe_name(f'{container_name}_{username}')}_{when.strftime('%Y%m%d%H%M%S')}{ext}"
+    return os.path.join(directory, name)
+
+
+def _rename(src: str, dst: str) -> bool:
+    """Move src to dst; True if dst holds the file afterwards (also when already moved)."""
+    try:
+        os.rename(src, dst)
+    except FileNotFoundError:
+        return os.path.exists(dst)
+    return True
+
+
+def migrate_flat_layout(*, batch: int = BATCH, dry_run: bool = False) -> tuple[int, int]:
+    """Move recordings that sit directly in TYPESCRIPT_DIR into their shards.
+
+    Driven by access_logs in keyset batches. Files are renamed first and the
+    rows of a batch are updated in one transaction afterwards; a rerun after
+    a crash finds the file already in place and just fixes the row. Open
+    sessions are left alone. Returns (moved, missing).
+    """
+    init_db()
+    prefix = TYPESCRIPT_DIR.rstrip("/") + "/"
+    moved = missing = 0
+    after = 0
+    made = set()
+    while True:
+        rows = connection().execute(
+            """SELECT id, container_name, ts_start, typescript_path FROM access_logs
+               WHERE id > ? AND ts_end IS NOT NULL
+                 AND substr(typescript_path, 1, ?) = ? AND instr(substr(typescript_path, ?), '/') = 0
+               ORDER BY id LIMIT ?""",
+            (after, len(prefix), prefix, len(prefix) + 1, batch),
+        ).fetchall()
+        if not rows:
+            return moved, missing
+        after = rows[-1]["id"]
+        updates = []
+        for row in rows:
+            old = row["typescript_path"]
+            when = datetime.strptime(str(row["ts_start"])[:19], "%Y-%m-%d %H:%M:%S")
+            directory = shard_dir(row["container_name"], when)
+            new = os.path.join(directory, os.path.basename(old))
+            if dry_run:
+                if os.path.exists(old):
+                    moved += 1
+                else:
+                    missing += 1
+                continue
+            if not os.path.exists(old) and not os.path.exists(new):
+                missing += 1
+                continue
+            if directory not in made:
+                os.makedirs(directory, mode=0o750, exist_ok=True)
+                made.add(directory)
+            if not _rename(old, new):
+                missing += 1
+                continue
+            _rename(old + INDEX_SUFFIX, new + INDEX_SUFFIX)
+            updates.append((new, row["id"], old))
+        if updates:
+            with transaction(immediate=True) as conn:
+                conn.executemany(
+                    "UPDATE access_logs SET typescript_path = ? WHERE id = ? AND typescript_path = ?", updates
+                )
+            moved += len(updates)
+
+
+def flat_leftovers() -> int:
+    """Files still sitting directly in TYPESCRIPT_DIR."""
+    try:
+        with os.scandir(TYPESCRIPT_DIR) as it:
+            return sum(1 for e in it if e.is_file(follow_symlinks=False))
+    except FileNotFoundError:
+        return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Session recording layout")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_mig = sub.add_parser("migrate", help=f"Move flat recordings in {TYPESCRIPT_DIR} into date/container shards")
+    p_mig.add_argument("--batch", type=int, default=BATCH, help="access_logs rows per transaction")
+    p_mig.add_argument("--dry-run", action="store_true", help="Only count what would be moved")
+    args = parser.parse_args()
+
+    if args.cmd == "migrate":
+        moved, missing = migrate_flat_layout(batch=args.batch, dry_run=args.dry_run)
+        verb = "would move" if args.dry_run else "moved"
+        print(f"{verb} {moved} recordings; {missing} referenced files missing")
+        left = flat_leftovers()
+        if left and not args.dry_run:
+            print(f"{left} files left in {TYPESCRIPT_DIR} (open sessions or not in access_logs)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 import argparse
+import csv
 import getpass
+import json
+import sys
+import time
 
-from accounts import create_user, list_users
+from accounts import create_user, create_users_bulk, get_auth_engine, iter_users
 
 
 def prompt_create() -> bool:
@@ -14,29 +20,144 @@ def prompt_create() -> bool:
     return ok
 
 
-def _print_users(users: list[tuple[str, str]]):
-    if not users:
-        print("(none)")
+def print_users(role: str, *, prefix: str | None = None, after: str | None = None,
+                limit: int | None = None, empty: str = "(none)"):
+    """Print one page of users with role, streaming rows as they arrive.
+
+    One row past limit is fetched: it is not printed, it only tells whether
+    to show the --after hint for the next page. Shared with admin.py list.
+    """
+    n = 0
+    last = None
+    more = False
+    fetch = None if limit is None else limit + 1
+    for username, role in iter_users(role=role, prefix=prefix, after=after, limit=fetch):
+        if n == limit:
+            more = True
+            break
+        print(f"- {username} ({role})", flush=True)
+        n += 1
+        last = username
+    if n == 0:
+        print(empty)
+    elif more:
+        print(f"(showing {n}; continue with --after {last})")
+
+
+def _add_list_args(p):
+    p.add_argument("--limit", type=int, help="Show at most N users")
+    p.add_argument("--after", help="Resume after this username (keyset cursor)")
+    p.add_argument("--prefix", help="Only usernames starting with this prefix")
+
+
+def _read_records(f, fmt: str):
+    """Yield (line_no, username, password, role, error) from a CSV or JSONL stream.
+
+    CSV needs a header with 'username' and 'password' columns ('role' is
+    optional). JSONL has one object per line with the same keys. Lines that
+    cannot be parsed, or whose fields are not strings, are yielded with an
+    error message so they are reported as per-row errors instead of
+    stopping the import.
+    """
+    if fmt == "jsonl":
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                obj = json.loads(line)
+            except ValueError:
+                yield line_no, None, None, None, "Not valid JSON."
+                continue
+            if not isinstance(obj, dict):
+                yield line_no, None, None, None, "Not a JSON object."
+                continue
+            fields = [obj.get(k) for k in ("username", "password", "role")]
+            bad = [k for k, v in zip(("username", "password", "role"), fields)
+                   if v is not None and not isinstance(v, str)]
+            if bad:
+                username = fields[0] if isinstance(fields[0], str) else None
+                yield line_no, username, None, None, f"Not a string: {', '.join(bad)}."
+                continue
+            yield (line_no, *fields, None)
         return
-    for username, role in users:
-        print(f"- {username} ({role})")
+
+    reader = csv.DictReader(f)
+    missing = {"username", "password"} - set(reader.fieldnames or [])
+    if missing:
+        raise ValueError(f"CSV header is missing: {', '.join(sorted(missing))}")
+    for row in reader:
+        yield reader.line_num, row.get("username"), row.get("password"), row.get("role") or None, None
+
+
+def _detect_format(path: str, f) -> str:
+    if path.endswith(".jsonl") or path.endswith(".ndjson"):
+        return "jsonl"
+    if path.endswith(".csv"):
+        return "csv"
+    # stdin / unknown extension: peek at the first character
+    head = f.buffer.peek(1)[:1] if hasattr(f, "buffer") and hasattr(f.buffer, "peek") else b""
+    return "jsonl" if head == b"{" else "csv"
+
+
+def import_users(path: str, fmt: str | None = None) -> bool:
+    """Bulk-create regular users from a CSV/JSONL file ('-' for stdin)."""
+    f = None
+    try:
+        f = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+        fmt = fmt or _detect_format(path, f)
+        t0 = time.perf_counter()
+        records = list(_read_records(f, fmt))
+    except (OSError, ValueError, csv.Error) as e:
+        print(f"Cannot read {path}: {e}")
+        return False
+    finally:
+        if f is not None and f is not sys.stdin:
+            f.close()
+
+    rejected = [(r[0], r[1], r[4]) for r in records if r[4] is not None]
+    records = [r[:4] for r in records if r[4] is None]
+    # only regular users may be imported here; admins go through admin.py
+    rejected += [(r[0], r[1], "Only role 'user' can be imported.") for r in records if r[3] not in (None, "user")]
+    records = [r for r in records if r[3] in (None, "user")]
+
+    print(f"Importing {len(records)} user(s) from {path} ({fmt})...")
+    created, errors = create_users_bulk(records, default_role="user")
+    errors = sorted(errors + rejected, key=lambda e: e[0])
+    elapsed = time.perf_counter() - t0
+
+    for line_no, username, msg in errors:
+        print(f"  line {line_no} ({username or '?'}): {msg}")
+
+    stats = get_auth_engine().stats()
+    rate = created / elapsed if elapsed > 0 else 0.0
+    print(f"Created {created}, failed {len(errors)} in {elapsed:.2f}s ({rate:.1f} users/s)")
+    print(f"bcrypt: {stats['workers']} worker(s), avg {stats['hash_cpu_avg'] * 1000:.0f} ms/hash")
+    return not errors
 
 
 def main():
     parser = argparse.ArgumentParser(description="Manage regular users")
     sub = parser.add_subparsers(dest="cmd", required=True)
 
-    sub.add_parser("list", help="List regular users")
+    p_list = sub.add_parser("list", help="List regular users")
+    _add_list_args(p_list)
     sub.add_parser("add", help="Add a regular user")
+    p_import = sub.add_parser("import", help="Bulk-create regular users from CSV/JSONL")
+    p_import.add_argument("path", nargs="?", default="-", help="Input file, '-' for stdin (default)")
+    p_import.add_argument("--format", choices=["csv", "jsonl"], help="Input format (default: detect)")
 
     args = parser.parse_args()
 
     if args.cmd == "list":
-        _print_users(list_users(role="user"))
+        print_users("user", prefix=args.prefix, after=args.after, limit=args.limit)
         return
     if args.cmd == "add":
         prompt_create()
         return
+    if args.cmd == "import":
+        if not import_users(args.path, args.format):
+            sys.exit(1)
+        return
 
 
 if __name__ == "__main__":